@@ -15,11 +15,24 @@ db = SQLAlchemy()
 
 def create_app(environment='development'):
     from config import config
+    from .filters import humanize_number
     from .views import main_blueprint
     from .auth.views import auth_blueprint
     from .settings.views import settings_blueprint
     from .links.views import links_blueprint
+    from .links.agents import user_agent_classifier
+    from .links.allocator import link_allocator
+    from .links.cache import route_cache
+    from .links.charts import chart_cache
+    from .links.expiration import expiration_sweeper
+    from .links.sampling import request_sampler
+    from .links.shared import route_invalidation, shared_route_cache
+    from .links.snapshot import route_snapshot
+    from .links.tracking import request_logger
     from .auth.models import User, AnonymousUser
+    from .metrics import request_metrics
+    from .pool import pool_monitor
+    from .profiler import request_profiler
 
     # Setup configuration
     dictConfig({
@@ -40,8 +53,7 @@ def create_app(environment='development'):
 
     # Instantiate app.
     app = Flask(__name__)
-    with app.app_context():
-        from .filters import humanize_number # noqa
+    app.add_template_filter(humanize_number)
 
     # Compile the SASS
     dirname = ('app/static/sass', 'app/static/css')
@@ -58,6 +70,19 @@ def create_app(environment='development'):
     # Set up extensions.
     db.init_app(app)
     login_manager.init_app(app)
+    route_cache.init_app(app)
+    chart_cache.init_app(app)
+    route_snapshot.init_app(app)
+    shared_route_cache.init_app(app)
+    route_invalidation.init_app(app)
+    expiration_sweeper.init_app(app)
+    user_agent_classifier.init_app(app)
+    request_logger.init_app(app)
+    request_sampler.init_app(app)
+    link_allocator.init_app(app)
+    pool_monitor.init_app(app)
+    request_metrics.init_app(app)
+    request_profiler.init_app(app)
 
     # Register blueprints.
     app.register_blueprint(links_blueprint)
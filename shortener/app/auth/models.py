@@ -27,18 +27,25 @@ class User(db.Model, UserMixin, ModelMixin):
     def password(self, password: str):
         self.password_hash = generate_password_hash(password)
 
-    def links(self) -> list:
-        """[summary]
+    def link_query(self):
+        """The links that the user is able to manage. Admins are able to
+        manage every link.
 
         Returns:
-            list: [description]
+            BaseQuery: a query instance that can include further filters.
         """
         if self.is_admin:
-            query = models.Link.query
-        else:
-            query = models.Link.find_by_user_id(self.id)
+            return models.Link.query
+
+        return models.Link.find_by_user_id(self.id)
+
+    def links(self) -> list:
+        """The links that the user is able to manage, active links first.
 
-        return query.order_by(models.Link.activated.desc()).all()
+        Returns:
+            list: a list of Link objects.
+        """
+        return self.link_query().order_by(models.Link.activated.desc()).all()
 
     @classmethod
     def authenticate(cls, user_id, password):
@@ -4,7 +4,6 @@ from flask import current_app
 UNITS = ['', 'K', 'M', 'B']
 
 
-@current_app.template_filter()
 def humanize_number(string: str) -> str:
     """Convert a standard integer into a human readable value.
 
@@ -0,0 +1,178 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+Agent = namedtuple('Agent', [
+    'browser', 'browser_version', 'os_name', 'os_version', 'platform',
+    'is_bot'
+])
+
+PLATFORM_RULES = (
+    (' cros ', 'chromeos'),
+    ('iphone|ios', 'iphone'),
+    ('ipad', 'ipad'),
+    (r'darwin\b|mac\b|os\s*x', 'macos'),
+    ('win', 'windows'),
+    ('android', 'android'),
+    ('netbsd', 'netbsd'),
+    ('openbsd', 'openbsd'),
+    ('freebsd', 'freebsd'),
+    (r'x11\b|lin(\b|ux)?', 'linux'),
+    ('blackberry|playbook', 'blackberry'),
+)
+
+BROWSER_RULES = (
+    ('googlebot', 'google'),
+    ('msnbot', 'msn'),
+    ('bingbot', 'bing'),
+    ('baiduspider', 'baidu'),
+    ('yahoo', 'yahoo'),
+    (r'opera|opr', 'opera'),
+    ('edge|edg', 'edge'),
+    ('chrome|crios', 'chrome'),
+    ('seamonkey', 'seamonkey'),
+    ('firefox|firebird|phoenix|iceweasel', 'firefox'),
+    ('safari|version', 'safari'),
+    ('webkit', 'webkit'),
+    ('konqueror', 'konqueror'),
+    (r'msie|microsoft\s+internet\s+explorer|trident/.+? rv:', 'msie'),
+    ('lynx', 'lynx'),
+    ('mozilla', 'mozilla'),
+)
+
+# Case-insensitive patterns that identify automated clients. Extend with the
+# BOT_SIGNATURES configuration value.
+BOT_SIGNATURES = (
+    r'bot\b', 'crawler', 'crawling', 'spider', 'slurp', 'archiver',
+    'facebookexternalhit', 'embedly', 'preview', 'headless', 'lighthouse',
+    'pingdom', 'uptime', 'monitor', 'scanner', r'^curl/', r'^wget/',
+    r'^python-', r'^go-http-client', r'^java/', r'^okhttp', 'httpclient',
+)
+
+PLATFORMS = tuple(
+    (platform, re.compile(pattern, re.I))
+    for pattern, platform in PLATFORM_RULES)
+BROWSERS = tuple(
+    (browser, re.compile(
+        rf'(?:{ pattern })[/\sa-z(]*(\d+[.\da-z]+)?', re.I))
+    for pattern, browser in BROWSER_RULES)
+TRIDENT = re.compile(r'trident/.+? rv:', re.I)
+OPERATING_SYSTEM = re.compile(r'\(([\w\.\s]+);\s([\w\.\s]+)')
+MAJOR_VERSION = re.compile(r'\d+')
+
+
+class UserAgentClassifier(object):
+    """Parses user agent strings into structured information, and decides
+    whether they belong to bots. Real traffic has very few distinct user
+    agents, so results are held in a bounded LRU cache keyed on the raw
+    string; a repeated user agent costs a dictionary lookup.
+    """
+
+    def __init__(self, cache_size: int = 4096,
+                 bot_signatures: tuple = BOT_SIGNATURES):
+        self.configure(cache_size, bot_signatures)
+
+    def init_app(self, app):
+        """Configure the classifier using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        signatures = BOT_SIGNATURES \
+            + tuple(app.config.get('BOT_SIGNATURES', ()))
+        self.configure(
+            app.config.get('USER_AGENT_CACHE_SIZE', self.cache_size),
+            signatures)
+
+        app.extensions['user_agent_classifier'] = self
+
+    def configure(self, cache_size: int, bot_signatures: tuple):
+        """Replace the cache size and bot signatures, clearing the cache.
+
+        Args:
+            cache_size (int): the number of user agents to cache.
+            bot_signatures (tuple): regular expressions matching bots.
+        """
+        self.cache_size = cache_size
+        self.bot_signatures = tuple(bot_signatures)
+        self.bots = re.compile('|'.join(
+            f'(?:{ signature })' for signature in self.bot_signatures), re.I)
+        self.classify = lru_cache(maxsize=cache_size)(self.parse)
+
+    def parse(self, string: str) -> Agent:
+        """Extract structured information from a user agent string, without
+        consulting the cache.
+
+        Args:
+            string (str): the raw user agent string.
+
+        Returns:
+            Agent: the browser, browser_version (major version only),
+                os_name, os_version, platform and is_bot values.
+        """
+        if not string:
+            return Agent(None, None, None, None, None, False)
+
+        for platform, expression in PLATFORMS:
+            if expression.search(string):
+                break
+        else:
+            platform = None
+
+        # Except for Trident, browser key words come after the last ')'
+        position = 0
+        if ')' in string and string[-1] != ')' \
+                and not TRIDENT.search(string):
+            position = string.rindex(')')
+
+        browser = version = None
+        for name, expression in BROWSERS:
+            match = expression.search(string, position)
+            if match:
+                browser = name
+                major = MAJOR_VERSION.match(match.group(1) or '')
+                version = int(major.group(0)) if major else None
+                break
+
+        # Pull extended information from the user agent string
+        os_name = os_version = None
+        if string.startswith('Mozilla/5.0'):
+            match = OPERATING_SYSTEM.search(string)
+            if match:
+                os_name, os_version = match.group(1)[:50], match.group(2)[:50]
+
+        is_bot = self.bots.search(string) is not None
+        return Agent(browser, version, os_name, os_version, platform, is_bot)
+
+    def stats(self) -> dict:
+        """Counters that describe how well the cache is performing.
+
+        Returns:
+            dict: the current counters, alongside the cache size.
+        """
+        info = self.classify.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_ratio': info.hits / lookups if lookups else 0.0,
+            'bot_signatures': len(self.bot_signatures),
+        }
+
+
+user_agent_classifier = UserAgentClassifier()
+
+
+def parse_user_agent(string: str) -> Agent:
+    """Classify a user agent string, using the shared, cached classifier.
+
+    Args:
+        string (str): the raw user agent string.
+
+    Returns:
+        Agent: the structured information for the user agent.
+    """
+    return user_agent_classifier.classify(string)
@@ -0,0 +1,302 @@
+import os
+from hashlib import blake2b, sha256
+from random import choice
+from threading import Lock
+
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from .models import Link, LinkSequence
+
+
+class SequenceAllocator(object):
+    """Allocates links from a counter, kept per link size in the
+    'link_sequences' table. Each process reserves a block of counter values at
+    a time, so most allocations never touch the counter. Counter values are
+    passed through a keyed permutation before being encoded with
+    Link.VALID_CHARS, so consecutive links do not look alike, while distinct
+    values are still guaranteed to give distinct links.
+
+    Once the counter for a size passes the occupancy threshold, allocation
+    moves on to links that are one character longer.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size: int = Link.LINK_SIZE, block_size: int = 100,
+                 threshold: float = 0.5, key: str = 'shortener'):
+        self.size = size
+        self.block_size = block_size
+        self.threshold = threshold
+        self.key = sha256(key.encode()).digest()
+
+        self._lock = Lock()
+        self._pid = None
+        self._block = iter(())
+        self._block_size = size
+        self.reset_stats()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(
+            size=config.get('LINK_SIZE', Link.LINK_SIZE),
+            block_size=config.get('LINK_ALLOCATOR_BLOCK_SIZE', 100),
+            threshold=config.get('LINK_ALLOCATOR_THRESHOLD', 0.5),
+            key=config.get('LINK_ALLOCATOR_KEY') or 'shortener')
+
+    def allocate(self) -> str:
+        """Allocate a link that is not in use.
+
+        Returns:
+            str: the allocated link.
+        """
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list:
+        """Allocate links that are not in use. Links chosen by users may take
+        a value from the sequence, so the values are checked in a single query
+        before they are handed out; taken values are skipped rather than
+        retried.
+
+        Args:
+            count (int): the number of links to allocate.
+
+        Returns:
+            list: the allocated links.
+        """
+        links = []
+        while len(links) < count:
+            candidates = [self._next() for _ in range(count - len(links))]
+            taken = Link.active_links(candidates)
+            links.extend(link for link in candidates if link not in taken)
+
+            with self._lock:
+                self.collisions += len(taken)
+
+        return links
+
+    def encode(self, value: int, size: int) -> str:
+        """Encode a counter value as a link of the given size.
+
+        Args:
+            value (int): a counter value, below len(Link.VALID_CHARS) ** size.
+            size (int): the number of characters in the link.
+
+        Returns:
+            str: the link for the counter value.
+        """
+        value = self.permute(value, size)
+        chars = []
+        for _ in range(size):
+            value, index = divmod(value, len(Link.VALID_CHARS))
+            chars.append(Link.VALID_CHARS[index])
+        return ''.join(chars)
+
+    def permute(self, value: int, size: int) -> int:
+        """A bijection over the values that fit in a link of the given size,
+        using a balanced Feistel network keyed on LINK_ALLOCATOR_KEY. Every
+        character encodes 6 bits, so each half of the network holds 3 bits per
+        character.
+        """
+        half = 3 * size
+        mask = (1 << half) - 1
+        left, right = value >> half, value & mask
+        for index in range(self.ROUNDS):
+            left, right = right, left ^ self._round(index, size, right, mask)
+        return (left << half) | right
+
+    def _round(self, index: int, size: int, value: int, mask: int) -> int:
+        digest = blake2b(
+            f'{ size }:{ index }:{ value }'.encode(),
+            digest_size=8, key=self.key).digest()
+        return int.from_bytes(digest, 'big') & mask
+
+    def _next(self) -> str:
+        with self._lock:
+            # A reserved block must not be shared with forked processes.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._block = iter(())
+
+            value = next(self._block, None)
+            if value is None:
+                self._block_size, block = self._reserve()
+                self._block = iter(block)
+                value = next(self._block)
+                self.reservations += 1
+
+            self.allocated += 1
+            return self.encode(value, self._block_size)
+
+    def _reserve(self) -> tuple:
+        """Reserve the next block of counter values, growing the link size
+        once the current size is past the occupancy threshold.
+
+        Returns:
+            tuple: the link size, and a range of counter values.
+        """
+        while True:
+            size = self.size
+            limit = int(len(Link.VALID_CHARS) ** size * self.threshold)
+
+            try:
+                with db.engine.begin() as connection:
+                    start = self._advance(connection, size)
+            except IntegrityError:
+                # Another process created the sequence for this size first.
+                continue
+
+            if start < limit:
+                return size, range(start, min(start + self.block_size, limit))
+            self.size = size + 1
+
+    def _advance(self, connection, size: int) -> int:
+        """Move the counter for a size forward by a block, returning the start
+        of the block.
+        """
+        table = LinkSequence.__table__
+        update = table.update() \
+            .where(table.c.size == size) \
+            .values(next_value=table.c.next_value + self.block_size)
+
+        if connection.dialect.full_returning:
+            value = connection.execute(
+                update.returning(table.c.next_value)).scalar()
+            if value is not None:
+                return value - self.block_size
+        elif connection.execute(update).rowcount:
+            value = connection.execute(
+                db.select(table.c.next_value).where(table.c.size == size)
+            ).scalar()
+            return value - self.block_size
+
+        connection.execute(
+            table.insert().values(size=size, next_value=self.block_size))
+        return 0
+
+    def reset_stats(self):
+        self.allocated = 0
+        self.collisions = 0
+        self.reservations = 0
+
+    def stats(self) -> dict:
+        return {
+            'allocator': 'sequence',
+            'size': self.size,
+            'block_size': self.block_size,
+            'allocated': self.allocated,
+            'collisions': self.collisions,
+            'reservations': self.reservations,
+        }
+
+
+class RandomAllocator(object):
+    """Allocates random links, checking them against the database. After a
+    number of consecutive rounds with collisions the links grow by one
+    character.
+    """
+
+    def __init__(self, size: int = Link.LINK_SIZE, attempts: int = 8):
+        self.size = size
+        self.attempts = attempts
+        self._lock = Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(
+            size=config.get('LINK_SIZE', Link.LINK_SIZE),
+            attempts=config.get('LINK_ALLOCATOR_ATTEMPTS', 8))
+
+    def allocate(self) -> str:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list:
+        links = set()
+        failures = 0
+        while len(links) < count:
+            size = self.size
+            candidates = {
+                ''.join(choice(Link.VALID_CHARS) for _ in range(size))
+                for _ in range(count - len(links))
+            } - links
+            taken = Link.active_links(candidates)
+            links |= candidates - taken
+
+            with self._lock:
+                self.allocated += len(candidates)
+                self.collisions += len(taken)
+
+                failures = failures + 1 if taken else 0
+                if failures >= self.attempts:
+                    self.size = max(self.size, size + 1)
+                    failures = 0
+
+        return list(links)
+
+    def reset_stats(self):
+        self.allocated = 0
+        self.collisions = 0
+
+    def stats(self) -> dict:
+        return {
+            'allocator': 'random',
+            'size': self.size,
+            'allocated': self.allocated,
+            'collisions': self.collisions,
+        }
+
+
+ALLOCATORS = {
+    'sequence': SequenceAllocator,
+    'random': RandomAllocator,
+}
+
+
+class LinkAllocator(object):
+    """Hands out new links using the allocator named by the LINK_ALLOCATOR
+    configuration value. The value may also be a class, which must provide
+    from_config, allocate, allocate_many and stats.
+    """
+
+    def __init__(self):
+        self.allocator = SequenceAllocator()
+
+    def init_app(self, app):
+        """Configure the allocator using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        allocator = app.config.get('LINK_ALLOCATOR', 'sequence')
+        if isinstance(allocator, str):
+            allocator = ALLOCATORS[allocator]
+        self.allocator = allocator.from_config(app.config)
+
+        app.extensions['link_allocator'] = self
+
+    def allocate(self) -> str:
+        """Allocate a link that is not in use.
+
+        Returns:
+            str: the allocated link.
+        """
+        return self.allocator.allocate()
+
+    def allocate_many(self, count: int) -> list:
+        """Allocate a number of distinct links that are not in use, checking
+        them against the database together.
+
+        Args:
+            count (int): the number of links to allocate.
+
+        Returns:
+            list: the allocated links.
+        """
+        return self.allocator.allocate_many(count)
+
+    def stats(self) -> dict:
+        return self.allocator.stats()
+
+
+link_allocator = LinkAllocator()
@@ -0,0 +1,259 @@
+import csv
+import json
+import os
+from datetime import datetime
+from itertools import islice
+from urllib.parse import urlparse
+
+from dateutil import parser
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from .allocator import link_allocator
+from .charts import chart_cache
+from .expiration import expiration_sweeper
+from .models import Link
+from .sampling import ADAPTIVE
+from .shared import route_invalidation
+
+
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+MIMETYPES = {
+    'text/csv': 'csv',
+    'application/jsonl': 'jsonl',
+    'application/x-ndjson': 'jsonl',
+}
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'off')
+
+
+def detect_format(filename: str) -> str:
+    """Returns the import format for a file name, or None if the extension is
+    not recognised.
+    """
+    _, extension = os.path.splitext(filename or '')
+    return FORMATS.get(extension.lower())
+
+
+def read_rows(file, format: str):
+    """Stream rows from a CSV file with a header, or a JSON lines file. Both
+    use the columns 'redirect' (required), 'link', 'expiration', 'activated',
+    'track_requests' and 'sample_rate'.
+
+    Args:
+        file (file): a text file, opened with newline=''.
+        format (str): either 'csv' or 'jsonl'.
+
+    Yields:
+        tuple: the line number, the row as a dictionary (or None) and an error
+            message (or None) for rows that could not be read.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        try:
+            for row in reader:
+                yield reader.line_num, row, None
+        except csv.Error as exception:
+            yield reader.line_num, None, str(exception)
+        return
+
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exception:
+            yield number, None, f'Invalid JSON: { exception }'
+            continue
+
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, 'Each line must be a JSON object'
+
+
+def import_links(rows, user_id: int = None, batch_size: int = 1000):
+    """Create links from a stream of rows, a batch at a time. Requested links
+    are checked for conflicts with one query per batch, links are allocated
+    for the remaining rows together, and each batch is inserted with a single
+    executemany. Rows with errors are reported and skipped; they do not stop
+    the rest of their batch from being created.
+
+    Args:
+        rows (iterable): (line number, row, error) tuples, as returned by
+            read_rows.
+        user_id (int, optional): the owner of the new links. Defaults to None.
+        batch_size (int, optional): the number of rows handled per
+            transaction. Defaults to 1000.
+
+    Yields:
+        tuple: the number of links created and a list of (line number, error)
+            tuples, for each batch.
+    """
+    rows = iter(rows)
+    batch = list(islice(rows, batch_size))
+    while batch:
+        yield _import_batch(batch, user_id)
+        batch = list(islice(rows, batch_size))
+
+
+def _import_batch(batch: list, user_id: int) -> tuple:
+    values, errors = [], []
+    requested = {}
+    for number, row, error in batch:
+        if error is None:
+            try:
+                value = _parse(row)
+            except ValueError as exception:
+                error = str(exception)
+
+        if error is None and value['link'] and value['activated']:
+            if value['link'] in requested:
+                error = f'The link { value["link"] } is repeated on line ' \
+                    f'{ requested[value["link"]] }'
+            else:
+                requested[value['link']] = number
+
+        if error is None:
+            values.append((number, value))
+        else:
+            errors.append((number, error))
+
+    taken = Link.active_links(requested)
+    for number, value in values:
+        if value['activated'] and value['link'] in taken:
+            errors.append(
+                (number, f'The link { value["link"] } is already in use'))
+    values = [
+        (number, value) for number, value in values
+        if not (value['activated'] and value['link'] in taken)
+    ]
+
+    missing = [value for _, value in values if not value['link']]
+    links = link_allocator.allocate_many(len(missing))
+    for value, link in zip(missing, links):
+        value['link'] = link
+
+    for _, value in values:
+        value['user_id'] = user_id
+
+    created = _insert(values, errors)
+    route_invalidation.invalidate(*(value['link'] for _, value in values))
+    if created:
+        chart_cache.invalidate(chart_cache.LINKS)
+    for _, value in values:
+        if value['activated'] and value['expiration']:
+            expiration_sweeper.schedule(value['link'], value['expiration'])
+
+    return created, sorted(errors)
+
+
+def _insert(values: list, errors: list) -> int:
+    """Insert the batch together, falling back to one row at a time if a link
+    was taken by someone else since the batch was checked.
+    """
+    if not values:
+        return 0
+
+    insert = Link.__table__.insert()
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(insert, [value for _, value in values])
+        return len(values)
+    except IntegrityError:
+        pass
+
+    created = 0
+    for number, value in values:
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert, value)
+            created += 1
+        except IntegrityError:
+            errors.append(
+                (number, f'The link { value["link"] } is already in use'))
+
+    return created
+
+
+def _parse(row: dict) -> dict:
+    """Validate a row, returning the column values for a new link.
+
+    Raises:
+        ValueError: the row contains an invalid value.
+    """
+    row = {
+        key.strip().lower(): value.strip() if isinstance(value, str) else value
+        for key, value in row.items() if key
+    }
+
+    redirect = row.get('redirect')
+    if not redirect or not isinstance(redirect, str):
+        raise ValueError('A redirect is required')
+
+    parsed = urlparse(redirect)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc \
+            or len(redirect) > 500:
+        raise ValueError(f'The redirect { redirect } is not a valid URL')
+
+    link = row.get('link') or None
+    if link and not isinstance(link, str):
+        raise ValueError('The link must be a string')
+    if link and not all(char in Link.VALID_CHARS for char in link):
+        raise ValueError(f'The link { link } contains invalid characters')
+
+    expiration = row.get('expiration') or None
+    if expiration and not isinstance(expiration, datetime):
+        try:
+            expiration = parser.parse(expiration)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f'The expiration { expiration } is not a date')
+    if expiration and expiration.tzinfo is not None:
+        # Expirations are stored and compared in naive local time.
+        expiration = expiration.astimezone().replace(tzinfo=None)
+
+    return {
+        'link': link,
+        'redirect': redirect,
+        'expiration': expiration,
+        'activated': _boolean(row.get('activated'), 'activated'),
+        'track_requests': _boolean(
+            row.get('track_requests'), 'track_requests'),
+        'sample_rate': _sample_rate(row.get('sample_rate')),
+    }
+
+
+def _sample_rate(value) -> float:
+    if value is None or value == '':
+        return 1.0
+    if str(value).lower() == 'adaptive':
+        return ADAPTIVE
+
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        rate = None
+    if rate is None or not 0 < rate <= 1:
+        raise ValueError(
+            'The sample_rate must be between 0 and 1, or adaptive')
+    return rate
+
+
+def _boolean(value, name: str, default: bool = True) -> bool:
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'The value of { name } must be true or false')
@@ -0,0 +1,234 @@
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+
+
+CachedRoute = namedtuple(
+    'CachedRoute',
+    ['link_id', 'redirect', 'track_requests', 'expiration', 'sample_rate'],
+    defaults=(1.0,))
+
+
+class RouteCache(object):
+    """A bounded, in-process LRU cache mapping a route to the information
+    required to perform a redirect. Routes that do not exist are remembered in
+    a separate negative cache, so that repeated misses do not reach the
+    database.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 300,
+                 negative_size: int = 4096, negative_ttl: float = 30):
+        self.size = size
+        self.ttl = ttl
+        self.negative_size = negative_size
+        self.negative_ttl = negative_ttl
+
+        self._lock = Lock()
+        self._routes = OrderedDict()
+        self._missing = OrderedDict()
+        self.generation = 0
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the cache using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.size = app.config.get('ROUTE_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('ROUTE_CACHE_TTL', self.ttl)
+        self.negative_size = app.config.get(
+            'ROUTE_CACHE_NEGATIVE_SIZE', self.negative_size)
+        self.negative_ttl = app.config.get(
+            'ROUTE_CACHE_NEGATIVE_TTL', self.negative_ttl)
+        self.clear()
+
+        app.extensions['route_cache'] = self
+
+    def get(self, route: str):
+        """Look up a route in the cache.
+
+        Args:
+            route (str): the route requested.
+
+        Returns:
+            tuple: a pair of (found, value). If found is False then the route
+                is unknown to the cache. Otherwise value is either a
+                CachedRoute, or None if the route is known not to exist.
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now and not _is_expired(value):
+                    self._routes.move_to_end(route)
+                    self.hits += 1
+                    return True, value
+
+                del self._routes[route]
+                self.expirations += 1
+
+            expires_at = self._missing.get(route)
+            if expires_at is not None:
+                if expires_at > now:
+                    self.negative_hits += 1
+                    return True, None
+
+                del self._missing[route]
+                self.expirations += 1
+
+            self.misses += 1
+            return False, None
+
+    def set(self, route: str, value: CachedRoute = None,
+            generation: int = None):
+        """Store the result of a lookup. A value of None records the route as
+        missing.
+
+        Args:
+            route (str): the route that was looked up.
+            value (CachedRoute, optional): the redirect information, or None if
+                there is no active link with the route. Defaults to None.
+            generation (int, optional): the cache generation observed before
+                the lookup was performed. If the cache has been invalidated
+                since then, the value is discarded. Defaults to None.
+        """
+        now = monotonic()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            if value is None:
+                if not self.negative_size:
+                    return
+                self._missing[route] = now + self.negative_ttl
+                self._missing.move_to_end(route)
+                self._routes.pop(route, None)
+                self._evict(self._missing, self.negative_size)
+            else:
+                if not self.size:
+                    return
+                self._routes[route] = (value, now + self.ttl)
+                self._routes.move_to_end(route)
+                self._missing.pop(route, None)
+                self._evict(self._routes, self.size)
+
+    def invalidate(self, *routes: str):
+        """Remove the given routes from both the positive and negative caches.
+        """
+        with self._lock:
+            self.generation += 1
+            for route in routes:
+                if self._routes.pop(route, None) is not None:
+                    self.invalidations += 1
+                if self._missing.pop(route, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._routes.clear()
+            self._missing.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def stats(self) -> dict:
+        """Counters that describe how well the cache is performing.
+
+        Returns:
+            dict: the current counters, alongside the cache sizes.
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._routes),
+                'max_size': self.size,
+                'negative_size': len(self._missing),
+                'max_negative_size': self.negative_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_ratio': (
+                    (self.hits + self.negative_hits) / lookups
+                    if lookups else 0.0
+                ),
+            }
+
+    def _evict(self, entries: OrderedDict, size: int):
+        while len(entries) > size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+
+def _is_expired(value: CachedRoute) -> bool:
+    return value.expiration is not None and datetime.now() >= value.expiration
+
+
+route_cache = RouteCache()
+
+
+def find_route(route: str) -> CachedRoute:
+    """Find the redirect information for an active, unexpired link with the
+    given route, consulting this worker's route cache, the node's shared route
+    cache and the route snapshot before the database.
+
+    Args:
+        route (str): the route requested.
+
+    Returns:
+        CachedRoute: the redirect information, or None if no link exists.
+    """
+    generation = route_cache.generation
+    found, value = route_cache.get(route)
+    if found:
+        return value
+    return load_route(route, generation)
+
+
+def load_route(route: str, generation: int) -> CachedRoute:
+    """Find the redirect information for a route that is missing from this
+    worker's route cache, and store it there. Used by callers that have
+    already consulted the route cache themselves.
+
+    Args:
+        route (str): the route requested.
+        generation (int): the route cache generation observed before it was
+            consulted.
+
+    Returns:
+        CachedRoute: the redirect information, or None if no link exists.
+    """
+    from .expiration import expiration_sweeper
+    from .models import Link
+    from .shared import route_invalidation, shared_route_cache
+    from .snapshot import route_snapshot
+
+    route_invalidation.listen()
+    expiration_sweeper.start()
+    found, value = shared_route_cache.get(route)
+    if not found:
+        found, value = route_snapshot.get(route)
+    if not found:
+        shared_generation = shared_route_cache.generation
+        # Expired links are deactivated by the sweeper, but one may not have
+        # been reached yet.
+        link = Link.active_with_link(route).first()
+        if link and not link.is_expired():
+            value = CachedRoute(
+                link.id, link.redirect, link.track_requests, link.expiration,
+                link.sample_rate)
+            shared_route_cache.set(route, value, shared_generation)
+
+    route_cache.set(route, value, generation)
+    return value
@@ -0,0 +1,346 @@
+import json
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+from time import monotonic, time
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from ..local_redis import redis_from_url
+
+
+class DatabaseVersions(object):
+    """Version counters kept in the 'chart_versions' table, so that every
+    worker, and the asyncio redirect service, sees the versions moved on by
+    the others.
+
+    Args:
+        app (Flask, optional): the application whose database is used.
+            Defaults to None, for the current application.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+
+    def counters(self, keys: list) -> tuple:
+        from .models import ChartVersion
+
+        table = ChartVersion.__table__
+        with self._engine().connect() as connection:
+            versions = dict(connection.execute(
+                db.select(table.c.name, table.c.version)
+                .where(table.c.name.in_(keys))).all())
+        return tuple(versions.get(key, 0) for key in keys)
+
+    def incr(self, keys: list):
+        from .models import ChartVersion
+
+        # Rows are locked in a consistent order, so that writers cannot
+        # deadlock on each other.
+        keys = sorted(set(keys))
+        table = ChartVersion.__table__
+        for attempt in range(2):
+            try:
+                with self._engine().begin() as connection:
+                    connection.execute(
+                        table.update()
+                        .where(table.c.name.in_(keys))
+                        .values(version=table.c.version + 1))
+                    existing = {name for name, in connection.execute(
+                        db.select(table.c.name)
+                        .where(table.c.name.in_(keys)))}
+                    missing = [key for key in keys if key not in existing]
+                    if missing:
+                        connection.execute(table.insert(), [
+                            dict(name=key, version=1) for key in missing])
+                return
+            except IntegrityError:
+                # Another writer created the same counter first.
+                if attempt:
+                    raise
+
+    def clear(self):
+        from .models import ChartVersion
+
+        with self._engine().begin() as connection:
+            connection.execute(ChartVersion.__table__.delete())
+
+    def _engine(self):
+        return db.get_engine(self.app or current_app._get_current_object())
+
+
+class MemoryBackend(object):
+    """An in-process LRU cache with expiry. Each worker caches its own
+    values, while the versions they were computed from are shared through
+    the database, so that requests written by another process still
+    invalidate them.
+
+    Args:
+        size (int, optional): the number of entries kept. Defaults to 1024.
+        versions (DatabaseVersions, optional): where version counters are
+            kept. Defaults to None, keeping them in this process, which is
+            only correct when a single process writes requests.
+    """
+
+    def __init__(self, size: int = 1024, versions=None):
+        self.size = size
+        self.versions = versions
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._counters = {}
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def counters(self, keys: list) -> tuple:
+        if self.versions is not None:
+            return self.versions.counters(keys)
+        with self._lock:
+            return tuple(self._counters.get(key, 0) for key in keys)
+
+    def incr(self, keys: list):
+        if self.versions is not None:
+            self.versions.incr(keys)
+            return
+        with self._lock:
+            for key in keys:
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+        if self.versions is not None:
+            self.versions.clear()
+
+
+class RedisBackend(object):
+    """A cache shared by every worker, kept in Redis or anything with the
+    same interface. Values are stored as JSON.
+
+    Args:
+        client: a redis.Redis client, or a LocalRedis.
+        prefix (str, optional): prepended to every key. Defaults to
+            'shortener:charts:'.
+    """
+
+    def __init__(self, client, prefix: str = 'shortener:charts:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        return cls(redis_from_url(url, 'redis chart cache'))
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value, ttl: float):
+        self.client.set(
+            self.prefix + key, json.dumps(value), ex=max(1, round(ttl)))
+
+    def counters(self, keys: list) -> tuple:
+        values = self.client.mget([self.prefix + key for key in keys])
+        return tuple(int(value or 0) for value in values)
+
+    def incr(self, keys: list):
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.incr(self.prefix + key)
+        pipeline.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+BACKENDS = ('memory', 'redis', 'none')
+
+
+class ChartCache(object):
+    """Caches the chart data computed for the dashboard and link pages, per
+    user or link and per day.
+
+    Each entry records the versions of the data it was computed from. Versions
+    are counters, incremented when requests are written or links change. An
+    entry whose versions are current is served until it expires, after
+    CHART_CACHE_TTL seconds. Once a version has moved on, the entry is still
+    served for up to CHART_CACHE_MAX_STALENESS seconds after it was computed,
+    so that a steady stream of requests does not force a recomputation on
+    every page view.
+
+    CHART_CACHE_BACKEND is 'memory', for a cache per worker with versions
+    shared through the database, 'redis', for a cache shared through
+    CHART_CACHE_URL, or 'none'. A CHART_CACHE_URL of
+    'local://' uses an in-process stand-in for Redis.
+    """
+
+    REQUESTS = 'requests'
+    LINKS = 'links'
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.ttl = 300
+        self.max_staleness = 5
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the cache using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        backend = app.config.get('CHART_CACHE_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryBackend(
+                app.config.get('CHART_CACHE_SIZE', 1024),
+                versions=DatabaseVersions(app))
+        elif backend == 'redis':
+            self.backend = RedisBackend.from_url(
+                app.config.get('CHART_CACHE_URL') or 'local://')
+        elif backend == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown chart cache backend '{ backend }'")
+
+        self.ttl = app.config.get('CHART_CACHE_TTL', self.ttl)
+        self.max_staleness = app.config.get(
+            'CHART_CACHE_MAX_STALENESS', self.max_staleness)
+        self.reset_stats()
+
+        app.extensions['chart_cache'] = self
+
+    def dashboard(self, user_id: int, compute):
+        """The dashboard chart data for a user.
+
+        Args:
+            user_id (int): the id of the user viewing the dashboard.
+            compute (function): computes the data when it is not cached.
+
+        Returns:
+            dict: the chart data.
+        """
+        return self.fetch(
+            f'dashboard:{ user_id }', (self.REQUESTS, self.LINKS), compute)
+
+    def link(self, link_id: int, compute):
+        """The chart data for a single link.
+
+        Args:
+            link_id (int): the id of the link.
+            compute (function): computes the data when it is not cached.
+
+        Returns:
+            dict: the chart data.
+        """
+        return self.fetch(f'link:{ link_id }', (f'link:{ link_id }',), compute)
+
+    def fetch(self, name: str, versions: tuple, compute):
+        """Read an entry from the cache, computing and storing it when it is
+        missing, or out of date by more than the allowed staleness.
+
+        Args:
+            name (str): identifies the data, such as 'link:1'.
+            versions (tuple): the names of the versions the data depends on.
+            compute (function): computes the data.
+
+        Returns:
+            Object: the cached or computed data.
+        """
+        backend = self.backend
+        if backend is None:
+            return compute()
+
+        key = f'{ name }:{ date.today().isoformat() }'
+        current = list(backend.counters(
+            [f'version:{ version }' for version in versions]))
+
+        entry = backend.get(key)
+        if entry is not None:
+            if entry['versions'] == current:
+                with self._lock:
+                    self.hits += 1
+                return entry['value']
+            if time() - entry['created'] < self.max_staleness:
+                with self._lock:
+                    self.stale_hits += 1
+                return entry['value']
+
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        backend.set(
+            key, {'value': value, 'versions': current, 'created': time()},
+            self.ttl)
+        return value
+
+    def invalidate(self, *versions: str):
+        """Move the given versions on, so that data depending on them is
+        recomputed once it is older than the allowed staleness.
+        """
+        if self.backend is not None and versions:
+            self.backend.incr([f'version:{ version }' for version in versions])
+            with self._lock:
+                self.invalidations += len(versions)
+
+    def requests_written(self, records: list):
+        """Invalidate the data that depends on newly written requests.
+
+        Args:
+            records (list): the records of the requests written.
+        """
+        link_ids = {record['link_id'] for record in records} - {None}
+        self.invalidate(
+            self.REQUESTS, *(f'link:{ link_id }' for link_id in link_ids))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'backend': type(self.backend).__name__
+                if self.backend is not None else None,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': (
+                    (self.hits + self.stale_hits) / lookups
+                    if lookups else 0.0
+                ),
+            }
+
+
+chart_cache = ChartCache()
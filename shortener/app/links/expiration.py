@@ -0,0 +1,236 @@
+import heapq
+import os
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import select
+
+from .. import db
+
+
+class ExpirationSweeper(object):
+    """Deactivates links as they expire, so that redirect lookups only need
+    to find an active link.
+
+    Upcoming expirations are kept in a min-heap. It is loaded from the
+    database every EXPIRATION_SWEEP_INTERVAL seconds with the links that
+    expire within the next EXPIRATION_SWEEP_HORIZON seconds, and links saved
+    by this process are added to it as they are committed. A background
+    thread, started by the first route lookup, sleeps until the earliest
+    expiration, evicts the route from this worker's caches, then deactivates
+    every expired link and invalidates their routes everywhere.
+    """
+
+    def __init__(self, interval: float = 60, horizon: float = 300,
+                 enabled: bool = True):
+        self.interval = interval
+        self.horizon = horizon
+        self.enabled = enabled
+
+        self.app = None
+        self._heap = []
+        self._loaded_until = None
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopping = Event()
+        self._pid = None
+        self._thread = None
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the sweeper using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.stop()
+        self.app = app
+        self.enabled = app.config.get('EXPIRATION_SWEEP_ENABLED', self.enabled)
+        self.interval = app.config.get(
+            'EXPIRATION_SWEEP_INTERVAL', self.interval)
+        self.horizon = max(
+            app.config.get('EXPIRATION_SWEEP_HORIZON', self.horizon),
+            self.interval)
+
+        app.extensions['expiration_sweeper'] = self
+
+    def start(self):
+        """Start the background thread if it is not running in this process.
+        Threads are not inherited across a fork, so a new one is started in
+        each child process.
+        """
+        pid = os.getpid()
+        if not self.enabled or (self._pid == pid and self._thread is not None):
+            return
+
+        with self._lock:
+            if self._pid != pid or self._thread is None:
+                self._stopping.clear()
+                self._thread = Thread(
+                    target=self._run, name='expiration-sweeper', daemon=True)
+                self._pid = pid
+                self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout)
+        self._thread = None
+        self._stopping.clear()
+
+    def schedule(self, route: str, expiration: datetime):
+        """Add a link's expiration to the heap, if it falls before the next
+        load from the database.
+
+        Args:
+            route (str): the route of the link.
+            expiration (datetime): when the link expires.
+        """
+        with self._lock:
+            if self._loaded_until is None or expiration > self._loaded_until:
+                return
+
+            heapq.heappush(self._heap, (expiration, route))
+            if self._heap[0] == (expiration, route):
+                self._wake.set()
+
+    def load(self, now: datetime = None):
+        """Replace the heap with the active links that expire within the
+        horizon.
+
+        Args:
+            now (datetime, optional): the current time. Defaults to None, for
+                datetime.now().
+        """
+        from .models import Link
+
+        now = now or datetime.now()
+        until = now + timedelta(seconds=self.horizon)
+        links = Link.__table__
+        with self._engine().connect() as connection:
+            upcoming = connection.execute(
+                select(links.c.expiration, links.c.link)
+                .where(links.c.activated)
+                .where(links.c.expiration > now)
+                .where(links.c.expiration <= until)).all()
+
+        heap = [tuple(row) for row in upcoming]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+            self._loaded_until = until
+            self.loads += 1
+
+    def sweep(self, now: datetime = None) -> list:
+        """Deactivate every active link that has expired, and invalidate
+        their routes.
+
+        Args:
+            now (datetime, optional): the current time. Defaults to None, for
+                datetime.now().
+
+        Returns:
+            list: the routes of the links that were deactivated.
+        """
+        from .charts import chart_cache
+        from .models import Link
+        from .shared import route_invalidation
+
+        now = now or datetime.now()
+        links = Link.__table__
+        with self._engine().begin() as connection:
+            expired = connection.execute(
+                select(links.c.id, links.c.link)
+                .where(links.c.activated)
+                .where(links.c.expiration <= now)).all()
+            if expired:
+                connection.execute(
+                    links.update()
+                    .where(links.c.id.in_([id for id, _ in expired]))
+                    .where(links.c.activated)
+                    .values(activated=False))
+
+        routes = [route for _, route in expired]
+        if routes:
+            route_invalidation.invalidate(*routes)
+            chart_cache.invalidate(chart_cache.LINKS)
+        with self._lock:
+            self.sweeps += 1
+            self.deactivated += len(routes)
+        return routes
+
+    def due(self, now: datetime = None) -> list:
+        """Remove the expirations that have passed from the heap.
+
+        Returns:
+            list: the routes that have expired.
+        """
+        now = now or datetime.now()
+        routes = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                routes.append(heapq.heappop(self._heap)[1])
+        return routes
+
+    def reset_stats(self):
+        self.loads = 0
+        self.sweeps = 0
+        self.deactivated = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'running': self._thread is not None,
+                'scheduled': len(self._heap),
+                'next_expiration': self._heap[0][0] if self._heap else None,
+                'loads': self.loads,
+                'sweeps': self.sweeps,
+                'deactivated': self.deactivated,
+                'failed': self.failed,
+            }
+
+    def _run(self):
+        from .shared import route_invalidation
+
+        next_load = monotonic()
+        while not self._stopping.is_set():
+            try:
+                if monotonic() >= next_load:
+                    next_load = monotonic() + self.interval
+                    self.sweep()
+                    self.load()
+
+                routes = self.due()
+                if routes:
+                    # Stop serving the routes here at once, even if another
+                    # worker deactivates the links first.
+                    route_invalidation.apply(routes)
+                    self.sweep()
+            except Exception as exception:
+                self._app().logger.error(
+                    f'Unable to sweep expired links: { exception }')
+                with self._lock:
+                    self.failed += 1
+
+            timeout = next_load - monotonic()
+            with self._lock:
+                if self._heap:
+                    until = self._heap[0][0] - datetime.now()
+                    timeout = min(timeout, until.total_seconds())
+            self._wake.wait(max(timeout, 0))
+            self._wake.clear()
+
+    def _app(self):
+        return self.app or current_app._get_current_object()
+
+    def _engine(self):
+        return db.get_engine(self._app())
+
+
+expiration_sweeper = ExpirationSweeper()
@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from flask import Response, abort, stream_with_context
+
+from .. import db
+from .models import Request
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# The pickled user agent is a legacy column, and is never exported.
+COLUMNS = tuple(
+    column for column in Request.__table__.columns
+    if column.name != 'user_agent')
+
+
+def select(link_ids: list = None, since: datetime = None,
+           until: datetime = None):
+    """Builds the query for an export, ordered by the time each request ended
+    so that it can be served by the 'end' indexes.
+
+    Args:
+        link_ids (list, optional): only export requests to these links.
+            Defaults to None, for every request.
+        since (datetime, optional): only export requests that ended at or
+            after this time. Defaults to None.
+        until (datetime, optional): only export requests that ended before
+            this time. Defaults to None.
+
+    Returns:
+        Select: the query for the requests.
+    """
+    table = Request.__table__
+    query = db.select(*COLUMNS).order_by(table.c.end, table.c.id)
+
+    if link_ids is not None:
+        query = query.where(table.c.link_id.in_(link_ids))
+    if since is not None:
+        query = query.where(table.c.end >= since)
+    if until is not None:
+        query = query.where(table.c.end < until)
+
+    return query
+
+
+def export(query, format: str = 'csv', compress: bool = False,
+           chunk_size: int = 1000, engine=None):
+    """Stream the results of a query as CSV (with a header row) or JSON lines.
+    Rows are fetched with a server-side cursor, chunk_size at a time, so memory
+    use does not depend on the number of rows. The CSV header is produced
+    before the query runs, so the first bytes are available immediately.
+
+    Args:
+        query (Select): the query to export, usually from select().
+        format (str, optional): either 'csv' or 'jsonl'. Defaults to 'csv'.
+        compress (bool, optional): whether to gzip the output. Defaults to
+            False.
+        chunk_size (int, optional): the number of rows fetched and encoded at
+            a time. Defaults to 1000.
+        engine (Engine, optional): the engine to query. Defaults to the
+            engine of the current application, which must then be resolved
+            before the generator leaves the application context.
+
+    Returns:
+        generator: the parts of the export, as bytes.
+    """
+    engine = engine or db.engine
+    chunks = _encode(engine, query, format, chunk_size)
+    return _compress(chunks) if compress else chunks
+
+
+def _encode(engine, query, format: str, chunk_size: int):
+    names = [column.name for column in query.selected_columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if format == 'csv':
+        writer.writerow(names)
+        yield _take(buffer)
+
+    with engine.connect() as connection:
+        result = connection \
+            .execution_options(stream_results=True) \
+            .execute(query)
+        for rows in result.partitions(chunk_size):
+            if format == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(
+                        dict(zip(names, row)), default=_default))
+                    buffer.write('\n')
+            yield _take(buffer)
+
+
+def _take(buffer: io.StringIO) -> bytes:
+    value = buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    return value
+
+
+def _compress(chunks):
+    """Gzip a stream of chunks, flushing after each one so that the client
+    receives data as it is produced.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def filename(name: str, format: str, compress: bool = False) -> str:
+    """Returns the file name for an export of the given format.
+
+    Args:
+        name (str): the name of the file, without an extension.
+        format (str): either 'csv' or 'jsonl'.
+        compress (bool, optional): whether the export is gzipped. Defaults to
+            False.
+
+    Returns:
+        str: the file name.
+    """
+    return f'{ name }.{ format }' + ('.gz' if compress else '')
+
+
+def response(name: str, args, link_ids: list = None) -> Response:
+    """Builds a streaming response for an export, using the 'format', 'gzip',
+    'since' and 'until' query string arguments.
+
+    Args:
+        name (str): the name of the downloaded file, without an extension.
+        args (MultiDict): the query string arguments of the request.
+        link_ids (list, optional): only export requests to these links.
+            Defaults to None, for every request.
+
+    Returns:
+        Response: a response that streams the export.
+    """
+    format = args.get('format', 'csv')
+    if format not in FORMATS:
+        abort(400)
+    compress = args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        since, until = (
+            datetime.fromisoformat(args[key]) if args.get(key) else None
+            for key in ('since', 'until'))
+    except ValueError:
+        abort(400)
+
+    query = select(link_ids, since, until)
+    chunks = export(query, format, compress, engine=db.engine)
+
+    headers = {
+        'Content-Disposition':
+            f'attachment; filename={ filename(name, format, compress) }',
+        # Ask proxies such as nginx to pass the chunks on as they arrive.
+        'X-Accel-Buffering': 'no',
+    }
+    mimetype = 'application/gzip' if compress else FORMATS[format]
+    return Response(
+        stream_with_context(chunks), mimetype=mimetype, headers=headers)
@@ -1,11 +1,15 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (
-    StringField, SubmitField, ValidationError, BooleanField, IntegerField
+    StringField, SubmitField, ValidationError, BooleanField, IntegerField,
+    SelectField
 )
 from wtforms.fields.html5 import DateField
 from wtforms.validators import DataRequired, URL, Optional
 
+from .bulk import detect_format
 from .models import Link
+from .sampling import ADAPTIVE, weight_for
 
 
 class QuickLinkForm(FlaskForm):
@@ -20,8 +24,25 @@ class LinkForm(FlaskForm):
     expiration = DateField('Expiration date', validators=[Optional()])
     activated = BooleanField('Active?')
     track_requests = BooleanField('Track requests?')
+    sample_rate = SelectField('Record', choices=[
+        (1.0, 'Every request'),
+        (0.1, '1 in 10 requests'),
+        (0.01, '1 in 100 requests'),
+        (ADAPTIVE, 'Adaptive, for busy links'),
+    ], coerce=float, default=1.0)
     submit = SubmitField('Submit')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Imported links may have any rate, which is offered alongside the
+        # presets so that saving the form keeps it.
+        obj = kwargs.get('obj')
+        rate = getattr(obj, 'sample_rate', None)
+        if rate is not None \
+                and rate not in dict(self.sample_rate.choices):
+            self.sample_rate.choices = self.sample_rate.choices + [
+                (rate, f'1 in { weight_for(rate) } requests')]
+
     def validate_link(self, field: StringField):
         """Performs validation on the link StringField. If a link is provided,
         confirms that it is not in use. If the field is empty, generate a
@@ -35,7 +56,7 @@ class LinkForm(FlaskForm):
                 contains illegal characters.
         """
         if field.data:
-            link = Link.active_with_link(field.data, include_expiration=True) \
+            link = Link.active_with_link(field.data) \
                 .filter(Link.id != self.id.data) \
                 .first()
             if link:
@@ -45,3 +66,28 @@ class LinkForm(FlaskForm):
                 raise ValidationError('The link contains invalid characters')
         else:
             field.data = Link.unique_link()
+
+
+class ImportForm(FlaskForm):
+    file = FileField('File', validators=[FileRequired()])
+    format = SelectField('Format', choices=[
+        ('', 'Detect from the file name'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON lines'),
+    ], validate_choice=False)
+    submit = SubmitField('Import')
+
+    def validate_format(self, field: SelectField):
+        """Detects the format from the name of the uploaded file, if it was
+        not chosen.
+
+        Args:
+            field (SelectField): an instance of a WTForms SelectField.
+
+        Raises:
+            ValidationError: the format could not be detected.
+        """
+        if not field.data and self.file.data:
+            field.data = detect_format(self.file.data.filename)
+        if field.data not in ('csv', 'jsonl'):
+            raise ValidationError('The format could not be detected.')
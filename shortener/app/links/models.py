@@ -1,13 +1,15 @@
 from .. import db
 from ..utils import ModelMixin
+from .charts import chart_cache
+from .expiration import expiration_sweeper
+from .shared import route_invalidation
 
-from sqlalchemy import or_
+from sqlalchemy import inspect, or_
 from sqlalchemy.orm import validates
 from flask import url_for
 from flask_sqlalchemy import BaseQuery
 from flask_login import current_user
-from datetime import datetime, timedelta
-from random import choice
+from datetime import date, datetime, time, timedelta
 from string import digits, ascii_letters
 from urllib.parse import urlparse
 
@@ -16,7 +18,20 @@ class Link(db.Model, ModelMixin):
     """A particular link between the shorterned value and the redirect."""
 
     __tablename__ = 'links'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Serves the route lookup performed for every redirect, and ensures
+        # that an active route belongs to a single link.
+        db.Index('uq_links_link_activated', 'link', unique=True,
+                 postgresql_where=db.text('activated'),
+                 sqlite_where=db.text('activated = 1')),
+        db.Index('ix_links_user_id_activated', 'user_id', 'activated'),
+        # Serves the expiration sweeper, which looks for active links that
+        # are about to expire.
+        db.Index('ix_links_expiration_activated', 'expiration',
+                 postgresql_where=db.text('activated'),
+                 sqlite_where=db.text('activated = 1')),
+        {'extend_existing': True},
+    )
 
     LINK_SIZE = 6
     VALID_CHARS = digits + ascii_letters + '-_'
@@ -24,45 +39,100 @@ class Link(db.Model, ModelMixin):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     requests = db.relationship('Request', backref='links', lazy=True)
-    link = db.Column(db.String, nullable=False)
+    link = db.column_property(
+        db.Column(db.String, nullable=False), active_history=True)
     redirect = db.Column(db.String(500), nullable=False)
     activated = db.Column(db.Boolean, default=True)
     track_requests = db.Column(db.Boolean, default=True)
+    # The fraction of requests recorded when requests are tracked, or 0 to
+    # adapt the rate to the link's traffic. See RequestSampler.
+    sample_rate = db.Column(
+        db.Float, nullable=False, default=1.0, server_default='1')
     expiration = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    total_hits = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    last_hit_at = db.Column(db.DateTime)
 
     @validates('link')
     def validate_link(self, key: str, link: str) -> str:
-        """Perform validation on a link, ensuring that it is the only
-        allowed if there are no other similar links validated.
+        """Perform validation on a link, ensuring that it only contains
+        allowed characters. Uniqueness of active links is enforced by the
+        'uq_links_link_activated' index, so saving a link that is already in
+        use raises an IntegrityError.
 
         Args:
             key (str): will always be 'link' in this context.
             link (str): the link that needs validation.
 
         Raises:
-            AssertionError: raised if the link is already in use, or contains
-                illegal characters.
+            AssertionError: raised if the link contains illegal characters.
 
         Returns:
             str: the link that just had validation performed.
         """
-        if Link.active_with_link(link).filter(Link.id != self.id).first():
-            raise AssertionError(f'The link { link } is already in use')
-
         if not all(char in Link.VALID_CHARS for char in link):
             raise AssertionError('The link contains invalid characters')
 
         return link
 
-    def requests_for_today(self) -> list:
-        """Returns all requests that have been performed today.
+    @validates('expiration')
+    def validate_expiration(self, key: str,
+                            expiration: date) -> datetime:
+        """Convert a bare date, as submitted by LinkForm, into the start of
+        that day, so that expirations can always be compared with datetimes.
+
+        Args:
+            key (str): will always be 'expiration' in this context.
+            expiration (date): the expiration, as a date or datetime.
 
         Returns:
-            list: a list of requests objects which ended in the day today.
+            datetime: the expiration as a datetime, or None.
         """
-        today = datetime.now().date()
-        return list(filter(lambda x: x.end.date() == today, self.requests))
+        if isinstance(expiration, date) \
+                and not isinstance(expiration, datetime):
+            return datetime.combine(expiration, time.min)
+        return expiration
+
+    def before_commit(self) -> tuple:
+        """Collects the routes affected by the pending changes, including any
+        route that the link is being moved away from, and the expiration that
+        the link will have.
+
+        Returns:
+            tuple: the routes that must be invalidated after the commit, and
+                a pair of (route, expiration) to schedule, or None.
+        """
+        with db.session.no_autoflush:
+            routes = set(inspect(self).attrs.link.history.deleted or ())
+            if self.link:
+                routes.add(self.link)
+            # New links are activated by default when they are inserted.
+            expires = self.link and self.activated is not False and \
+                self.expiration
+        return routes, (self.link, self.expiration) if expires else None
+
+    def after_commit(self, state: tuple):
+        routes, expiration = state
+        route_invalidation.invalidate(*routes)
+        if expiration:
+            expiration_sweeper.schedule(*expiration)
+        chart_cache.invalidate(chart_cache.LINKS)
+
+    def hits_today(self) -> int:
+        """Returns the number of hits recorded today, read from the daily
+        rollup.
+
+        Returns:
+            int: the number of hits that ended in the day today.
+        """
+        today = RequestRollup.truncate(datetime.now(), RequestRollup.DAY)
+        hits = db.session.query(db.func.sum(RequestRollup.hits)) \
+            .filter(RequestRollup.link_id == self.id) \
+            .filter(RequestRollup.granularity == RequestRollup.DAY) \
+            .filter(RequestRollup.bucket_start == today) \
+            .scalar()
+        return hits or 0
 
     def is_expired(self) -> bool:
         return self.expiration and datetime.now() >= self.expiration
@@ -138,7 +208,10 @@ class Link(db.Model, ModelMixin):
     @staticmethod
     def active_with_link(route: str, include_expiration=False) -> BaseQuery:
         """Returns an SQLAlchemy query of all active links with a particular
-        route value. Includes the option to look for expired links.
+        route value. Expired links are deactivated by the expiration sweeper,
+        so redirect lookups leave out the expiration check, and the query is
+        answered from the 'uq_links_link_activated' index alone. The check
+        can be included for callers that cannot wait for the sweeper.
 
         Args:
             route (str): a particular link to search for.
@@ -156,22 +229,45 @@ class Link(db.Model, ModelMixin):
 
         return query
 
+    @staticmethod
+    def active_links(routes) -> set:
+        """Finds which of the given routes belong to an activated link, using
+        a single query.
+
+        Args:
+            routes (iterable): the routes to look for.
+
+        Returns:
+            set: the routes that are in use.
+        """
+        routes = list(routes)
+        if not routes:
+            return set()
+
+        query = Link.active() \
+            .filter(Link.link.in_(routes)) \
+            .with_entities(Link.link)
+        return {route for route, in query}
+
     @staticmethod
     def unique_link() -> str:
-        """Generates a unique, random alphanumeric link value of size
-        Link.LINK_SIZE.
+        """Allocates a link value that is not in use, using the configured
+        allocator.
 
         Returns:
-            str: a randomly generated, unique link value.
+            str: a unique link value.
         """
-        list = (choice(Link.VALID_CHARS) for _ in range(Link.LINK_SIZE))
-        value = ''.join(list)
+        from .allocator import link_allocator
+        return link_allocator.allocate()
+
+
+class LinkSequence(db.Model):
+    """The next counter value to allocate links from, for each link size."""
 
-        while Link.active_with_link(value, include_expiration=True).first():
-            list = (choice(Link.VALID_CHARS) for _ in range(Link.LINK_SIZE))
-            value = ''.join(list)
+    __tablename__ = 'link_sequences'
 
-        return value
+    size = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
 
 
 class Request(db.Model, ModelMixin):
@@ -180,6 +276,12 @@ class Request(db.Model, ModelMixin):
     """
 
     __tablename__ = 'requests'
+    __table_args__ = (
+        db.Index('ix_requests_link_id_end', 'link_id', 'end'),
+        db.Index('ix_requests_end', 'end'),
+        db.Index('ix_requests_link_id_browser',
+                 'link_id', 'browser', 'browser_version'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=True)
@@ -188,7 +290,22 @@ class Request(db.Model, ModelMixin):
     is_bot = db.Column(db.Boolean, default=False)
     start = db.Column(db.DateTime, nullable=False)
     end = db.Column(db.DateTime, nullable=False)
-    user_agent = db.Column(db.PickleType)
+    browser = db.Column(db.String(50))
+    browser_version = db.Column(db.Integer)
+    os_name = db.Column(db.String(50))
+    os_version = db.Column(db.String(50))
+    platform = db.Column(db.String(50))
+    # The number of requests that this one stands for, when the link's
+    # requests are sampled.
+    weight = db.Column(
+        db.Integer, nullable=False, default=1, server_default='1')
+    # A keyed hash of the address and user agent, counted by the unique
+    # visitor sketches.
+    visitor = db.Column(db.BigInteger)
+
+    # Legacy, pickled copy of the user agent. Only read when backfilling the
+    # structured columns above.
+    user_agent = db.deferred(db.Column(db.PickleType))
 
     def __str__(self) -> str:
         return f'<Request: { self._link }, is_hit = { self.is_hit }>'
@@ -202,6 +319,27 @@ class Request(db.Model, ModelMixin):
         """
         return self.end - self.start
 
+    def to_record(self) -> dict:
+        """The column values of the request, suitable for a bulk insert. Unset
+        values are replaced with the column's default, so that every record
+        has the same keys.
+
+        Returns:
+            dict: a mapping of column name to value, excluding the id.
+        """
+        record = {}
+        for column in Request.__table__.columns:
+            if column.primary_key:
+                continue
+
+            value = getattr(self, column.key)
+            if value is None and column.default is not None \
+                    and column.default.is_scalar:
+                value = column.default.arg
+            record[column.key] = value
+
+        return record
+
     @staticmethod
     def find_by_link(id: int) -> BaseQuery:
         """Finds all requests with a particular link_id.
@@ -217,3 +355,154 @@ class Request(db.Model, ModelMixin):
     @staticmethod
     def hit() -> BaseQuery:
         return Request.query.filter(Request.is_hit)
+
+
+class RequestRollup(db.Model, ModelMixin):
+    """Pre-aggregated request counts for a link, over a bucket of time. Misses
+    are recorded against a link_id of None.
+
+    A bucket may be spread over more than one row, if two workers create it at
+    the same time, so counts should always be summed.
+    """
+
+    __tablename__ = 'request_rollups'
+    __table_args__ = (
+        db.Index('ix_request_rollups_granularity_bucket_start',
+                 'granularity', 'bucket_start', 'link_id'),
+        db.Index('ix_request_rollups_link_id_granularity',
+                 'link_id', 'granularity', 'bucket_start'),
+    )
+
+    HOUR = 'hour'
+    DAY = 'day'
+    WEEK = 'week'
+
+    id = db.Column(db.Integer, primary_key=True)
+    link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=True)
+    granularity = db.Column(db.String(10), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    misses = db.Column(db.Integer, nullable=False, default=0)
+    bots = db.Column(db.Integer, nullable=False, default=0)
+
+    def __str__(self) -> str:
+        return f'<RequestRollup: { self.link_id }, { self.bucket_start }>'
+
+    @staticmethod
+    def truncate(value: datetime, granularity: str) -> datetime:
+        """Returns the start of the bucket that contains the given time.
+
+        Args:
+            value (datetime): a particular point in time.
+            granularity (str): RequestRollup.HOUR, RequestRollup.DAY or
+                RequestRollup.WEEK. Weeks start on a Monday.
+
+        Returns:
+            datetime: the start of the bucket.
+        """
+        if granularity == RequestRollup.HOUR:
+            return value.replace(minute=0, second=0, microsecond=0)
+
+        day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+        if granularity == RequestRollup.WEEK:
+            return day - timedelta(days=day.weekday())
+        return day
+
+    @staticmethod
+    def find_by_granularity(granularity: str, since: datetime) -> BaseQuery:
+        """Finds the rollups of a particular granularity, starting from the
+        bucket containing the given time.
+
+        Args:
+            granularity (str): either RequestRollup.HOUR or RequestRollup.DAY.
+            since (datetime): the earliest point in time to include.
+
+        Returns:
+            BaseQuery: results of the performed query.
+        """
+        bucket_start = RequestRollup.truncate(since, granularity)
+        return RequestRollup.query \
+            .filter(RequestRollup.granularity == granularity) \
+            .filter(RequestRollup.bucket_start >= bucket_start)
+
+
+class RequestTotal(db.Model):
+    """Request counts over every link, for a day or week that has closed.
+    Totals are computed from the daily rollups the first time they are
+    needed, so the dashboard only aggregates the buckets that are still open.
+    """
+
+    __tablename__ = 'request_totals'
+
+    granularity = db.Column(db.String(10), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    misses = db.Column(db.Integer, nullable=False, default=0)
+    bots = db.Column(db.Integer, nullable=False, default=0)
+
+    def __str__(self) -> str:
+        return f'<RequestTotal: { self.granularity }, { self.bucket_start }>'
+
+
+class RequestSketch(db.Model):
+    """A HyperLogLog sketch of the distinct visitors to a link over a day,
+    stored compressed. Sketches are merged to count the visitors over any
+    number of days and links.
+
+    A day may be spread over more than one row, if two workers create it at
+    the same time, so rows should always be merged.
+    """
+
+    __tablename__ = 'request_sketches'
+    __table_args__ = (
+        db.Index('ix_request_sketches_link_id_bucket_start',
+                 'link_id', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+    def __str__(self) -> str:
+        return f'<RequestSketch: { self.link_id }, { self.bucket_start }>'
+
+
+class OwnerSketch(db.Model):
+    """The union of the daily visitor sketches of every link that a user
+    owns, so that the dashboard merges one row per day however many links
+    the user has. A user_id of None holds the union over every link, which is
+    what admins see.
+
+    As with RequestSketch, a day may be spread over more than one row. The
+    unions are kept as requests are written, so a link that changes owner is
+    only moved to its new owner by the rebuild_rollups command.
+    """
+
+    __tablename__ = 'owner_sketches'
+    __table_args__ = (
+        db.Index('ix_owner_sketches_user_id_bucket_start',
+                 'user_id', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+    def __str__(self) -> str:
+        return f'<OwnerSketch: { self.user_id }, { self.bucket_start }>'
+
+
+class ChartVersion(db.Model):
+    """A version counter for cached chart data, moved on whenever the data
+    it covers changes. Kept in the database so that every process shares it.
+    """
+
+    __tablename__ = 'chart_versions'
+
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __str__(self) -> str:
+        return f'<ChartVersion: { self.name }, { self.version }>'
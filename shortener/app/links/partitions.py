@@ -0,0 +1,261 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+from .. import db
+from .models import Request
+
+
+DEFAULT_PARTITION = 'requests_default'
+
+
+def is_supported(engine) -> bool:
+    """Native range partitioning is only used on PostgreSQL. Other databases
+    keep 'requests' as a single table.
+    """
+    return engine.dialect.name == 'postgresql'
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(value: date) -> date:
+    if value.month == 12:
+        return date(value.year + 1, 1, 1)
+    return date(value.year, value.month + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'requests_{ month.year:04d}_{ month.month:02d}'
+
+
+def is_partitioned(connection) -> bool:
+    return connection.exec_driver_sql(
+        'SELECT 1 FROM pg_partitioned_table p '
+        'JOIN pg_class c ON c.oid = p.partrelid '
+        "WHERE c.relname = 'requests'").first() is not None
+
+
+def list_partitions(connection) -> list:
+    """List the monthly partitions of the 'requests' table.
+
+    Args:
+        connection (Connection): a connection to a PostgreSQL database.
+
+    Returns:
+        list: a list of (name, start, end) tuples ordered by start, where the
+            partition holds requests that ended in [start, end).
+    """
+    rows = connection.exec_driver_sql(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        "WHERE p.relname = 'requests'").fetchall()
+
+    partitions = []
+    for name, in rows:
+        if name == DEFAULT_PARTITION:
+            continue
+        year, month = name.split('_')[1:]
+        start = date(int(year), int(month), 1)
+        partitions.append((name, start, next_month(start)))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(connection, start: date, end: date) -> list:
+    """Create any missing monthly partitions covering the given range, along
+    with a default partition that catches anything outside of them.
+
+    Args:
+        connection (Connection): a connection to a PostgreSQL database.
+        start (date): the first month to create a partition for.
+        end (date): the last month to create a partition for.
+
+    Returns:
+        list: the names of the partitions that were created.
+    """
+    existing = {name for name, _, _ in list_partitions(connection)}
+    created = []
+
+    month = month_start(start)
+    while month <= end:
+        name = partition_name(month)
+        if name not in existing:
+            connection.exec_driver_sql(
+                f'CREATE TABLE { name } PARTITION OF requests FOR VALUES '
+                f"FROM ('{ month.isoformat() }') "
+                f"TO ('{ next_month(month).isoformat() }')")
+            created.append(name)
+        month = next_month(month)
+
+    connection.exec_driver_sql(
+        f'CREATE TABLE IF NOT EXISTS { DEFAULT_PARTITION } '
+        'PARTITION OF requests DEFAULT')
+
+    return created
+
+
+def partition(months_ahead: int = 3) -> list:
+    """Convert the 'requests' table into a table partitioned by month on its
+    'end' column, if it is not already, and create partitions for the coming
+    months. Existing rows are copied into the new partitions. Does nothing on
+    databases that do not support partitioning.
+
+    Args:
+        months_ahead (int, optional): the number of future months to create
+            partitions for. Defaults to 3.
+
+    Returns:
+        list: a description of each change that was made.
+    """
+    engine = db.engine
+    if not is_supported(engine):
+        return []
+
+    changes = []
+    last = month_start(datetime.now())
+    for _ in range(months_ahead):
+        last = next_month(last)
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            first = _convert(connection)
+            changes.append('Partitioned table requests')
+        else:
+            first = month_start(datetime.now())
+
+        for name in ensure_partitions(connection, first, last):
+            changes.append(f'Created partition { name }')
+
+    return changes
+
+
+def _convert(connection) -> date:
+    """Replace 'requests' with a partitioned copy, within the transaction of
+    the given connection. The primary key of a partitioned table must include
+    the partition key, so it becomes (id, end).
+
+    Returns:
+        date: the month of the oldest request.
+    """
+    connection.exec_driver_sql(
+        'ALTER TABLE requests RENAME TO requests_legacy')
+    connection.exec_driver_sql(
+        'ALTER TABLE requests_legacy DROP CONSTRAINT IF EXISTS requests_pkey')
+    for index in Request.__table__.indexes:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS { index.name }')
+
+    connection.exec_driver_sql(
+        'CREATE TABLE requests (LIKE requests_legacy INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE ("end")')
+    connection.exec_driver_sql(
+        'ALTER TABLE requests ADD CONSTRAINT requests_pkey '
+        'PRIMARY KEY (id, "end")')
+    connection.exec_driver_sql(
+        'ALTER TABLE requests ADD CONSTRAINT requests_link_id_fkey '
+        'FOREIGN KEY (link_id) REFERENCES links (id)')
+
+    oldest = connection.exec_driver_sql(
+        'SELECT min("end") FROM requests_legacy').scalar()
+    first = month_start(oldest or datetime.now())
+    ensure_partitions(connection, first, month_start(datetime.now()))
+
+    connection.exec_driver_sql(
+        'INSERT INTO requests SELECT * FROM requests_legacy')
+    connection.exec_driver_sql(
+        'ALTER SEQUENCE IF EXISTS requests_id_seq OWNED BY requests.id')
+    connection.exec_driver_sql('DROP TABLE requests_legacy')
+
+    for index in Request.__table__.indexes:
+        index.create(connection)
+
+    return first
+
+
+def prune(cutoff: datetime, archive: str = None) -> list:
+    """Remove requests that ended before the cutoff. On PostgreSQL, whole
+    monthly partitions that end on or before the cutoff are detached and
+    dropped; a partition that spans the cutoff is kept. Elsewhere, the rows
+    are removed with a single DELETE. The rollups are left untouched, so the
+    dashboards keep their history.
+
+    Args:
+        cutoff (datetime): requests that ended before this are removed.
+        archive (str, optional): a directory to write the removed requests
+            to, as one gzipped JSON lines file per partition. Defaults to
+            None.
+
+    Returns:
+        list: a list of (name, count) tuples for each partition or table that
+            was pruned. Counts for dropped partitions are only known when
+            archiving.
+    """
+    engine = db.engine
+    table = Request.__table__
+    pruned = []
+
+    if is_supported(engine) and _has_partitions(engine):
+        with engine.connect() as connection:
+            partitions = [
+                name for name, _, end in list_partitions(connection)
+                if end <= cutoff.date()
+            ]
+
+        for name in partitions:
+            count = None
+            if archive:
+                query = db.text(f'SELECT * FROM { name }')
+                count = _archive(engine, query, archive, name)
+
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE requests DETACH PARTITION { name }')
+                connection.exec_driver_sql(f'DROP TABLE { name }')
+            pruned.append((name, count))
+
+        # Requests in the default partition can only be removed with a DELETE.
+        table = db.table(
+            DEFAULT_PARTITION, *(db.column(column.name) for column in table.c))
+
+    count = None
+    if archive:
+        query = db.select(table).where(table.c.end < cutoff)
+        name = f'{ table.name }_before_{ cutoff.strftime("%Y_%m_%d") }'
+        count = _archive(engine, query, archive, name)
+
+    with engine.begin() as connection:
+        result = connection.execute(table.delete().where(table.c.end < cutoff))
+        pruned.append((table.name, result.rowcount))
+
+    return pruned
+
+
+def _has_partitions(engine) -> bool:
+    with engine.connect() as connection:
+        return is_partitioned(connection)
+
+
+def _archive(engine, query, directory: str, name: str) -> int:
+    """Stream the results of a query to a gzipped JSON lines file.
+
+    Returns:
+        int: the number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{ name }.jsonl.gz')
+
+    count = 0
+    with engine.connect() as connection, gzip.open(path, 'wt') as file:
+        result = connection \
+            .execution_options(stream_results=True) \
+            .execute(query)
+        for rows in result.partitions(1000):
+            for row in rows:
+                file.write(json.dumps(dict(row._mapping), default=str))
+                file.write('\n')
+                count += 1
+
+    return count
@@ -0,0 +1,148 @@
+from datetime import datetime
+from time import perf_counter
+
+from flask import render_template
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.urls import iri_to_uri
+
+from ..metrics import request_metrics
+from .agents import parse_user_agent
+from .cache import load_route, route_cache
+from .sampling import request_sampler
+from .sketches import visitor_id
+from .tracking import request_logger
+
+
+class RedirectApp(object):
+    """A minimal WSGI application that serves redirects, intended to be
+    mounted in front of the main application at '/l' with a
+    DispatcherMiddleware. It shares the route cache, user agent classifier and
+    request logger with the main application, but skips sessions, logins,
+    breadcrumbs and templates. Misses are served a 404 page that is rendered
+    once, without the request details that main.link shows. Like main.link,
+    only GET and HEAD requests for a non-empty route are served; anything else
+    gets the application's error page, without a lookup or a logged request.
+
+    Args:
+        app (Flask): the application to share configuration and the database
+            with.
+    """
+
+    METHODS = ('GET', 'HEAD')
+
+    def __init__(self, app):
+        from .models import Request
+
+        self.app = app
+        self.defaults = Request().to_record()
+        self._not_found = None
+        self._errors = {}
+
+    def __call__(self, environ, start_response):
+        began = perf_counter()
+        start = datetime.now()
+        method = environ.get('REQUEST_METHOD')
+        if method not in self.METHODS:
+            return self.error(
+                environ, start_response,
+                MethodNotAllowed(valid_methods=self.METHODS), began)
+
+        # main.link only matches a single, non-empty path segment.
+        route = environ.get('PATH_INFO', '')[1:]
+        if not route or '/' in route:
+            return self.error(environ, start_response, NotFound(), began)
+        if not route.isascii():
+            route = route.encode('latin-1').decode('utf-8', 'replace')
+
+        generation = route_cache.generation
+        found, link = route_cache.get(route)
+        if not found:
+            with self.app.app_context():
+                link = load_route(route, generation)
+
+        weight = request_sampler.weight(link)
+        if weight:
+            user_agent = environ.get('HTTP_USER_AGENT')
+            agent = parse_user_agent(user_agent)
+            request_logger.log(dict(
+                self.defaults, route=route, start=start, end=datetime.now(),
+                is_hit=link is not None, link_id=link and link.link_id,
+                weight=weight, visitor=visitor_id(
+                    environ.get('REMOTE_ADDR'), user_agent,
+                    self.app.config.get('SECRET_KEY')),
+                **agent._asdict()))
+
+        if link:
+            location = link.redirect
+            if not location.isascii():
+                location = iri_to_uri(location, safe_conversion=True)
+            start_response('302 FOUND', [
+                ('Location', location), ('Content-Length', '0')])
+            request_metrics.observe(
+                'redirects.link', method, 302, perf_counter() - began)
+            return [b'']
+
+        body = self.not_found()
+        request_metrics.observe(
+            'redirects.link', method, 404, perf_counter() - began)
+        start_response('404 NOT FOUND', [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body)))])
+        return [body]
+
+    def not_found(self) -> bytes:
+        """The body served for missing links, rendered on first use.
+
+        Returns:
+            bytes: the rendered 'missing.html' template.
+        """
+        if self._not_found is None:
+            with self.app.test_request_context('/l/'):
+                self._not_found = render_template('missing.html').encode()
+        return self._not_found
+
+    def error(self, environ, start_response, exception: HTTPException,
+              began: float) -> list:
+        """Serve the application's error page for a request that main.link
+        would not have matched. Pages are rendered once for each status code.
+
+        Args:
+            environ (dict): the WSGI environment of the request.
+            start_response (callable): the WSGI start_response callable.
+            exception (HTTPException): the error to serve.
+            began (float): the perf_counter value when the request began.
+
+        Returns:
+            list: the body of the response.
+        """
+        body = self._errors.get(exception.code)
+        if body is None:
+            with self.app.test_request_context('/l/'):
+                body = self._errors[exception.code] = render_template(
+                    'error.html', error=exception).encode()
+
+        headers = [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body)))]
+        if getattr(exception, 'valid_methods', None):
+            headers.append(('Allow', ', '.join(exception.valid_methods)))
+
+        request_metrics.observe(
+            'redirects.link', environ.get('REQUEST_METHOD'), exception.code,
+            perf_counter() - began)
+        start_response(f'{ exception.code } { exception.name.upper() }',
+                       headers)
+        return [body]
+
+
+def mount(app):
+    """Serve '/l/<route>' for the given application from a RedirectApp, when
+    REDIRECT_FAST_PATH is enabled.
+
+    Args:
+        app (Flask): the application to mount the redirect application on.
+    """
+    if app.config.get('REDIRECT_FAST_PATH'):
+        app.wsgi_app = DispatcherMiddleware(
+            app.wsgi_app, {'/l': RedirectApp(app)})
@@ -0,0 +1,282 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from .models import Link, Request, RequestRollup, RequestTotal
+
+
+GRANULARITIES = (RequestRollup.HOUR, RequestRollup.DAY)
+LENGTHS = {
+    RequestRollup.DAY: timedelta(days=1),
+    RequestRollup.WEEK: timedelta(weeks=1),
+}
+
+# A bucket is only treated as closed once this long has passed since it
+# ended, so that requests still queued by the writers are counted.
+CLOSE_DELAY = timedelta(minutes=5)
+
+
+def aggregate(records, counts: dict = None) -> dict:
+    """Count hits, misses and bots for each link and bucket of time. Each
+    request counts for its weight, so that sampled requests are scaled back
+    up to the traffic they stand for.
+
+    Args:
+        records (iterable): request records, as produced by Request.to_record.
+        counts (dict, optional): existing counts to add to. Defaults to None.
+
+    Returns:
+        dict: a mapping of (link_id, granularity, bucket_start) to a list of
+            [hits, misses, bots].
+    """
+    counts = defaultdict(lambda: [0, 0, 0]) if counts is None else counts
+    for record in records:
+        for granularity in GRANULARITIES:
+            bucket_start = RequestRollup.truncate(record['end'], granularity)
+            key = (record['link_id'], granularity, bucket_start)
+            count = counts[key]
+            weight = record.get('weight') or 1
+            count[0 if record['is_hit'] else 1] += weight
+            if record['is_bot']:
+                count[2] += weight
+
+    return counts
+
+
+def apply(connection, records: list):
+    """Add a batch of request records to the rollups, within the transaction
+    of the given connection. Existing buckets are incremented in place, and
+    missing buckets are inserted.
+
+    Args:
+        connection (Connection): a connection with an open transaction.
+        records (list): request records, as produced by Request.to_record.
+    """
+    table = RequestRollup.__table__
+    for key, (hits, misses, bots) in aggregate(records).items():
+        link_id, granularity, bucket_start = key
+        result = connection.execute(
+            table.update()
+            .where(_matches(table, link_id, granularity, bucket_start))
+            .values(
+                hits=table.c.hits + hits,
+                misses=table.c.misses + misses,
+                bots=table.c.bots + bots))
+
+        if not result.rowcount:
+            connection.execute(table.insert().values(
+                link_id=link_id, granularity=granularity,
+                bucket_start=bucket_start, hits=hits, misses=misses,
+                bots=bots))
+
+
+def apply_counters(connection, records: list):
+    """Add a batch of request records to the hit counters held on each link,
+    within the transaction of the given connection.
+
+    Args:
+        connection (Connection): a connection with an open transaction.
+        records (list): request records, as produced by Request.to_record.
+    """
+    counters = {}
+    for record in records:
+        if record['is_hit'] and record['link_id'] is not None:
+            hits, last_hit_at = counters.get(record['link_id'], (0, None))
+            if last_hit_at is None or record['end'] > last_hit_at:
+                last_hit_at = record['end']
+            counters[record['link_id']] = (
+                hits + (record.get('weight') or 1), last_hit_at)
+
+    table = Link.__table__
+    for link_id, (hits, last_hit_at) in counters.items():
+        connection.execute(
+            table.update()
+            .where(table.c.id == link_id)
+            .values(
+                total_hits=table.c.total_hits + hits,
+                last_hit_at=db.case(
+                    (table.c.last_hit_at.is_(None), last_hit_at),
+                    (table.c.last_hit_at < last_hit_at, last_hit_at),
+                    else_=table.c.last_hit_at)))
+
+
+def rebuild(since: datetime = None, chunk_size: int = 1000) -> int:
+    """Recompute the rollups from the raw 'requests' table. Used to compact
+    the rollups and to populate them for requests recorded before they
+    existed. A full rebuild also recomputes the hit counters of each link,
+    and stored totals are discarded to be recomputed from the new rollups.
+    Requests are streamed, so memory use depends only on the number of
+    buckets. Requests written while the rebuild runs may be missed, so it is
+    best run against closed buckets, or while traffic is quiet.
+
+    Args:
+        since (datetime, optional): only rebuild buckets from this point in
+            time onwards. Defaults to None, rebuilding everything.
+        chunk_size (int, optional): the number of requests loaded at a time.
+            Defaults to 1000.
+
+    Returns:
+        int: the number of rollup rows written.
+    """
+    requests = Request.__table__
+    rollups = RequestRollup.__table__
+
+    query = db.select(
+        requests.c.link_id, requests.c.is_hit, requests.c.is_bot,
+        requests.c.end, requests.c.weight)
+    delete = rollups.delete()
+    delete_totals = RequestTotal.__table__.delete()
+    if since is not None:
+        since = RequestRollup.truncate(since, RequestRollup.DAY)
+        query = query.where(requests.c.end >= since)
+        delete = delete.where(rollups.c.bucket_start >= since)
+        delete_totals = delete_totals.where(
+            RequestTotal.bucket_start
+            >= RequestRollup.truncate(since, RequestRollup.WEEK))
+
+    counts = None
+    with db.engine.connect() as connection:
+        result = connection \
+            .execution_options(stream_results=True) \
+            .execute(query)
+        for rows in result.partitions(chunk_size):
+            counts = aggregate((row._mapping for row in rows), counts)
+
+    values = [
+        dict(link_id=link_id, granularity=granularity,
+             bucket_start=bucket_start, hits=hits, misses=misses, bots=bots)
+        for (link_id, granularity, bucket_start), (hits, misses, bots)
+        in (counts or {}).items()
+    ]
+    with db.engine.begin() as connection:
+        connection.execute(delete)
+        connection.execute(delete_totals)
+        if values:
+            connection.execute(rollups.insert(), values)
+        if since is None:
+            _rebuild_counters(connection)
+
+    return len(values)
+
+
+def totals(granularity: str, bucket_starts: list,
+           now: datetime = None) -> dict:
+    """Count hits, misses and bots over every link, for each of the given
+    days or weeks. Closed buckets are read from the 'request_totals' table,
+    being computed from the daily rollups and stored the first time they are
+    needed. Only buckets that are still open are summed on every call, so the
+    cost does not grow with the history being shown.
+
+    Args:
+        granularity (str): either RequestRollup.DAY or RequestRollup.WEEK.
+        bucket_starts (list): the start of each bucket.
+        now (datetime, optional): the current time. Defaults to None, for
+            datetime.now().
+
+    Returns:
+        dict: a mapping of bucket_start to a list of [hits, misses, bots].
+    """
+    now = now or datetime.now()
+    length = LENGTHS[granularity]
+    closed = [
+        start for start in bucket_starts
+        if start + length + CLOSE_DELAY <= now]
+
+    counts = _stored_totals(granularity, closed)
+    missing = [start for start in closed if start not in counts]
+    if missing:
+        computed = _sum_days(granularity, missing)
+        _store_totals(granularity, computed)
+        counts.update(computed)
+
+    pending = [start for start in bucket_starts if start not in counts]
+    if granularity == RequestRollup.DAY:
+        counts.update(_sum_days(granularity, pending))
+    else:
+        # An open week is made up of closed days, which are stored, and the
+        # open days that remain.
+        for start in pending:
+            days = [start + timedelta(days=day) for day in range(7)]
+            days = totals(
+                RequestRollup.DAY, [day for day in days if day <= now], now)
+            counts[start] = [sum(values) for values in zip(*days.values())] \
+                or [0, 0, 0]
+
+    return counts
+
+
+def _stored_totals(granularity: str, bucket_starts: list) -> dict:
+    if not bucket_starts:
+        return {}
+
+    rows = db.session.query(
+        RequestTotal.bucket_start, RequestTotal.hits, RequestTotal.misses,
+        RequestTotal.bots) \
+        .filter(RequestTotal.granularity == granularity) \
+        .filter(RequestTotal.bucket_start.in_(bucket_starts)) \
+        .all()
+    return {start: [hits, misses, bots] for start, hits, misses, bots in rows}
+
+
+def _sum_days(granularity: str, bucket_starts: list) -> dict:
+    """Sum the daily rollups of every link into the given buckets."""
+    if not bucket_starts:
+        return {}
+
+    counts = {start: [0, 0, 0] for start in bucket_starts}
+    end = max(bucket_starts) + LENGTHS[granularity]
+    rows = RequestRollup \
+        .find_by_granularity(RequestRollup.DAY, min(bucket_starts)) \
+        .filter(RequestRollup.bucket_start < end) \
+        .with_entities(
+            RequestRollup.bucket_start, db.func.sum(RequestRollup.hits),
+            db.func.sum(RequestRollup.misses),
+            db.func.sum(RequestRollup.bots)) \
+        .group_by(RequestRollup.bucket_start) \
+        .all()
+
+    for day, hits, misses, bots in rows:
+        count = counts.get(RequestRollup.truncate(day, granularity))
+        if count is not None:
+            count[0] += hits
+            count[1] += misses
+            count[2] += bots
+    return counts
+
+
+def _store_totals(granularity: str, counts: dict):
+    values = [
+        dict(granularity=granularity, bucket_start=start, hits=hits,
+             misses=misses, bots=bots)
+        for start, (hits, misses, bots) in counts.items()]
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(RequestTotal.__table__.insert(), values)
+    except IntegrityError:
+        # Another worker stored the same totals first.
+        pass
+
+
+def _rebuild_counters(connection):
+    links = Link.__table__
+    requests = Request.__table__
+    hits = db.select(db.func.coalesce(db.func.sum(requests.c.weight), 0)) \
+        .where(requests.c.link_id == links.c.id) \
+        .where(requests.c.is_hit) \
+        .scalar_subquery()
+    last_hit_at = db.select(db.func.max(requests.c.end)) \
+        .where(requests.c.link_id == links.c.id) \
+        .where(requests.c.is_hit) \
+        .scalar_subquery()
+    connection.execute(
+        links.update().values(total_hits=hits, last_hit_at=last_hit_at))
+
+
+def _matches(table, link_id, granularity, bucket_start):
+    link = table.c.link_id.is_(None) if link_id is None \
+        else table.c.link_id == link_id
+    return db.and_(
+        link, table.c.granularity == granularity,
+        table.c.bucket_start == bucket_start)
@@ -0,0 +1,154 @@
+import math
+import random
+from threading import Lock
+from time import monotonic
+
+
+# A sample rate that adapts to the link's traffic.
+ADAPTIVE = 0.0
+
+
+def weight_for(rate: float) -> int:
+    """The number of requests that each recorded request stands for, when
+    requests are recorded at the given rate. Rates are rounded to one in a
+    whole number of requests, so that weighted counts stay integers.
+
+    Args:
+        rate (float): the fraction of requests recorded.
+
+    Returns:
+        int: the weight of each recorded request.
+    """
+    return max(1, round(1 / rate)) if rate > 0 else 1
+
+
+class RequestSampler(object):
+    """Decides which requests to a link are recorded, and the weight that a
+    recorded request carries, so that weighted counts estimate the full
+    traffic.
+
+    Links have a fixed sample rate, or adapt it to their traffic when their
+    rate is ADAPTIVE. An adaptive link is recorded in full until this worker
+    sees it take more than REQUEST_SAMPLE_THRESHOLD requests per second over
+    a window of REQUEST_SAMPLE_WINDOW seconds. The rate for the next window
+    is then lowered by powers of ten, until the requests recorded fall back
+    under the threshold.
+
+    Args:
+        threshold (float, optional): requests per second, per worker, above
+            which adaptive links are sampled. Defaults to 50.
+        window (float, optional): seconds over which traffic is measured.
+            Defaults to 10.
+        size (int, optional): the number of adaptive links to measure.
+            Defaults to 10000.
+    """
+
+    def __init__(self, threshold: float = 50, window: float = 10,
+                 size: int = 10000):
+        self.threshold = threshold
+        self.window = window
+        self.size = size
+
+        self._lock = Lock()
+        self._traffic = {}
+        self.random = random.random
+        self.clock = monotonic
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the sampler using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.threshold = app.config.get(
+            'REQUEST_SAMPLE_THRESHOLD', self.threshold)
+        self.window = app.config.get('REQUEST_SAMPLE_WINDOW', self.window)
+        with self._lock:
+            self._traffic.clear()
+
+        app.extensions['request_sampler'] = self
+
+    def weight(self, link) -> int:
+        """Decide whether to record a request to a link.
+
+        Args:
+            link (CachedRoute): the link requested, or None for a miss.
+
+        Returns:
+            int: the weight to record the request with, or 0 if it should not
+                be recorded. Misses are always recorded.
+        """
+        if link is None:
+            return 1
+        if not link.track_requests:
+            return 0
+
+        rate = link.sample_rate
+        weight = self._adaptive_weight(link.link_id) if rate == ADAPTIVE \
+            else weight_for(rate)
+        if weight == 1:
+            return 1
+        if self.random() * weight < 1:
+            with self._lock:
+                self.sampled += 1
+            return weight
+
+        with self._lock:
+            self.skipped += 1
+        return 0
+
+    def _adaptive_weight(self, link_id: int) -> int:
+        now = self.clock()
+        with self._lock:
+            traffic = self._traffic.get(link_id)
+            if traffic is None:
+                if len(self._traffic) >= self.size:
+                    self._prune(now)
+                traffic = self._traffic[link_id] = [now, 0, 1]
+
+            started, count, weight = traffic
+            elapsed = now - started
+            if elapsed >= self.window:
+                # Measure the rate over the window that ended, and choose the
+                # weight that brings it under the threshold.
+                per_second = count / elapsed
+                weight = 1
+                if per_second > self.threshold:
+                    weight = 10 ** math.ceil(
+                        math.log10(per_second / self.threshold))
+                if weight != traffic[2]:
+                    self.adjustments += 1
+                traffic[:] = [now, 0, weight]
+
+            traffic[1] += 1
+            return traffic[2]
+
+    def _prune(self, now: float):
+        stale = [
+            link_id for link_id, (started, _, _) in self._traffic.items()
+            if now - started >= self.window]
+        for link_id in stale or list(self._traffic)[:len(self._traffic) // 2]:
+            del self._traffic[link_id]
+
+    def reset_stats(self):
+        self.sampled = 0
+        self.skipped = 0
+        self.adjustments = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'threshold': self.threshold,
+                'window': self.window,
+                'adaptive_links': len(self._traffic),
+                'sampled_links': sum(
+                    1 for _, _, weight in self._traffic.values()
+                    if weight > 1),
+                'sampled': self.sampled,
+                'skipped': self.skipped,
+                'adjustments': self.adjustments,
+            }
+
+
+request_sampler = RequestSampler()
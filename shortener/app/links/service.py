@@ -0,0 +1,343 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.urls import iri_to_uri
+
+from . import rollups, sketches
+from .agents import parse_user_agent
+from .cache import CachedRoute, route_cache
+from .charts import chart_cache
+from .expiration import expiration_sweeper
+from .sampling import request_sampler
+from .shared import route_invalidation, shared_route_cache
+from .snapshot import route_snapshot
+from .models import Link, Request
+
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_url(url: str) -> str:
+    """Returns a database URL that uses the asyncio driver for its database,
+    such as aiosqlite for SQLite and asyncpg for PostgreSQL.
+
+    Args:
+        url (str): a database URL, as used by SQLALCHEMY_DATABASE_URI.
+
+    Returns:
+        str: the URL with an asyncio driver.
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return str(url.set(drivername=drivername))
+
+
+class RedirectService(object):
+    """An ASGI application that serves '/l/<route>' redirects from asyncio.
+    Lookups go through the route cache and an async connection pool, and
+    concurrent lookups of the same route share one query. Requests are
+    written in batches by a background task, so neither blocks the event
+    loop, and a single process can hold thousands of redirects in flight.
+
+    Args:
+        url (str): the database URL, with an asyncio driver.
+        not_found (bytes): the body served for missing links.
+        pool_size (int, optional): connections kept in the pool. Defaults to
+            20.
+        max_overflow (int, optional): connections allowed beyond pool_size.
+            Defaults to 10.
+        queue_size (int, optional): requests held before new ones are dropped.
+            Defaults to 10000.
+        batch_size (int, optional): requests written per transaction.
+            Defaults to 500.
+        flush_interval (float, optional): the longest time, in seconds, that
+            the writer waits for a request. Defaults to 1.0.
+        logger (Logger, optional): where failures are reported. Defaults to
+            None.
+        secret (str, optional): the key that visitors are hashed with.
+            Defaults to None.
+    """
+
+    PREFIX = '/l/'
+
+    def __init__(self, url: str, not_found: bytes, pool_size: int = 20,
+                 max_overflow: int = 10, queue_size: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 1.0,
+                 logger=None, secret: str = None):
+        self.url = url
+        self.not_found = not_found
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logger
+        self.secret = secret
+
+        self.engine = None
+        self.defaults = Request().to_record()
+        self._lookups = {}
+        self._queue = None
+        self._writer = None
+        self._stopping = None
+        self.reset_stats()
+
+        links = Link.__table__
+        self._query = select(
+            links.c.id, links.c.redirect, links.c.track_requests,
+            links.c.expiration, links.c.sample_rate,
+        ).where(
+            links.c.link == bindparam('route'),
+            links.c.activated,
+        ).limit(1)
+
+    @classmethod
+    def from_app(cls, app):
+        """Create a service using the configuration of the given application.
+        ASYNC_DATABASE_URL defaults to SQLALCHEMY_DATABASE_URI, with an
+        asyncio driver.
+
+        Args:
+            app (Flask): the application to take the configuration from.
+
+        Returns:
+            RedirectService: the configured service.
+        """
+        from .redirects import RedirectApp
+
+        config = app.config
+        url = config.get('ASYNC_DATABASE_URL') \
+            or async_url(config['SQLALCHEMY_DATABASE_URI'])
+        return cls(
+            url, RedirectApp(app).not_found(),
+            pool_size=config.get('ASYNC_POOL_SIZE', 20),
+            max_overflow=config.get('ASYNC_MAX_OVERFLOW', 10),
+            queue_size=config.get('REQUEST_LOG_QUEUE_SIZE', 10000),
+            batch_size=config.get('REQUEST_LOG_BATCH_SIZE', 500),
+            flush_interval=config.get('REQUEST_LOG_FLUSH_INTERVAL', 1.0),
+            logger=app.logger, secret=config.get('SECRET_KEY'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if self.engine is None:
+            await self.startup()
+
+        start = datetime.now()
+        path = scope['path']
+        if not path.startswith(self.PREFIX):
+            await self._respond(send, 404, body=self.not_found)
+            return
+
+        route = path[len(self.PREFIX):]
+        link = await self.find_route(route)
+
+        weight = request_sampler.weight(link)
+        if weight:
+            user_agent = None
+            for name, value in scope['headers']:
+                if name == b'user-agent':
+                    user_agent = value.decode('latin-1')
+                    break
+
+            client = scope.get('client')
+            agent = parse_user_agent(user_agent)
+            self.log(dict(
+                self.defaults, route=route, start=start, end=datetime.now(),
+                is_hit=link is not None, link_id=link and link.link_id,
+                weight=weight, visitor=sketches.visitor_id(
+                    client and client[0], user_agent, self.secret),
+                **agent._asdict()))
+
+        if link:
+            location = link.redirect
+            if not location.isascii():
+                location = iri_to_uri(location, safe_conversion=True)
+            await self._respond(send, 302, [(b'location', location.encode())])
+        else:
+            await self._respond(send, 404, body=self.not_found)
+
+    async def startup(self):
+        """Create the connection pool and start the request writer."""
+        options = {}
+        if make_url(self.url).get_backend_name() != 'sqlite':
+            options.update(
+                pool_size=self.pool_size, max_overflow=self.max_overflow,
+                pool_pre_ping=True)
+
+        self.engine = create_async_engine(self.url, **options)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = asyncio.Event()
+        self._writer = asyncio.ensure_future(self._run())
+
+    async def shutdown(self):
+        """Write any queued requests, then close the connection pool."""
+        if self.engine is None:
+            return
+
+        self._stopping.set()
+        await self._writer
+        await self.engine.dispose()
+        self.engine = None
+
+    async def find_route(self, route: str) -> CachedRoute:
+        """Find the redirect information for an active, unexpired link with the
+        given route, consulting this worker's route cache, the node's shared
+        route cache and the route snapshot before the database.
+
+        Args:
+            route (str): the route requested.
+
+        Returns:
+            CachedRoute: the redirect information, or None if no link exists.
+        """
+        route_invalidation.listen()
+        expiration_sweeper.start()
+        found, value = route_cache.get(route)
+        if found:
+            return value
+
+        lookup = self._lookups.get(route)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup(route))
+            self._lookups[route] = lookup
+            lookup.add_done_callback(
+                lambda _: self._lookups.pop(route, None))
+        else:
+            self.shared_lookups += 1
+
+        # A client that goes away must not cancel a lookup that others share.
+        return await asyncio.shield(lookup)
+
+    async def _lookup(self, route: str) -> CachedRoute:
+        generation = route_cache.generation
+        found, value = shared_route_cache.get(route)
+        if not found:
+            found, value = route_snapshot.get(route)
+        if not found:
+            shared_generation = shared_route_cache.generation
+            async with self.engine.connect() as connection:
+                result = await connection.execute(
+                    self._query, {'route': route})
+                row = result.first()
+
+            self.lookups += 1
+            value = CachedRoute(*row) if row else None
+            if value and value.expiration and \
+                    value.expiration <= datetime.now():
+                value = None
+            shared_route_cache.set(route, value, shared_generation)
+        route_cache.set(route, value, generation)
+        return value
+
+    def log(self, record: dict) -> bool:
+        """Queue a record to be written to the 'requests' table.
+
+        Args:
+            record (dict): the column values of a Request.
+
+        Returns:
+            bool: False if the record was dropped because the queue was full.
+        """
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+        self.queued += 1
+        return True
+
+    async def _run(self):
+        queue = self._queue
+        while not (self._stopping.is_set() and queue.empty()):
+            try:
+                record = await asyncio.wait_for(
+                    queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+
+            batch = [record]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            await self._write(batch)
+
+    async def _write(self, records: list):
+        """Bulk insert a batch of records, updating the rollups, link hit
+        counters and visitor sketches in the same transaction.
+        """
+        try:
+            async with self.engine.begin() as connection:
+                await connection.execute(Request.__table__.insert(), records)
+                await connection.run_sync(rollups.apply, records)
+                await connection.run_sync(rollups.apply_counters, records)
+                await connection.run_sync(sketches.apply, records)
+        except Exception as exception:
+            if self.logger:
+                self.logger.error(
+                    f'Unable to write { len(records) } requests: '
+                    f'{ exception }')
+            self.failed += len(records)
+            return
+
+        # Invalidating the chart cache may write to the database, so it runs
+        # in a thread rather than blocking the event loop.
+        await asyncio.get_running_loop().run_in_executor(
+            None, chart_cache.requests_written, records)
+        self.written += len(records)
+        self.batches += 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _respond(self, send, status: int, headers: list = None,
+                       body: bytes = b''):
+        headers = list(headers or ())
+        if body:
+            headers.append((b'content-type', b'text/html; charset=utf-8'))
+        headers.append((b'content-length', str(len(body)).encode()))
+
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def reset_stats(self):
+        self.lookups = 0
+        self.shared_lookups = 0
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def stats(self) -> dict:
+        return {
+            'lookups': self.lookups,
+            'shared_lookups': self.shared_lookups,
+            'in_flight_lookups': len(self._lookups),
+            'queue_size': self._queue.qsize() if self._queue else 0,
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
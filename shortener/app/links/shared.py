@@ -0,0 +1,450 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import uuid
+from datetime import datetime
+from hashlib import blake2b
+from threading import Event, Lock, Thread
+from time import time
+
+from ..local_redis import redis_from_url
+from .cache import CachedRoute, route_cache
+from .snapshot import route_snapshot
+
+
+MAGIC = b'RSHM'
+FORMAT_VERSION = 2
+
+# Magic, format version, number of slots, slot size and the generation, which
+# is incremented by every invalidation.
+HEADER = struct.Struct('<4sIIIQ')
+GENERATION = struct.Struct('<Q')
+GENERATION_OFFSET = 16
+# Sequence, route hash, link id, expiration (0 for none), when the entry
+# expires, route length, redirect length, whether requests are tracked and the
+# sample rate. The route and redirect follow the slot header.
+SLOT = struct.Struct('<QQQddHH?d')
+SEQUENCE = struct.Struct('<Q')
+KEY_OFFSET = 8
+SLOT_SIZE = 640
+
+
+def _route_hash(route: bytes) -> int:
+    # Zero marks an empty slot.
+    digest = blake2b(route, digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SharedRouteCache(object):
+    """A route cache kept in a memory-mapped file, shared by every worker on
+    a node. Each route hashes to one slot, and a newer entry replaces whatever
+    the slot held.
+
+    Readers take no lock. Writers hold a lock on the file, and make a slot's
+    sequence odd while they change it, so a reader that sees an odd or
+    changed sequence treats the lookup as a miss. Only routes that exist are
+    cached, as misses are cheap to remember in each worker.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.slots = 8192
+        self.ttl = 300
+        self.map = None
+        self._descriptor = None
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the cache using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.close()
+        self.path = app.config.get('ROUTE_SHARED_CACHE_PATH')
+        self.slots = app.config.get('ROUTE_SHARED_CACHE_SLOTS', self.slots)
+        self.ttl = app.config.get('ROUTE_CACHE_TTL', self.ttl)
+        if self.path:
+            self.open()
+
+        app.extensions['shared_route_cache'] = self
+
+    def open(self):
+        """Map the cache file, creating it if it does not exist or was created
+        with a different layout.
+        """
+        size = HEADER.size + self.slots * SLOT_SIZE
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(descriptor, fcntl.LOCK_EX)
+            try:
+                header = os.pread(descriptor, HEADER.size, 0)
+                expected = (MAGIC, FORMAT_VERSION, self.slots, SLOT_SIZE)
+                if len(header) < HEADER.size or \
+                        HEADER.unpack(header)[:4] != expected or \
+                        os.fstat(descriptor).st_size != size:
+                    os.ftruncate(descriptor, 0)
+                    os.ftruncate(descriptor, size)
+                    os.pwrite(descriptor, HEADER.pack(*expected, 0), 0)
+            finally:
+                fcntl.lockf(descriptor, fcntl.LOCK_UN)
+            self.map = mmap.mmap(descriptor, size)
+        except BaseException:
+            os.close(descriptor)
+            raise
+        self._descriptor = descriptor
+
+    def close(self):
+        with self._lock:
+            if self.map is not None:
+                self.map.close()
+                os.close(self._descriptor)
+            self.map = None
+            self._descriptor = None
+
+    @property
+    def generation(self) -> int:
+        if self.map is None:
+            return 0
+        return GENERATION.unpack_from(self.map, GENERATION_OFFSET)[0]
+
+    def get(self, route: str):
+        """Look up a route in the cache.
+
+        Args:
+            route (str): the route requested.
+
+        Returns:
+            tuple: a pair of (found, value). If found is False the route must
+                be looked up elsewhere. Otherwise value is a CachedRoute.
+        """
+        data = self.map
+        if data is None:
+            return False, None
+
+        encoded = route.encode()
+        key = _route_hash(encoded)
+        offset = self._offset(key)
+        sequence, stored, link_id, expiration, expires_at, route_length, \
+            redirect_length, track_requests, sample_rate = \
+            SLOT.unpack_from(data, offset)
+        start = offset + SLOT.size
+        if sequence & 1 or stored != key or route_length != len(encoded):
+            self.misses += 1
+            return False, None
+
+        value = data[start:start + route_length + redirect_length]
+        if SEQUENCE.unpack_from(data, offset)[0] != sequence or \
+                value[:route_length] != encoded:
+            self.misses += 1
+            return False, None
+
+        now = time()
+        if expires_at <= now or (expiration and expiration <= now):
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, CachedRoute(
+            link_id, value[route_length:].decode(), track_requests,
+            datetime.fromtimestamp(expiration) if expiration else None,
+            sample_rate)
+
+    def set(self, route: str, value: CachedRoute, generation: int = None):
+        """Store a route.
+
+        Args:
+            route (str): the route that was looked up.
+            value (CachedRoute): the redirect information.
+            generation (int, optional): the generation observed before the
+                lookup was performed. If the cache has been invalidated since
+                then, the value is discarded. Defaults to None.
+        """
+        if self.map is None or value is None:
+            return
+
+        encoded, redirect = route.encode(), value.redirect.encode()
+        if SLOT.size + len(encoded) + len(redirect) > SLOT_SIZE:
+            self.skipped += 1
+            return
+
+        key = _route_hash(encoded)
+        offset = self._offset(key)
+        expiration = value.expiration.timestamp() if value.expiration else 0.0
+        with self._locked() as data:
+            if generation is not None and generation != self.generation:
+                return
+
+            sequence = SEQUENCE.unpack_from(data, offset)[0] | 1
+            SEQUENCE.pack_into(data, offset, sequence)
+            start = offset + SLOT.size
+            data[start:start + len(encoded) + len(redirect)] = \
+                encoded + redirect
+            SLOT.pack_into(
+                data, offset, sequence, key, value.link_id, expiration,
+                time() + self.ttl, len(encoded), len(redirect),
+                bool(value.track_requests), value.sample_rate)
+            SEQUENCE.pack_into(data, offset, sequence + 1)
+            self.writes += 1
+
+    def invalidate(self, *routes: str):
+        """Remove the given routes, and discard any lookup in flight."""
+        if self.map is None:
+            return
+
+        with self._locked() as data:
+            GENERATION.pack_into(
+                data, GENERATION_OFFSET, self.generation + 1)
+            for route in routes:
+                key = _route_hash(route.encode())
+                offset = self._offset(key)
+                if SEQUENCE.unpack_from(data, offset + KEY_OFFSET)[0] == key:
+                    _empty(data, offset)
+                    self.invalidations += 1
+
+    def clear(self):
+        if self.map is None:
+            return
+
+        with self._locked() as data:
+            GENERATION.pack_into(
+                data, GENERATION_OFFSET, self.generation + 1)
+            for offset in range(HEADER.size, len(data), SLOT_SIZE):
+                _empty(data, offset)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped = 0
+        self.invalidations = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'slots': self.slots if self.map is not None else 0,
+            'bytes': len(self.map) if self.map is not None else 0,
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'skipped': self.skipped,
+            'invalidations': self.invalidations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _offset(self, key: int) -> int:
+        return HEADER.size + (key % self.slots) * SLOT_SIZE
+
+    def _locked(self):
+        return _FileLock(self)
+
+
+def _empty(data: mmap.mmap, offset: int):
+    sequence = SEQUENCE.unpack_from(data, offset)[0] | 1
+    SEQUENCE.pack_into(data, offset, sequence)
+    SEQUENCE.pack_into(data, offset + KEY_OFFSET, 0)
+    SEQUENCE.pack_into(data, offset, sequence + 1)
+
+
+class _FileLock(object):
+    """Holds the cache's thread lock and a lock on its file. File locks are
+    held per process, so the thread lock keeps threads apart.
+    """
+
+    def __init__(self, cache: SharedRouteCache):
+        self.cache = cache
+
+    def __enter__(self):
+        self.cache._lock.acquire()
+        fcntl.lockf(self.cache._descriptor, fcntl.LOCK_EX)
+        return self.cache.map
+
+    def __exit__(self, *exception):
+        fcntl.lockf(self.cache._descriptor, fcntl.LOCK_UN)
+        self.cache._lock.release()
+
+
+shared_route_cache = SharedRouteCache()
+
+
+class RouteInvalidation(object):
+    """Invalidates routes in every cache that holds them, and tells the other
+    workers to do the same.
+
+    Changed routes are removed from this worker's caches and the node's
+    shared route cache, then published on ROUTE_INVALIDATION_CHANNEL through
+    ROUTE_INVALIDATION_URL, which is a Redis URL or 'local://' for an
+    in-process stand-in. Each worker listens on the channel from a background
+    thread, started by its first route lookup, and removes the routes it
+    receives. A worker clears its caches whenever it (re)subscribes, as it may
+    have missed messages, and stops trusting route snapshots built before it
+    resubscribed. A change therefore reaches every worker once the message is
+    delivered, or within ROUTE_CACHE_TTL seconds while the channel is down.
+    """
+
+    def __init__(self):
+        self.url = None
+        self.channel = 'shortener:routes'
+        self.client = None
+        self.app = None
+        self.retry_interval = 1.0
+        self._sender = None
+        self._pid = None
+        self._thread = None
+        self._stopping = Event()
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the channel using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.stop()
+        self.app = app
+        self.url = app.config.get('ROUTE_INVALIDATION_URL')
+        self.channel = app.config.get(
+            'ROUTE_INVALIDATION_CHANNEL', self.channel)
+        self.client = redis_from_url(self.url, 'route invalidation channel') \
+            if self.url else None
+
+        app.extensions['route_invalidation'] = self
+
+    def invalidate(self, *routes: str):
+        """Remove the given routes from every cache, here and elsewhere.
+        Failures to publish are logged rather than raised, as the change has
+        already been committed.
+        """
+        routes = [route for route in routes if route]
+        if not routes:
+            return
+
+        self.apply(routes)
+        if self.client is None:
+            return
+
+        message = json.dumps({'sender': self._sender_id(), 'routes': routes})
+        try:
+            self.client.publish(self.channel, message)
+        except Exception as exception:
+            self._log(f'Unable to publish route invalidations: { exception }')
+            with self._lock:
+                self.failed += 1
+            return
+
+        with self._lock:
+            self.published += 1
+
+    def apply(self, routes: list):
+        route_cache.invalidate(*routes)
+        route_snapshot.invalidate(*routes)
+        shared_route_cache.invalidate(*routes)
+
+    def listen(self):
+        """Start listening for invalidations if this process is not already.
+        Threads are not inherited across a fork, so a listener is started in
+        each child process.
+        """
+        pid = os.getpid()
+        if self.client is None or (
+                self._pid == pid and self._thread is not None):
+            return
+
+        with self._lock:
+            if self._pid != pid or self._thread is None:
+                self._stopping.clear()
+                self._thread = Thread(
+                    target=self._run, name='route-invalidation', daemon=True)
+                self._pid = pid
+                self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            thread.join(timeout)
+        self._thread = None
+        self._stopping.clear()
+
+    def reset_stats(self):
+        self.published = 0
+        self.received = 0
+        self.failed = 0
+        self.subscriptions = 0
+
+    def stats(self) -> dict:
+        thread = self._thread
+        with self._lock:
+            return {
+                'channel': self.channel if self.client is not None else None,
+                'listening': thread is not None and thread.is_alive(),
+                'published': self.published,
+                'received': self.received,
+                'failed': self.failed,
+                'subscriptions': self.subscriptions,
+            }
+
+    def _run(self):
+        failed = False
+        while not self._stopping.is_set():
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+
+                # Messages published while this worker was not subscribed
+                # are lost, so forget anything they might have invalidated.
+                # Other workers keep the shared cache current unless the
+                # channel failed for them too. Snapshots built before now
+                # may hold routes changed during the outage.
+                route_cache.clear()
+                if failed:
+                    shared_route_cache.clear()
+                    route_snapshot.distrust()
+                with self._lock:
+                    self.subscriptions += 1
+
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=self.retry_interval)
+                    if message and message.get('type') == 'message':
+                        self._receive(message['data'])
+            except Exception as exception:
+                self._log(f'Route invalidation channel failed: { exception }')
+                with self._lock:
+                    self.failed += 1
+                failed = True
+                self._stopping.wait(self.retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _receive(self, data: bytes):
+        message = json.loads(data)
+        if message.get('sender') == self._sender_id():
+            return
+
+        self.apply(message['routes'])
+        with self._lock:
+            self.received += 1
+
+    def _sender_id(self) -> str:
+        pid = os.getpid()
+        if self._sender is None or self._sender[0] != pid:
+            self._sender = (pid, uuid.uuid4().hex)
+        return self._sender[1]
+
+    def _log(self, message: str):
+        if self.app is not None:
+            self.app.logger.error(message)
+
+
+route_invalidation = RouteInvalidation()
@@ -0,0 +1,356 @@
+import mmap
+import os
+import struct
+import tempfile
+from datetime import datetime
+from threading import Lock
+from time import monotonic, time
+
+from sqlalchemy import func, or_, select
+
+from .. import db
+
+
+MAGIC = b'RSNP'
+FORMAT_VERSION = 2
+
+# Magic, format version, generation, created at, number of routes.
+HEADER = struct.Struct('<4sIQdQ')
+# Link id, expiration (0 for none), route offset, route length, redirect
+# offset, redirect length, whether requests are tracked and the sample rate.
+# Entries are sorted by route, and offsets point into the strings that follow
+# them.
+ENTRY = struct.Struct('<QdQIQI?d')
+ROUTE = struct.Struct('<QI')
+ROUTE_OFFSET = 16
+
+
+def write(path: str, links, generation: int, created_at: float = None) -> dict:
+    """Write a route snapshot file. The file is written next to its
+    destination and moved into place, so readers never see a partial file.
+
+    Args:
+        path (str): where the snapshot is written.
+        links (iterable): tuples of (link_id, route, redirect,
+            track_requests, expiration, sample_rate).
+        generation (int): the highest link id that the snapshot covers.
+        created_at (float, optional): when the links were read, as a UNIX
+            timestamp. Defaults to None, for the current time.
+
+    Returns:
+        dict: the number of routes, and the size of the file in bytes.
+    """
+    entries = sorted(
+        (route.encode(), redirect.encode(), link_id, track_requests,
+         expiration.timestamp() if expiration else 0.0, sample_rate)
+        for link_id, route, redirect, track_requests, expiration, sample_rate
+        in links)
+
+    offset = HEADER.size + ENTRY.size * len(entries)
+    index, strings = [], []
+    for route, redirect, link_id, track_requests, expiration, sample_rate \
+            in entries:
+        index.append(ENTRY.pack(
+            link_id, expiration, offset, len(route),
+            offset + len(route), len(redirect), bool(track_requests),
+            sample_rate))
+        strings.extend((route, redirect))
+        offset += len(route) + len(redirect)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, generation,
+                created_at if created_at is not None else time(),
+                len(entries)))
+            file.writelines(index)
+            file.writelines(strings)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    return {'routes': len(entries), 'bytes': offset}
+
+
+def build(path: str) -> dict:
+    """Write a snapshot of every active, unexpired link in the database.
+
+    Args:
+        path (str): where the snapshot is written.
+
+    Returns:
+        dict: the generation, number of routes and size of the snapshot.
+    """
+    from .models import Link
+
+    links = Link.__table__
+    created_at = time()
+    with db.engine.connect() as connection:
+        generation = connection.execute(
+            select(func.max(links.c.id))).scalar() or 0
+        result = connection.execution_options(stream_results=True).execute(
+            select(
+                links.c.id, links.c.link, links.c.redirect,
+                links.c.track_requests, links.c.expiration,
+                links.c.sample_rate)
+            .where(links.c.activated, links.c.id <= generation)
+            .where(or_(
+                links.c.expiration.is_(None),
+                links.c.expiration > datetime.fromtimestamp(created_at))))
+        written = write(path, result, generation, created_at)
+
+    return dict(written, generation=generation)
+
+
+class Snapshot(object):
+    """A memory-mapped snapshot file. Pages are shared by every process that
+    maps the file, so a snapshot costs each worker almost no memory.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self.map)
+        magic, version, self.generation, self.created_at, self.count = header
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"'{ path }' is not a route snapshot")
+
+    def find(self, route: bytes) -> tuple:
+        """Binary search the sorted entries for a route.
+
+        Returns:
+            tuple: the unpacked entry, or None if the route is not present.
+        """
+        data = self.map
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = HEADER.size + middle * ENTRY.size
+            offset, length = ROUTE.unpack_from(data, position + ROUTE_OFFSET)
+            candidate = data[offset:offset + length]
+            if candidate < route:
+                low = middle + 1
+            elif candidate > route:
+                high = middle
+            else:
+                return ENTRY.unpack_from(data, position)
+        return None
+
+    def redirect(self, entry: tuple) -> str:
+        offset, length = entry[4], entry[5]
+        return self.map[offset:offset + length].decode()
+
+    def is_current(self, stat) -> bool:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) == (
+            self.stat.st_ino, self.stat.st_mtime_ns, self.stat.st_size)
+
+
+class RouteSnapshot(object):
+    """Serves redirect lookups from a memory-mapped snapshot of every active
+    link, written by 'flask build-route-snapshot'. Routes that are not in the
+    snapshot, such as those created after it was built, are left to the
+    database. Routes changed since the snapshot was built are also left to
+    the database, until a newer snapshot is loaded. Changes made while no
+    snapshot is loaded, or more than MAX_CHANGED of them, are not tracked by
+    route: every snapshot built before them is distrusted instead.
+
+    The file at ROUTE_SNAPSHOT_PATH is checked for a newer snapshot at most
+    every ROUTE_SNAPSHOT_CHECK_INTERVAL seconds.
+    """
+
+    MAX_CHANGED = 10000
+
+    def __init__(self):
+        self.path = None
+        self.check_interval = 5
+        self.snapshot = None
+        self._checked_at = None
+        self._changed = {}
+        self._stale_before = 0.0
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the snapshot using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        from ..metrics import request_metrics
+
+        self.path = app.config.get('ROUTE_SNAPSHOT_PATH')
+        self.check_interval = app.config.get(
+            'ROUTE_SNAPSHOT_CHECK_INTERVAL', self.check_interval)
+        self.unload()
+
+        request_metrics.add_gauge(
+            'route_snapshot_age_seconds',
+            'Seconds since the loaded route snapshot was built.',
+            lambda: self.stats()['age_seconds'])
+        request_metrics.add_gauge(
+            'route_snapshot_routes', 'Routes in the loaded route snapshot.',
+            lambda: self.stats()['routes'])
+        request_metrics.add_gauge(
+            'route_snapshot_bytes', 'Size of the loaded route snapshot.',
+            lambda: self.stats()['bytes'])
+
+        app.extensions['route_snapshot'] = self
+
+    def get(self, route: str):
+        """Look up a route in the snapshot.
+
+        Args:
+            route (str): the route requested.
+
+        Returns:
+            tuple: a pair of (found, value). If found is False the database
+                must be consulted. Otherwise value is a CachedRoute.
+        """
+        from .cache import CachedRoute
+
+        snapshot = self.current()
+        if snapshot is None:
+            return False, None
+        if snapshot.created_at <= self._stale_before:
+            self.stale += 1
+            return False, None
+
+        entry = snapshot.find(route.encode())
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        changed_at = self._changed.get(route)
+        if changed_at is not None and changed_at >= snapshot.created_at:
+            self.stale += 1
+            return False, None
+
+        link_id, expiration, _, _, _, _, track_requests, sample_rate = entry
+        if expiration and expiration <= time():
+            self.expired += 1
+            return False, None
+
+        self.hits += 1
+        return True, CachedRoute(
+            link_id, snapshot.redirect(entry), track_requests,
+            datetime.fromtimestamp(expiration) if expiration else None,
+            sample_rate)
+
+    def current(self) -> Snapshot:
+        """The loaded snapshot, after loading a newer one if the check
+        interval has passed.
+
+        Returns:
+            Snapshot: the snapshot, or None if there is none.
+        """
+        if not self.path:
+            return None
+
+        now = monotonic()
+        checked_at = self._checked_at
+        if checked_at is None or now - checked_at >= self.check_interval:
+            with self._lock:
+                if self._checked_at == checked_at:
+                    self._checked_at = now
+                    self._reload()
+        return self.snapshot
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._forget_changes()
+            self.snapshot = None
+            return
+
+        if self.snapshot is not None and self.snapshot.is_current(stat):
+            return
+
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError, struct.error):
+            return
+
+        # Forget changes that the new snapshot already includes. The old map
+        # is closed once no lookup is using it.
+        self._changed = {
+            route: changed_at for route, changed_at in self._changed.items()
+            if changed_at >= snapshot.created_at}
+        self.snapshot = snapshot
+        self.loads += 1
+
+    def invalidate(self, *routes: str):
+        """Stop serving the given routes from the current snapshot."""
+        if not self.path:
+            return
+
+        # Load the snapshot first, so that a snapshot that is about to be
+        # loaded is tracked by route rather than distrusted.
+        self.current()
+        now = time()
+        with self._lock:
+            if self.snapshot is None \
+                    or len(self._changed) + len(routes) > self.MAX_CHANGED:
+                self._changed.clear()
+                self._stale_before = now
+                return
+
+            for route in routes:
+                self._changed[route] = now
+
+    def distrust(self):
+        """Stop serving routes from the snapshots built so far, when changes
+        may have been missed. Lookups go to the database until a newer
+        snapshot is loaded.
+        """
+        now = time()
+        with self._lock:
+            self._changed.clear()
+            self._stale_before = now
+
+    def _forget_changes(self):
+        # Snapshots loaded later must still skip the routes changed so far.
+        if self._changed:
+            self._stale_before = max(
+                self._stale_before, max(self._changed.values()))
+            self._changed = {}
+
+    def unload(self):
+        with self._lock:
+            self.snapshot = None
+            self._checked_at = None
+            self._changed = {}
+            self._stale_before = 0.0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.loads = 0
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            'path': self.path,
+            'generation': snapshot.generation if snapshot else None,
+            'routes': snapshot.count if snapshot else 0,
+            'bytes': len(snapshot.map) if snapshot else 0,
+            'age_seconds': time() - snapshot.created_at if snapshot else None,
+            'loads': self.loads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'expired': self.expired,
+        }
+
+
+route_snapshot = RouteSnapshot()
@@ -0,0 +1,220 @@
+import atexit
+import os
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from flask import current_app
+
+from .. import db
+
+
+class RequestLogger(object):
+    """A write-behind pipeline for request analytics. Records are pushed onto a
+    bounded, in-memory queue and written to the database in batches by a
+    background worker, so that the redirect path never waits on the database.
+    """
+
+    def __init__(self, queue_size: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, block_timeout: float = 0,
+                 asynchronous: bool = True):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.asynchronous = asynchronous
+
+        self.app = None
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = Event()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Configure the logger using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.app = app
+        self.queue_size = app.config.get(
+            'REQUEST_LOG_QUEUE_SIZE', self.queue_size)
+        self.batch_size = app.config.get(
+            'REQUEST_LOG_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get(
+            'REQUEST_LOG_FLUSH_INTERVAL', self.flush_interval)
+        self.block_timeout = app.config.get(
+            'REQUEST_LOG_BLOCK_TIMEOUT', self.block_timeout)
+        self.asynchronous = app.config.get(
+            'REQUEST_LOG_ASYNC', self.asynchronous)
+
+        app.extensions['request_logger'] = self
+        atexit.register(self.stop)
+
+    def log(self, record: dict) -> bool:
+        """Queue a record to be written to the 'requests' table.
+
+        Args:
+            record (dict): the column values of a Request.
+
+        Returns:
+            bool: False if the record was dropped because the queue was full.
+        """
+        if not self.asynchronous:
+            self._write([record])
+            return True
+
+        queue = self._ensure_worker()
+        try:
+            if self.block_timeout:
+                queue.put(record, timeout=self.block_timeout)
+            else:
+                queue.put_nowait(record)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def flush(self):
+        """Write every queued record to the database, from the calling thread.
+        """
+        if self._queue is None:
+            return
+
+        batch = self._drain(self._queue, self.batch_size)
+        while batch:
+            self._write(batch)
+            batch = self._drain(self._queue, self.batch_size)
+
+    def stop(self, timeout: float = 5):
+        """Stop the background worker, flushing any remaining records.
+
+        Args:
+            timeout (float, optional): seconds to wait for the worker to
+                finish. Defaults to 5.
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            thread.join(timeout)
+        self.flush()
+
+        self._thread = None
+        self._stopping.clear()
+
+    def reset_stats(self):
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def stats(self) -> dict:
+        """Counters describing the state of the pipeline.
+
+        Returns:
+            dict: the current counters, alongside the queue size.
+        """
+        with self._lock:
+            return {
+                'asynchronous': self.asynchronous,
+                'queue_size': self._queue.qsize() if self._queue else 0,
+                'max_queue_size': self.queue_size,
+                'queued': self.queued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'batches': self.batches,
+            }
+
+    def _ensure_worker(self) -> Queue:
+        """Start the background worker if it is not running in this process.
+        Workers are not inherited across a fork, so a new one is started in
+        each child process.
+
+        Returns:
+            Queue: the queue read by the worker.
+        """
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return self._queue
+
+        with self._lock:
+            if self._pid != pid or self._thread is None:
+                self._queue = Queue(maxsize=self.queue_size)
+                self._stopping.clear()
+                self._thread = Thread(
+                    target=self._run, name='request-logger', daemon=True)
+                self._pid = pid
+                self._thread.start()
+
+        return self._queue
+
+    def _run(self):
+        queue = self._queue
+        while not self._stopping.is_set():
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or self._stopping.is_set():
+                    break
+                try:
+                    batch.append(queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+
+    def _write(self, records: list):
+        """Bulk insert a batch of records, updating the rollups, link hit
+        counters and visitor sketches in the same transaction. Failures are
+        logged and counted rather than raised, as nothing is waiting on the
+        result.
+
+        Args:
+            records (list): a list of record dictionaries.
+        """
+        from . import rollups, sketches
+        from .charts import chart_cache
+        from .models import Request
+
+        app = self.app or current_app._get_current_object()
+        try:
+            with self._write_lock, db.get_engine(app).begin() as connection:
+                connection.execute(Request.__table__.insert(), records)
+                rollups.apply(connection, records)
+                rollups.apply_counters(connection, records)
+                sketches.apply(connection, records)
+        except Exception as exception:
+            app.logger.error(
+                f'Unable to write { len(records) } requests: { exception }')
+            with self._lock:
+                self.failed += len(records)
+            return
+
+        chart_cache.requests_written(records)
+        with self._lock:
+            self.written += len(records)
+            self.batches += 1
+
+    @staticmethod
+    def _drain(queue: Queue, size: int) -> list:
+        batch = []
+        while len(batch) < size:
+            try:
+                batch.append(queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+
+request_logger = RequestLogger()
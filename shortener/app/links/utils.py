@@ -1,117 +1,161 @@
 from datetime import datetime, timedelta
 from flask_login import current_user
+from sqlalchemy import func
 
-from .models import Request
+from . import rollups, sketches
+from .models import Link, Request, RequestRollup
 
 
-def __increment_dict(key: str, dictionary: dict):
-    """A helper function that iterates a value in a dictionary. If the key does
-    not exists, then the key is added with the value '1'.
-
-    Args:
-        key (str): the particular key to increment.
-        dictionary (dict): the dictionary that requires incrementing.
-    """
-    if key in dictionary:
-        dictionary[key] += 1
-    else:
-        dictionary[key] = 1
-
-
-def get_link_data(link_id: int) -> dict:
-    """Generate dashboard data, that can be used for graph information.
+def get_link_data(link_id: int, limit: int = 5) -> dict:
+    """Generate dashboard data, that can be used for graph information. The
+    breakdowns are computed by the database, so only the top values are ever
+    loaded. Requests count for their weight, so sampled links are scaled back
+    up to their full traffic.
 
     Args:
         link_id (int): an id for a particular instance of a link.
+        limit (int, optional): the number of browsers and browser versions to
+            include. Defaults to 5.
 
     Returns:
         dict: a dictionary of data that can be fed to chart.js.
     """
-    data = {}
+    data = {
+        'requests': get_daily_hits([link_id]),
+        'visitors': get_unique_visitors([link_id]),
+    }
 
-    requests = Request.find_by_link(link_id).order_by(Request.end.asc()).all()
-    if not requests:
-        return None
+    query = Request.find_by_link(link_id).filter(Request.browser.isnot(None))
+    count = query.with_entities(func.sum(Request.weight)).scalar()
+    if not count:
+        return data if data['requests']['values'] else None
+
+    total = func.sum(Request.weight).label('total')
+    by_browser = query \
+        .with_entities(Request.browser, total) \
+        .group_by(Request.browser) \
+        .order_by(total.desc(), Request.browser) \
+        .limit(limit) \
+        .all()
 
-    count = 0
-    by_browser = {}
-    by_version = {}
-    for request in requests:
-        browser = request.user_agent['browser'].capitalize()
-        version = request.user_agent['version'].split('.')[0]
+    # Convert by_browser to percentage, grouping the remainder as 'Other'.
+    labels = [browser.capitalize() for browser, _ in by_browser]
+    values = [value / count * 100 for _, value in by_browser]
+    other = count - sum(value for _, value in by_browser)
+    if other:
+        labels.append('Other')
+        values.append(other / count * 100)
+    data['browser'] = {'labels': tuple(labels), 'values': tuple(values)}
+
+    by_version = query \
+        .with_entities(Request.browser, Request.browser_version, total) \
+        .group_by(Request.browser, Request.browser_version) \
+        .order_by(total.desc(), Request.browser, Request.browser_version) \
+        .limit(limit) \
+        .all()
 
-        if browser:
-            count += 1
-            __increment_dict(browser, by_browser)
-            __increment_dict(f'{browser} {version}', by_version)
+    # Convert by_version to percentage and split into keys/values.
+    labels = tuple(
+        f'{ browser.capitalize() } { version }'
+        if version is not None else browser.capitalize()
+        for browser, version, _ in by_version)
+    values = tuple(value / count * 100 for _, _, value in by_version)
+    data['version'] = {'labels': labels, 'values': values}
 
-    # Convert by_browser to percentage and split into keys/values.
-    for key in by_browser.keys():
-        by_browser[key] = by_browser[key] / count * 100
+    return data
 
-    labels, values = zip(*by_browser.items())
-    data['browser'] = {'labels': labels, 'values': values}
 
-    # Convert by_version to percentage, sort, and split into keys/values.
-    for key in by_version.keys():
-        by_version[key] = by_version[key] / count * 100
+def get_daily_hits(link_ids, days: int = 7) -> dict:
+    """Count the hits for each of the last few days, using the daily rollups.
 
-    filtered = sorted(by_version.items(), key=lambda x: x[1], reverse=True)[:5]
-    labels, values = zip(*{k: v for k, v in filtered}.items())
-    data['version'] = {'labels': labels, 'values': values}
+    Args:
+        link_ids: the ids of the links to include, either as a list or as a
+            query that selects link ids.
+        days (int, optional): the number of days, including today, to
+            include. Defaults to 7.
 
-    return data
+    Returns:
+        dict: the labels and values for a chart, in date order.
+    """
+    since = datetime.now() - timedelta(days=days - 1)
+    hits = func.sum(RequestRollup.hits)
+    rows = RequestRollup.find_by_granularity(RequestRollup.DAY, since) \
+        .filter(RequestRollup.link_id.in_(link_ids)) \
+        .with_entities(RequestRollup.bucket_start, hits) \
+        .group_by(RequestRollup.bucket_start) \
+        .having(hits > 0) \
+        .order_by(RequestRollup.bucket_start) \
+        .all()
+
+    labels = tuple(bucket_start.strftime('%x') for bucket_start, _ in rows)
+    values = tuple(value for _, value in rows)
+    return {'labels': labels, 'values': values}
+
+
+def get_unique_visitors(link_ids=None, user_id: int = None,
+                        days: int = 7) -> dict:
+    """Estimate the distinct visitors for today and for the last few days,
+    by merging the daily visitor sketches. Visitors are counted once across
+    every day and link. Sampled links only record some of their requests, so
+    their visitors are under-counted.
+
+    Args:
+        link_ids (optional): the ids of the links to include, either as a
+            list or as a query that selects link ids. Defaults to None, for
+            every link of the given user.
+        user_id (int, optional): the owner whose links are included when no
+            link ids are given. Defaults to None, for every link.
+        days (int, optional): the number of days, including today, to
+            include. Defaults to 7.
+
+    Returns:
+        dict: the estimates for today and for the days, with their relative
+            standard error as a percentage.
+    """
+    today, recent = sketches.recent_visitors(link_ids, user_id, days)
+    return {
+        'today': today,
+        'days': recent,
+        'error': sketches.STANDARD_ERROR * 100,
+    }
 
 
-def get_dashboard_data() -> dict:
+def get_dashboard_data(weeks: int = 5) -> dict:
     """Generate dashboard data, that can be used for graph information.
-    Currently interprets only the request data from the past 5 weeks.
+    Interprets the request data from the current week and the few before it.
+    Totals for weeks and days that have closed are only computed once, so
+    only the open days are aggregated on each call. The rollups count each
+    request for its weight, so sampled links are scaled back up.
+
+    Args:
+        weeks (int, optional): the number of weeks before the current one to
+            include. Defaults to 5.
 
     Returns:
         dict: a dictionary of data that can be fed to chart.js.
     """
     data = {}
-    today = datetime.now()
+    now = datetime.now()
 
-    requests = Request.query \
-        .filter(Request.end > (today - timedelta(weeks=5))) \
-        .order_by(Request.end.asc()) \
-        .all()
+    this_week = RequestRollup.truncate(now, RequestRollup.WEEK)
+    starts = [
+        this_week - timedelta(weeks=week) for week in range(weeks, -1, -1)]
+    totals = rollups.totals(RequestRollup.WEEK, starts, now)
+    starts = [start for start in starts if any(totals[start])]
 
-    if not requests:
+    if not starts:
         return None
 
-    requests_by_date = {}
-    hits_week = {}
-    misses_week = {}
-    bots_week = {}
-    link_ids = [link.id for link in current_user.links()]
-    for request in requests:
-        in_range = request.end > (today - timedelta(weeks=1))
-        if request.is_hit and in_range and request.link_id in link_ids:
-            date = request.end.strftime('%x')
-            __increment_dict(date, requests_by_date)
-
-        week = request.end.strftime('Week %W, %Y')
-        if week not in hits_week:
-            hits_week[week] = 0
-        if week not in misses_week:
-            misses_week[week] = 0
-        if week not in bots_week:
-            bots_week[week] = 0
-        __increment_dict(week, hits_week if request.is_hit else misses_week)
-        if request.is_bot:
-            __increment_dict(week, bots_week)
-
-    labels, values = zip(*requests_by_date.items())
-    data['requests'] = {'labels': labels, 'values': values}
-
-    hit_labels, hit_values = zip(*hits_week.items())
-    misses_labels, misses_values = zip(*misses_week.items())
-    bots_labels, bots_values = zip(*bots_week.items())
+    link_ids = current_user.link_query().with_entities(Link.id)
+    data['requests'] = get_daily_hits(link_ids)
+    data['visitors'] = get_unique_visitors(
+        user_id=None if current_user.is_admin else current_user.id)
+
     data['hits'] = {
-        'labels': list(hit_labels), 'misses': list(misses_values),
-        'hits': list(hit_values), 'bots': list(bots_values)
+        'labels': [start.strftime('Week %W, %Y') for start in starts],
+        'hits': [totals[start][0] for start in starts],
+        'misses': [totals[start][1] for start in starts],
+        'bots': [totals[start][2] for start in starts],
     }
 
     return data
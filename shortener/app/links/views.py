@@ -1,10 +1,18 @@
+import io
+
 from flask import (
-    Blueprint, current_app, render_template, request, flash, url_for, redirect
+    Blueprint, current_app, render_template, request, flash, url_for, redirect,
+    jsonify
 )
 from flask_login import login_required, current_user
 from flask_breadcrumbs import register_breadcrumb, default_breadcrumb_root
+from sqlalchemy.exc import IntegrityError
 
-from .forms import QuickLinkForm, LinkForm
+from .. import db
+from . import export
+from .bulk import MIMETYPES, import_links, read_rows
+from .charts import chart_cache
+from .forms import QuickLinkForm, LinkForm, ImportForm
 from .models import Link
 from .utils import get_dashboard_data, get_link_data
 
@@ -19,7 +27,13 @@ def new():
     if form.validate_on_submit():
         link = Link(user_id=current_user.id)
         form.populate_obj(link)
-        link.save()
+        try:
+            link.save()
+        except IntegrityError:
+            # Another link took the same route after the form was validated.
+            db.session.rollback()
+            flash('This link is already in use.', 'danger')
+            return render_template('links/new.html', form=form)
 
         flash(f'The link \'{link.link}\' was created.', 'success')
         return redirect(url_for('links.link', value=link.id))
@@ -29,6 +43,51 @@ def new():
     return render_template('links/new.html', form=form)
 
 
+@links_blueprint.route('/link/import', methods=['GET', 'POST'])
+@register_breadcrumb(links_blueprint, '.dashboard.import', 'Import')
+def bulk():
+    """Import links from an uploaded file with the ImportForm. Files can also
+    be POSTed directly as the request body, with a CSV or JSON lines content
+    type, and are then reported on as JSON.
+
+    The direct upload is an API path: it relies on the session login alone,
+    without the form's CSRF token. Browsers only send those content types
+    cross-site after a CORS preflight, which the application never allows.
+    """
+    format = MIMETYPES.get(request.mimetype)
+    if format and request.method == 'POST':
+        created, errors = _import_file(request.stream, format)
+        return jsonify(created=created, errors=[
+            {'line': number, 'error': error} for number, error in errors
+        ])
+
+    form = ImportForm()
+    errors = None
+    if form.validate_on_submit():
+        created, errors = _import_file(form.file.data.stream, form.format.data)
+
+        category = 'warning' if errors else 'success'
+        flash(f'{ created } links were imported.', category)
+    elif form.is_submitted():
+        flash('There was a problem with the form submission.', 'danger')
+
+    return render_template('links/import.html', form=form, errors=errors)
+
+
+def _import_file(stream, format: str) -> tuple:
+    file = io.TextIOWrapper(
+        stream, encoding='utf-8', errors='replace', newline='')
+    batch_size = current_app.config.get('LINK_IMPORT_BATCH_SIZE', 1000)
+
+    created, errors = 0, []
+    for count, batch_errors in import_links(
+            read_rows(file, format), current_user.id, batch_size):
+        created += count
+        errors.extend(batch_errors)
+
+    return created, errors
+
+
 @links_blueprint.route('/link/<int:value>', methods=['GET', 'POST'])
 @register_breadcrumb(links_blueprint, '.dashboard.value', 'Link')
 def link(value: int):
@@ -41,16 +100,32 @@ def link(value: int):
     form = LinkForm(obj=link)
     if form.validate_on_submit():
         form.populate_obj(link)
-        link.update()
-
-        flash(f'The link \'{link.link}\' was updated.', 'success')
+        try:
+            link.update()
+            flash(f'The link \'{link.link}\' was updated.', 'success')
+        except IntegrityError:
+            db.session.rollback()
+            flash('This link is already in use.', 'danger')
+            link = Link.find_by_id(value).first()
     elif form.is_submitted():
         flash('The given URL was invalid.', 'danger')
 
-    data = get_link_data(link.id)
+    data = chart_cache.link(link.id, lambda: get_link_data(link.id))
     return render_template('links/link.html', form=form, link=link, data=data)
 
 
+@links_blueprint.route('/link/<int:value>/export', methods=['GET'])
+def export_requests(value: int):
+    link = Link.find_by_id(value).first()
+
+    owner = link and (current_user.is_admin or link.user_id == current_user.id)
+    if not owner:
+        flash(f'A link with the id \'{ value }\' does not exist.', 'danger')
+        return redirect(url_for('links.dashboard'))
+
+    return export.response(f'requests-{ link.link }', request.args, [link.id])
+
+
 @links_blueprint.route('/dashboard', methods=['GET', 'POST'])
 @register_breadcrumb(links_blueprint, '.dashboard', 'Dashboard')
 def dashboard():
@@ -59,7 +134,12 @@ def dashboard():
         link = Link(
             link=Link.unique_link(), redirect=form.redirect.data,
             user_id=current_user.id)
-        link.save()
+        try:
+            link.save()
+        except IntegrityError:
+            db.session.rollback()
+            flash('This link is already in use.', 'danger')
+            return redirect(url_for('links.dashboard'))
 
         flash(f'Url \'{ link.full_link() }\' was generated.', 'success')
         return redirect(url_for('links.link', value=link.id))
@@ -67,7 +147,8 @@ def dashboard():
         flash('The given URL was invalid.', 'danger')
 
     try:
-        dashboard_data = get_dashboard_data()
+        dashboard_data = chart_cache.dashboard(
+            current_user.id, get_dashboard_data)
     except Exception as e:
         current_app.logger.warning(f'There was a problem: {e}. Hiding graphs.')
         dashboard_data = None
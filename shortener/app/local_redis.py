@@ -0,0 +1,152 @@
+from queue import Empty, Queue
+from threading import Lock
+from time import monotonic
+
+
+def redis_from_url(url: str, feature: str):
+    """Connect to Redis, or to an in-process stand-in for a URL of 'local://'.
+
+    Args:
+        url (str): the Redis URL.
+        feature (str): what the client is for, named in the error raised when
+            the 'redis' package is missing.
+
+    Raises:
+        RuntimeError: raised if the 'redis' package is not installed.
+
+    Returns:
+        Object: a redis.Redis client, or a LocalRedis.
+    """
+    if url.startswith('local://'):
+        return LocalRedis()
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(
+            f"The 'redis' package is required by the { feature }")
+    return redis.Redis.from_url(url)
+
+
+class LocalRedis(object):
+    """An in-process stand-in for the subset of the redis.Redis interface
+    used by this application, for tests and single process deployments.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+        self._subscribers = {}
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            return self._get(key)
+
+    def mget(self, keys: list) -> list:
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key: str, value, ex: int = None):
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            expires_at = monotonic() + ex if ex else None
+            self._values[key] = (value, expires_at)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._values[key] = (str(value).encode(), None)
+            return value
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(
+                self._values.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match: str):
+        prefix = match.rstrip('*')
+        with self._lock:
+            keys = [key for key in self._values if key.startswith(prefix)]
+        return iter(keys)
+
+    def pipeline(self, transaction: bool = True):
+        return LocalPipeline(self)
+
+    def publish(self, channel: str, message) -> int:
+        if isinstance(message, str):
+            message = message.encode()
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.deliver(channel, message)
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False):
+        return LocalPubSub(self)
+
+    def _subscribe(self, channel: str, subscriber):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+
+    def _unsubscribe(self, channel: str, subscriber):
+        with self._lock:
+            self._subscribers.get(channel, set()).discard(subscriber)
+
+    def _get(self, key: str) -> bytes:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= monotonic():
+            del self._values[key]
+            return None
+        return value
+
+
+class LocalPipeline(object):
+    def __init__(self, client: LocalRedis):
+        self.client = client
+        self._calls = []
+
+    def incr(self, key: str):
+        self._calls.append((self.client.incr, key))
+        return self
+
+    def execute(self) -> list:
+        calls, self._calls = self._calls, []
+        return [method(key) for method, key in calls]
+
+
+class LocalPubSub(object):
+    """The subscriber side of LocalRedis, with the polling interface of
+    redis.client.PubSub. Subscription confirmations are never delivered.
+    """
+
+    def __init__(self, client: LocalRedis):
+        self.client = client
+        self.channels = set()
+        self._messages = Queue()
+
+    def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self.client._subscribe(channel, self)
+
+    def get_message(self, timeout: float = 0.0) -> dict:
+        try:
+            return self._messages.get(timeout=timeout) if timeout \
+                else self._messages.get_nowait()
+        except Empty:
+            return None
+
+    def deliver(self, channel: str, message: bytes):
+        self._messages.put(
+            {'type': 'message', 'pattern': None, 'channel': channel.encode(),
+             'data': message})
+
+    def close(self):
+        for channel in self.channels:
+            self.client._unsubscribe(channel, self)
+        self.channels.clear()
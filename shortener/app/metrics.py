@@ -0,0 +1,305 @@
+import hmac
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import (
+    Response, abort, before_render_template, g, has_request_context, request,
+    template_rendered
+)
+from sqlalchemy import event
+
+from . import db
+
+
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """A Prometheus style histogram, kept per combination of label values.
+
+    Args:
+        name (str): the metric name.
+        documentation (str): the help text of the metric.
+        labels (tuple): the label names.
+        buckets (tuple): the upper bounds of the buckets, in ascending order.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple,
+                 buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labels):
+        """Record a value for the given label values."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # A count per bucket and one for '+Inf', followed by the sum.
+                series = self._series[labels] = [0] * (len(self.buckets) + 1)
+                series.append(0.0)
+            series[index] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[:-1]) if series else 0
+
+    def exposition(self) -> list:
+        """The histogram in the Prometheus text format.
+
+        Returns:
+            list: the lines of the exposition.
+        """
+        lines = [
+            f'# HELP { self.name } { self.documentation }',
+            f'# TYPE { self.name } histogram',
+        ]
+        with self._lock:
+            series = sorted(
+                (labels, list(counts)) for labels, counts in
+                self._series.items())
+
+        bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+        for values, counts in series:
+            labels = list(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f'{ self.name }_bucket'
+                    f'{ _labels(labels + [("le", bound)]) } { cumulative }')
+            lines.append(
+                f'{ self.name }_sum{ _labels(labels) } { counts[-1] }')
+            lines.append(
+                f'{ self.name }_count{ _labels(labels) } { cumulative }')
+        return lines
+
+
+class RequestMetrics(object):
+    """Records the wall time of each request by endpoint, along with the
+    number of queries it made, the time spent in the database and the time
+    spent rendering templates. Metrics are served from '/metrics' in the
+    Prometheus text format, per process, when METRICS_ENABLED is set.
+    """
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds',
+            'Time taken to serve a request.',
+            ('endpoint', 'method', 'status'), DURATION_BUCKETS)
+        self.request_queries = Histogram(
+            'http_request_queries',
+            'Database queries made while serving a request.',
+            ('endpoint',), QUERY_BUCKETS)
+        self.request_query_duration = Histogram(
+            'http_request_query_duration_seconds',
+            'Time spent in the database while serving a request.',
+            ('endpoint',), DURATION_BUCKETS)
+        self.template_duration = Histogram(
+            'template_render_duration_seconds',
+            'Time taken to render a template.',
+            ('template',), DURATION_BUCKETS)
+        self.histograms = (
+            self.request_duration, self.request_queries,
+            self.request_query_duration, self.template_duration)
+        self.gauges = {}
+        self.allowed_addresses = ()
+        self.token = None
+
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Install the request hooks, database listeners and template signals
+        on the given application, and register the '/metrics' endpoint. The
+        endpoint is served to METRICS_ALLOWED_IPS, and to requests that carry
+        METRICS_TOKEN as a bearer token.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+
+        self.allowed_addresses = tuple(
+            app.config.get('METRICS_ALLOWED_IPS', ()))
+        self.token = app.config.get('METRICS_TOKEN')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._rendered, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+        engine = db.get_engine(app)
+        if not event.contains(
+                engine, 'before_cursor_execute', self._before_execute):
+            event.listen(
+                engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+            event.listen(engine, 'handle_error', self._handle_error)
+
+        app.extensions['request_metrics'] = self
+
+    def _before_request(self):
+        g.metrics = {'start': perf_counter(), 'queries': 0, 'seconds': 0.0}
+
+    def _after_request(self, response):
+        metrics = g.pop('metrics', None)
+        if metrics is not None:
+            endpoint = request.endpoint or 'none'
+            self.request_duration.observe(
+                perf_counter() - metrics['start'], endpoint, request.method,
+                str(response.status_code))
+            self.request_queries.observe(metrics['queries'], endpoint)
+            self.request_query_duration.observe(metrics['seconds'], endpoint)
+        return response
+
+    def _before_render(self, app, template, context):
+        g.setdefault('templates', []).append(perf_counter())
+
+    def _rendered(self, app, template, context):
+        starts = g.get('templates')
+        if starts:
+            self.template_duration.observe(
+                perf_counter() - starts.pop(), template.name or 'string')
+
+    def _before_execute(self, connection, cursor, statement, parameters,
+                        context, executemany):
+        connection.info.setdefault('query_start', []).append(perf_counter())
+
+    def _after_execute(self, connection, cursor, statement, parameters,
+                       context, executemany):
+        self._finish_query(connection)
+
+    def _handle_error(self, context):
+        if context.connection is not None:
+            self._finish_query(context.connection)
+
+    def _finish_query(self, connection):
+        starts = connection.info.get('query_start')
+        if not starts:
+            return
+
+        seconds = perf_counter() - starts.pop()
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+        if has_request_context():
+            metrics = g.get('metrics')
+            if metrics is not None:
+                metrics['queries'] += 1
+                metrics['seconds'] += seconds
+
+    def observe(self, endpoint: str, method: str, status: int,
+                seconds: float):
+        """Record a request served outside of Flask, such as by the redirect
+        fast path.
+        """
+        self.request_duration.observe(seconds, endpoint, method, str(status))
+
+    def add_gauge(self, name: str, documentation: str, function):
+        """Expose a value that is read when metrics are collected.
+
+        Args:
+            name (str): the metric name.
+            documentation (str): the help text of the metric.
+            function (function): returns the current value, or None if there
+                is no value.
+        """
+        self.gauges[name] = (documentation, function)
+
+    def view(self):
+        if not self.is_allowed():
+            abort(403)
+        return Response(
+            self.exposition(),
+            mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def is_allowed(self) -> bool:
+        """Whether the current request may read the metrics.
+
+        Returns:
+            bool: True if the request comes from an allowed address, or
+                carries the metrics token.
+        """
+        if request.remote_addr in self.allowed_addresses:
+            return True
+        if not self.token:
+            return False
+        return hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer { self.token }')
+
+    def exposition(self) -> str:
+        """Every metric in the Prometheus text format.
+
+        Returns:
+            str: the exposition.
+        """
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.exposition())
+
+        with self._lock:
+            queries, query_seconds = self.queries, self.query_seconds
+        lines.extend([
+            '# HELP db_queries_total Database queries made by this process.',
+            '# TYPE db_queries_total counter',
+            f'db_queries_total { queries }',
+            '# HELP db_query_seconds_total Time spent in the database by '
+            'this process.',
+            '# TYPE db_query_seconds_total counter',
+            f'db_query_seconds_total { query_seconds }',
+        ])
+
+        for name, (documentation, function) in self.gauges.items():
+            value = function()
+            if value is not None:
+                lines.extend([
+                    f'# HELP { name } { documentation }',
+                    f'# TYPE { name } gauge',
+                    f'{ name } { value }',
+                ])
+        return '\n'.join(lines) + '\n'
+
+    def reset_stats(self):
+        for histogram in self.histograms:
+            histogram.clear()
+        with self._lock:
+            self.queries = 0
+            self.query_seconds = 0.0
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels: list) -> str:
+    if not labels:
+        return ''
+
+    pairs = ','.join(
+        f'{ name }="{ _escape(value) }"' for name, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return str(value) \
+        .replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_metrics = RequestMetrics()
@@ -1,2 +1,6 @@
 from .auth.models import User, AnonymousUser  # noqa: F401; unused-variable
-from .links.models import Link, Request  # noqa: F401; unused-variable
+from .links.models import (  # noqa: F401; unused-variable
+    ChartVersion, Link, LinkSequence, OwnerSketch, Request, RequestRollup,
+    RequestSketch, RequestTotal
+)
+from .settings.models import Setting  # noqa: F401; unused-variable
@@ -0,0 +1,79 @@
+from threading import Lock
+
+from sqlalchemy import event
+
+from . import db
+
+
+class PoolMonitor(object):
+    """Tracks how the database connection pool of an application is used, so
+    that pool sizes can be checked against real traffic. Counters are kept per
+    process, as each worker has its own pool.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self._lock = Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Start monitoring the engine of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        engine = db.get_engine(app)
+        if not event.contains(engine, 'checkout', self._checkout):
+            event.listen(engine, 'connect', self._connect)
+            event.listen(engine, 'checkout', self._checkout)
+            event.listen(engine, 'checkin', self._checkin)
+        self.engine = engine
+
+        app.extensions['pool_monitor'] = self
+
+    def _connect(self, connection, record):
+        with self._lock:
+            self.connections += 1
+
+    def _checkout(self, connection, record, proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(
+                self.peak_checked_out, self.checked_out)
+
+    def _checkin(self, connection, record):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def reset_stats(self):
+        self.connections = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+
+    def stats(self) -> dict:
+        """The state of the pool, alongside counters of its use.
+
+        Returns:
+            dict: the current counters, and the pool size where the pool has
+                one.
+        """
+        pool = self.engine.pool if self.engine is not None else None
+        stats = {'pool': type(pool).__name__ if pool else None}
+        for name in ('size', 'checkedin', 'overflow'):
+            method = getattr(pool, name, None)
+            if method is not None:
+                stats[name] = method()
+
+        with self._lock:
+            stats.update({
+                'connections': self.connections,
+                'checkouts': self.checkouts,
+                'checked_out': self.checked_out,
+                'peak_checked_out': self.peak_checked_out,
+            })
+        return stats
+
+
+pool_monitor = PoolMonitor()
@@ -0,0 +1,304 @@
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from random import random
+from time import perf_counter
+
+from flask import current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+
+from . import db
+
+
+PROFILERS = ('cprofile', 'sampler')
+ARTIFACTS = {'cprofile': 'prof', 'sampler': 'folded'}
+
+
+class StackSampler(object):
+    """A statistical profiler, which samples the stack of one thread from a
+    background thread. Stacks are counted in the collapsed format read by
+    flame graph tools, such as flamegraph.pl and speedscope.
+
+    Args:
+        thread_id (int): the identifier of the thread to sample.
+        interval (float, optional): seconds between samples. Defaults to
+            0.005.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{ code.co_name } ({ os.path.basename(code.co_filename) }'
+                    f':{ code.co_firstlineno })')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        """The sampled stacks, one per line, followed by their count."""
+        return ''.join(
+            f'{ stack } { count }\n'
+            for stack, count in self.stacks.most_common())
+
+
+class ProfileStore(object):
+    """Keeps the most recent profiles in a directory. Each profile is a JSON
+    file of its details, next to a file of the raw profiler output.
+
+    Args:
+        directory (str): where profiles are written.
+        keep (int, optional): the number of profiles kept, after which the
+            oldest are removed. Defaults to 100.
+    """
+
+    ID = re.compile(r'^[0-9]{20}-[0-9]+$')
+
+    def __init__(self, directory: str, keep: int = 100):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, record: dict, suffix: str, data: bytes) -> str:
+        """Write a profile, removing the oldest beyond those kept.
+
+        Args:
+            record (dict): the details of the profile.
+            suffix (str): the file extension of the raw output.
+            data (bytes): the raw profiler output.
+
+        Returns:
+            str: the identifier of the profile.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f'{ datetime.now():%Y%m%d%H%M%S%f}-{ os.getpid() }'
+        record = dict(record, id=profile_id, artifact=suffix)
+
+        with open(self.path(profile_id, suffix), 'wb') as file:
+            file.write(data)
+        with open(self.path(profile_id, 'json'), 'w') as file:
+            json.dump(record, file)
+
+        for old_id in self.ids()[self.keep:]:
+            self.delete(old_id)
+        return profile_id
+
+    def ids(self) -> list:
+        """The identifiers of the stored profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        names = (os.path.splitext(name) for name in os.listdir(self.directory))
+        return sorted(
+            (name for name, suffix in names
+             if suffix == '.json' and self.ID.match(name)),
+            reverse=True)
+
+    def get(self, profile_id: str) -> dict:
+        """The details of a profile, or None if it does not exist."""
+        if not self.ID.match(profile_id):
+            return None
+
+        try:
+            with open(self.path(profile_id, 'json')) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def all(self) -> list:
+        return [record for record in map(self.get, self.ids()) if record]
+
+    def delete(self, profile_id: str):
+        for suffix in ('json', *ARTIFACTS.values()):
+            try:
+                os.remove(self.path(profile_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f'{ profile_id }.{ suffix }')
+
+
+class RequestProfiler(object):
+    """Profiles individual requests, along with the SQL statements that they
+    execute. A request is profiled when an admin sends the PROFILE_HEADER
+    header, or at random with a probability of PROFILE_SAMPLE_RATE. Other
+    requests only pay for checking the header.
+
+    Profiles are written to PROFILE_DIRECTORY, keeping the newest
+    PROFILE_KEEP, and can be browsed from the settings page. PROFILER is
+    either 'cprofile', for deterministic profiles that can be opened with
+    pstats or snakeviz, or 'sampler', for stack samples taken every
+    PROFILE_SAMPLE_INTERVAL seconds that can be turned into flame graphs.
+    """
+
+    def __init__(self):
+        self.profiler = 'cprofile'
+        self.header = 'X-Profile'
+        self.sample_rate = 0.0
+        self.sample_interval = 0.005
+        self.max_statements = 1000
+        self.store = None
+
+    def init_app(self, app):
+        """Configure the profiler using the values of the given application.
+
+        Args:
+            app (Flask): the application being configured.
+        """
+        self.profiler = app.config.get('PROFILER', self.profiler)
+        if self.profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{ self.profiler }'")
+
+        self.header = app.config.get('PROFILE_HEADER', self.header)
+        self.sample_rate = app.config.get(
+            'PROFILE_SAMPLE_RATE', self.sample_rate)
+        self.sample_interval = app.config.get(
+            'PROFILE_SAMPLE_INTERVAL', self.sample_interval)
+        directory = app.config.get('PROFILE_DIRECTORY') \
+            or os.path.join(app.instance_path, 'profiles')
+        self.store = ProfileStore(
+            directory, app.config.get('PROFILE_KEEP', 100))
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        engine = db.get_engine(app)
+        if not event.contains(
+                engine, 'before_cursor_execute', self._before_execute):
+            event.listen(
+                engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+        app.extensions['request_profiler'] = self
+
+    def wanted(self) -> str:
+        """Whether the current request should be profiled.
+
+        Returns:
+            str: why the request is profiled, or None if it is not.
+        """
+        if self.sample_rate and random() < self.sample_rate:
+            return 'sampled'
+        if self.header and self.header in request.headers \
+                and getattr(current_user, 'is_admin', False):
+            return 'requested'
+        return None
+
+    def _before_request(self):
+        reason = self.wanted()
+        if reason is None:
+            return
+
+        if self.profiler == 'sampler':
+            profiler = StackSampler(
+                threading.get_ident(), self.sample_interval)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already running in this thread.
+                return
+
+        g.profile = {
+            'reason': reason, 'profiler': profiler, 'start': perf_counter(),
+            'started_at': datetime.now().isoformat(), 'statements': [],
+        }
+
+    def _after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+
+        profiler = profile['profiler']
+        if self.profiler == 'sampler':
+            profiler.stop()
+            folded = profiler.folded()
+            data = folded.encode()
+            summary = ''.join(folded.splitlines(True)[:50])
+        else:
+            profiler.disable()
+            data = _marshal(profiler)
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output) \
+                .sort_stats('cumulative').print_stats(50)
+            summary = output.getvalue()
+
+        record = {
+            'reason': profile['reason'],
+            'profiler': self.profiler,
+            'started_at': profile['started_at'],
+            'seconds': perf_counter() - profile['start'],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'statements': profile['statements'],
+            'summary': summary,
+        }
+        try:
+            profile_id = self.store.save(
+                record, ARTIFACTS[self.profiler], data)
+        except OSError as exception:
+            current_app.logger.warning(
+                f'Unable to save a profile: { exception }')
+        else:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def _before_execute(self, connection, cursor, statement, parameters,
+                        context, executemany):
+        if has_request_context() and 'profile' in g:
+            connection.info['profile_start'] = perf_counter()
+
+    def _after_execute(self, connection, cursor, statement, parameters,
+                       context, executemany):
+        start = connection.info.pop('profile_start', None)
+        if start is None or not has_request_context():
+            return
+
+        profile = g.get('profile')
+        if profile is not None \
+                and len(profile['statements']) < self.max_statements:
+            profile['statements'].append({
+                'statement': statement,
+                'seconds': perf_counter() - start,
+            })
+
+
+def _marshal(profiler) -> bytes:
+    """The profile in the format written by cProfile.Profile.dump_stats."""
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,186 @@
+from sqlalchemy import bindparam, inspect
+
+from . import db
+
+
+# Indexes that have been replaced, and are dropped by upgrade().
+OBSOLETE_INDEXES = {
+    'links': ('ix_links_link_activated',),
+}
+
+
+def upgrade() -> list:
+    """Bring an existing database up to date with the models. Missing tables
+    are created, missing columns are added (as nullable columns), missing
+    indexes are created and obsolete indexes are dropped. Existing data is
+    left untouched, so creating a unique index fails if the data breaks it.
+
+    Returns:
+        list: a description of each change that was made.
+    """
+    engine = db.engine
+    db.create_all()
+
+    changes = []
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        columns = {
+            column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                _add_column(engine, table, column)
+                changes.append(f'Added column { table.name }.{ column.name }')
+
+        indexes = {
+            index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+                changes.append(f'Created index { index.name }')
+
+        for name in OBSOLETE_INDEXES.get(table.name, ()):
+            if name in indexes:
+                with engine.begin() as connection:
+                    connection.exec_driver_sql(f'DROP INDEX { name }')
+                changes.append(f'Dropped index { name }')
+
+    return changes
+
+
+def _add_column(engine, table, column):
+    preparer = engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=engine.dialect)
+    statement = (
+        f'ALTER TABLE { preparer.format_table(table) } '
+        f'ADD COLUMN { preparer.format_column(column) } { column_type }'
+    )
+    if column.server_default is not None:
+        default = column.server_default.arg
+        default = getattr(default, 'text', default)
+        statement += f' DEFAULT { default }'
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(statement)
+
+
+def backfill_user_agents(chunk_size: int = 1000):
+    """Populate the structured user agent columns of requests that were stored
+    with a pickled user agent. Rows are read and updated in chunks, ordered by
+    id, so that memory use does not depend on the size of the table. The
+    pickled value is cleared once a row has been converted.
+
+    Args:
+        chunk_size (int, optional): the number of rows handled per
+            transaction. Defaults to 1000.
+
+    Yields:
+        int: the number of rows converted in each chunk.
+    """
+    from .links.agents import parse_user_agent
+    from .models import Request
+
+    table = Request.__table__
+    select = db.select(table.c.id, table.c.user_agent) \
+        .where(table.c.user_agent.isnot(None)) \
+        .order_by(table.c.id) \
+        .limit(chunk_size)
+    update = table.update() \
+        .where(table.c.id == bindparam('_id')) \
+        .values(
+            browser=bindparam('browser'),
+            browser_version=bindparam('browser_version'),
+            os_name=bindparam('os_name'),
+            os_version=bindparam('os_version'),
+            platform=bindparam('platform'),
+            is_bot=bindparam('is_bot'),
+            user_agent=None)
+
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(
+                select.where(table.c.id > last_id)).fetchall()
+            if not rows:
+                return
+
+            values = []
+            for id, user_agent in rows:
+                string = (user_agent or {}).get('string')
+                agent = parse_user_agent(string)._asdict()
+                values.append(dict(agent, _id=id))
+            connection.execute(update, values)
+
+        last_id = rows[-1].id
+        yield len(rows)
+
+
+def explain_hot_queries(user, route: str, link_id: int) -> list:
+    """Run EXPLAIN against the statements executed by the hot paths of the
+    application, so that regressions such as sequential scans can be spotted.
+    The statements are captured as the code runs, so they always match what
+    is executed in production.
+
+    Args:
+        user (User): the user that the dashboard queries are performed for.
+        route (str): the route looked up by the redirect query.
+        link_id (int): the link that the link page queries are performed for.
+
+    Returns:
+        list: a list of (name, statement, plan, sequential) tuples, where
+            plan is a list of lines and sequential is True if the plan
+            contains a full table scan.
+    """
+    from flask import current_app
+    from flask_login import login_user
+    from sqlalchemy import event
+
+    from .links.utils import get_dashboard_data, get_link_data
+    from .models import Link
+
+    hot_paths = (
+        ('main.link', lambda: Link.active_with_link(route).first()),
+        ('get_dashboard_data', get_dashboard_data),
+        ('get_link_data', lambda: get_link_data(link_id)),
+        ('User.links', user.links),
+    )
+
+    engine = db.engine
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, many):
+        if not many:
+            statements.append((statement, parameters))
+
+    results = []
+    with current_app.test_request_context():
+        login_user(user)
+        for name, hot_path in hot_paths:
+            statements.clear()
+            event.listen(engine, 'before_cursor_execute', capture)
+            try:
+                hot_path()
+            finally:
+                event.remove(engine, 'before_cursor_execute', capture)
+
+            for statement, parameters in list(statements):
+                plan = _explain(engine, statement, parameters)
+                results.append(
+                    (name, statement, plan, _is_sequential(engine, plan)))
+
+    return results
+
+
+def _explain(engine, statement: str, parameters) -> list:
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' \
+        else 'EXPLAIN '
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters)
+        return [str(row[-1]) for row in rows]
+
+
+def _is_sequential(engine, plan: list) -> bool:
+    if engine.dialect.name == 'sqlite':
+        return any(
+            line.startswith('SCAN') and 'USING' not in line
+            for line in plan)
+    return any('Seq Scan' in line for line in plan)
@@ -1,6 +1,7 @@
 from enum import Enum, unique
 
 from flask import current_app
+from flask_sqlalchemy import BaseQuery
 
 from dateutil import parser
 
@@ -10,8 +11,7 @@ from ..utils import ModelMixin
 
 @unique
 class Type(Enum):
-    """[summary]
-    """
+    """The type of value held by a setting."""
     STRING = 0
     BOOLEAN = 1
     INTEGER = 2
@@ -20,48 +20,54 @@ class Type(Enum):
 
 
 class Setting(db.Model, ModelMixin):
-    """[summary]
-    """
+    """A configurable value, stored as a string alongside its type."""
     __tablename__ = 'setting'
 
+    REQUEST_RETENTION_DAYS = 'requests.retention_days'
+
     id = db.Column(db.Integer, primary_key=True)
-    value_type = db.Column(db.Integer, default=Type.STRING)
+    value_type = db.Column(db.Integer, default=Type.STRING.value)
     key = db.Column(db.String, nullable=False)
     value = db.Column(db.String(500))
 
     @staticmethod
-    def find_by_key(key: str) -> Setting:
-        """[summary]
+    def find_by_key(key: str) -> BaseQuery:
+        """Perform a query on the 'setting' table, to find the setting with
+        the given key.
 
         Args:
-            key (str): [description]
+            key (str): the setting's key.
 
         Returns:
-            Setting: [description]
+            BaseQuery: results of the performed query.
         """
         return Setting.query.filter(Setting.key == key)
 
     @staticmethod
     def value_by_key(key: str):
-        """[summary]
+        """Returns the value of a setting, converted to the setting's type.
 
         Args:
-            key (str): [description]
+            key (str): the setting's key.
 
         Returns:
-            [description]
+            the value of the setting, or None if it does not exist or could
+            not be converted.
         """
         try:
-            setting = Setting.find_by_key(key)
-
-            if setting.value_type is Type.BOOLEAN:
-                return True if setting.value == 'True' else 'False'
-            elif setting.value_type is Type.Integer:
+            setting = Setting.find_by_key(key).first()
+            if setting is None or setting.value is None:
+                return None
+
+            value_type = Type(setting.value_type)
+            if value_type is Type.BOOLEAN:
+                return setting.value == 'True'
+            elif value_type is Type.INTEGER:
                 return int(setting.value)
-            elif setting.value_type is Type.DECIMAl:
+            elif value_type is Type.FLOAT:
                 return float(setting.value)
-            elif setting.value_type is Type.DATETIME:
-                return parser(setting.value)
+            elif value_type is Type.DATETIME:
+                return parser.parse(setting.value)
             else:
                 return setting.value
         except Exception as exception:
@@ -69,3 +75,21 @@ class Setting(db.Model, ModelMixin):
                 .error(f'Error with \'{key}\', returning None: {exception}')
 
         return None
+
+    @staticmethod
+    def set_value(key: str, value, value_type: Type = Type.STRING):
+        """Create or update the setting with the given key.
+
+        Args:
+            key (str): the setting's key.
+            value: the new value, which is stored as a string.
+            value_type (Type, optional): the type of the value. Defaults to
+                Type.STRING.
+
+        Returns:
+            Setting: the saved setting.
+        """
+        setting = Setting.find_by_key(key).first() or Setting(key=key)
+        setting.value_type = value_type.value
+        setting.value = None if value is None else str(value)
+        return setting.save()
@@ -1,7 +1,23 @@
-from flask import Blueprint, render_template, flash, url_for, redirect
+from flask import (
+    Blueprint, render_template, flash, url_for, redirect, request, abort,
+    send_file
+)
 from flask_login import login_required, current_user
 from flask_breadcrumbs import register_breadcrumb, default_breadcrumb_root
 
+from ..links import export
+from ..links.agents import user_agent_classifier
+from ..links.allocator import link_allocator
+from ..links.cache import route_cache
+from ..links.charts import chart_cache
+from ..links.expiration import expiration_sweeper
+from ..links.sampling import request_sampler
+from ..links.shared import route_invalidation, shared_route_cache
+from ..links.snapshot import route_snapshot
+from ..links.tracking import request_logger
+from ..pool import pool_monitor
+from ..profiler import request_profiler
+
 settings_blueprint = Blueprint('settings', __name__, url_prefix='/settings')
 default_breadcrumb_root(settings_blueprint, '.')
 
@@ -9,7 +25,51 @@ default_breadcrumb_root(settings_blueprint, '.')
 @settings_blueprint.route('/', methods=['GET'])
 @register_breadcrumb(settings_blueprint, '.settings', 'Settings')
 def index():
-    return render_template('settings/index.html')
+    statistics = {
+        'Route cache': route_cache.stats(),
+        'Chart cache': chart_cache.stats(),
+        'Route snapshot': route_snapshot.stats(),
+        'Shared route cache': shared_route_cache.stats(),
+        'Route invalidation': route_invalidation.stats(),
+        'Expiration sweeper': expiration_sweeper.stats(),
+        'Request logging': request_logger.stats(),
+        'Request sampling': request_sampler.stats(),
+        'User agent cache': user_agent_classifier.stats(),
+        'Link allocation': link_allocator.stats(),
+        'Database pool': pool_monitor.stats(),
+    }
+    return render_template('settings/index.html', statistics=statistics)
+
+
+@settings_blueprint.route('/export', methods=['GET'])
+def export_requests():
+    link_ids = request.args.getlist('link_id', type=int) or None
+    return export.response('requests', request.args, link_ids)
+
+
+@settings_blueprint.route('/profiles', methods=['GET'])
+@register_breadcrumb(settings_blueprint, '.settings.profiles', 'Profiles')
+def profiles():
+    return render_template(
+        'settings/profiles.html', profiles=request_profiler.store.all(),
+        header=request_profiler.header)
+
+
+@settings_blueprint.route('/profiles/<string:profile_id>', methods=['GET'])
+@register_breadcrumb(
+    settings_blueprint, '.settings.profiles.profile', 'Profile')
+def profile(profile_id: str):
+    record = request_profiler.store.get(profile_id)
+    if record is None:
+        abort(404)
+
+    if 'download' in request.args:
+        path = request_profiler.store.path(profile_id, record['artifact'])
+        return send_file(
+            path, as_attachment=True, mimetype='application/octet-stream',
+            download_name=f'{ profile_id }.{ record["artifact"] }')
+
+    return render_template('settings/profile.html', profile=record)
 
 
 @settings_blueprint.before_request
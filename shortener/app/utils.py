@@ -12,7 +12,7 @@ class ModelMixin(object):
             Object: an instance of the saved object.
         """
         db.session.add(self)
-        db.session.commit()
+        self.commit()
         return self
 
     def update(self):
@@ -22,7 +22,7 @@ class ModelMixin(object):
         Returns:
             Object: an instance of the saved object.
         """
-        db.session.commit()
+        self.commit()
         return self
 
     def delete(self):
@@ -32,5 +32,30 @@ class ModelMixin(object):
             Object: an instance of the deleted object.
         """
         db.session.delete(self)
-        db.session.commit()
+        self.commit()
         return self
+
+    def commit(self):
+        """Commits the current session, calling the object's commit hooks
+        either side of the commit.
+        """
+        state = self.before_commit()
+        db.session.commit()
+        self.after_commit(state)
+
+    def before_commit(self):
+        """Hook called before the object's changes are committed. Useful for
+        capturing state that is no longer available after the commit.
+
+        Returns:
+            Object: any value, which is passed to after_commit.
+        """
+        return None
+
+    def after_commit(self, state):
+        """Hook called once the object's changes have been committed.
+
+        Args:
+            state (Object): the value returned by before_commit.
+        """
+        pass
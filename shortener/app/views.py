@@ -3,8 +3,12 @@ from datetime import datetime
 from flask import current_app, render_template, Blueprint, request, redirect
 from flask_breadcrumbs import register_breadcrumb, default_breadcrumb_root
 
-from .models import Request, Link
-import re
+from .links.agents import parse_user_agent
+from .links.cache import find_route
+from .links.sampling import request_sampler
+from .links.sketches import visitor_id
+from .links.tracking import request_logger
+from .models import Request
 
 main_blueprint = Blueprint('main', __name__)
 default_breadcrumb_root(main_blueprint, '.')
@@ -28,36 +32,27 @@ def link(route: str):
     """
 
     start_time = datetime.now()
-    link = Link.active_with_link(route, include_expiration=True).first()
+    link = find_route(route)
 
-    model = Request(start=start_time, route=route)
+    agent = parse_user_agent(request.user_agent.string)
+    model = Request(
+        start=start_time, route=route, is_hit=False, **agent._asdict())
     if link:
         model.is_hit = True
-        model.link_id = link.id
-
-    model.user_agent = vars(request.user_agent)
-
-    user_agent_string = model.user_agent['string']
-    # Pull extended information from the user agent string
-    if user_agent_string[:11] == 'Mozilla/5.0':
-        expression = re.compile(r'\(([\w\.\s]+);\s([\w\.\s]+)')
-        match = expression.search(user_agent_string)
-
-        model.user_agent['operating_system'] = {
-            'name': match.group(1), 'version': match.group(2)
-        }
-
-    # Determine whether the request is from a bot or not
-    is_bot = re.compile(r'/bot|crawler|spider|crawling/i')
-    model.is_bot = user_agent_string and is_bot.search(user_agent_string)
+        model.link_id = link.link_id
 
     model.end = datetime.now()
-    if not link or link.track_requests:
-        model.save()
-
-    current_app.logger.debug(f'Took { model.duration().microseconds / 1e6 }s')
+    model.weight = request_sampler.weight(link)
+    if model.weight:
+        model.visitor = visitor_id(
+            request.remote_addr, request.user_agent.string,
+            current_app.config.get('SECRET_KEY'))
+        request_logger.log(model.to_record())
+
+    current_app.logger.debug(f'Took { model.duration().total_seconds() }s')
     if link:
-        current_app.logger.info(f"Performed redirect for link '{ link.id }'")
+        current_app.logger.info(
+            f"Performed redirect for link '{ link.link_id }'")
         return redirect(link.redirect, code=302)
     else:
         current_app.logger.info(f"Link with route '{ route }' does not exist")
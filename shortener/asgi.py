@@ -0,0 +1,10 @@
+#!/user/bin/env python
+"""The asyncio redirect service, which serves '/l/<route>' on its own. Run it
+with any ASGI server, for example:
+
+    uvicorn asgi:application --port 8000
+"""
+from app import create_app
+from app.links.service import RedirectService
+
+application = RedirectService.from_app(create_app())
@@ -0,0 +1,90 @@
+"""Benchmark for the redirect path.
+
+Compares requests per second for the main.link view, served by the full
+Flask application, with the lightweight RedirectApp, for both hits and misses.
+Requests are passed straight to each WSGI application, so the numbers exclude
+the web server. A temporary SQLite database is used, and requests are logged
+asynchronously as they are in production, and the per-request log lines of
+main.link are silenced. Run from the 'shortener' directory
+with:
+
+    python -m benchmarks.bench_redirects
+"""
+import logging
+import os
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+
+
+def requests_per_second(application, path: str, number: int) -> float:
+    environ = EnvironBuilder(
+        path=path, headers={'User-Agent': USER_AGENT}).get_environ()
+
+    def start_response(status, headers):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(number):
+        response = application(dict(environ), start_response)
+        for _ in response:
+            pass
+        if hasattr(response, 'close'):
+            response.close()
+    return number / (time.perf_counter() - start)
+
+
+def run(number: int = 2000) -> dict:
+    """Time hits and misses against both redirect implementations.
+
+    Args:
+        number (int, optional): the number of requests per measurement.
+            Defaults to 2000.
+
+    Returns:
+        dict: requests per second for each implementation and case.
+    """
+    directory = tempfile.mkdtemp()
+    os.environ['TEST_DATABASE_URL'] = \
+        'sqlite:///' + os.path.join(directory, 'bench.sqlite3')
+
+    from app import create_app, db
+    from app.links.redirects import RedirectApp
+    from app.links.tracking import request_logger
+    from app.models import Link
+
+    app = create_app(environment='testing')
+    app.logger.setLevel(logging.WARNING)
+    request_logger.asynchronous = True
+
+    with app.app_context():
+        db.create_all()
+        Link(link='abcdef', redirect='https://example.com').save()
+
+    applications = {
+        'main.link': (app.wsgi_app, '/l/'),
+        'RedirectApp': (RedirectApp(app), '/'),
+    }
+
+    results = {}
+    try:
+        for name, (application, prefix) in applications.items():
+            for case, route in (('hit', 'abcdef'), ('miss', 'missing')):
+                # Warm the caches before measuring.
+                requests_per_second(application, prefix + route, 10)
+                results[f'{ name } { case }'] = requests_per_second(
+                    application, prefix + route, number)
+    finally:
+        request_logger.stop()
+
+    return results
+
+
+if __name__ == '__main__':
+    for name, rate in run().items():
+        print(f'{ name:>18}: { rate:,.0f} requests/s')
@@ -0,0 +1,54 @@
+"""Micro-benchmark for user agent classification.
+
+Compares the cost of parsing a user agent from scratch with the cost of a
+cached lookup, which is what the redirect path pays for a repeated user
+agent. Run from the 'shortener' directory with:
+
+    python -m benchmarks.bench_user_agents
+"""
+import timeit
+
+from app.links.agents import UserAgentClassifier
+
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) '
+    'AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 '
+    'Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'curl/8.4.0',
+)
+
+
+def run(number: int = 20000) -> dict:
+    """Time parsing and cached classification of a set of user agents.
+
+    Args:
+        number (int, optional): the number of calls per user agent. Defaults
+            to 20000.
+
+    Returns:
+        dict: the cost per call, in microseconds, for each strategy.
+    """
+    classifier = UserAgentClassifier()
+    calls = number * len(USER_AGENTS)
+
+    def parse():
+        for user_agent in USER_AGENTS:
+            classifier.parse(user_agent)
+
+    def classify():
+        for user_agent in USER_AGENTS:
+            classifier.classify(user_agent)
+
+    return {
+        'parse': timeit.timeit(parse, number=number) / calls * 1e6,
+        'cached': timeit.timeit(classify, number=number) / calls * 1e6,
+    }
+
+
+if __name__ == '__main__':
+    for name, microseconds in run().items():
+        print(f'{ name:>8}: { microseconds:.3f}us per call')
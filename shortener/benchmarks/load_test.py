@@ -0,0 +1,179 @@
+"""Load test for the production server.
+
+Starts gunicorn (with gunicorn.conf.py) for each worker count in turn, and
+drives redirects at it from several client processes over keep-alive
+connections. Reports throughput and latency for each worker count, showing how
+the server scales. By default, a temporary SQLite database with a single link
+is used; pass --url to test a server that is already running instead. Run from
+the 'shortener' directory with:
+
+    python -m benchmarks.load_test --workers 1 2 4 --duration 10
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def client(url: str, duration: float) -> tuple:
+    """Request the URL repeatedly over one connection until the duration has
+    passed.
+
+    Returns:
+        tuple: the number of errors, and the latency of each request in
+            seconds.
+    """
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request('GET', parsed.path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(
+                parsed.hostname, parsed.port)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+    connection.close()
+    return errors, latencies
+
+
+def load(url: str, clients: int, duration: float) -> dict:
+    """Drive the URL from a number of client processes at once.
+
+    Returns:
+        dict: requests per second, errors and latency percentiles (in
+            milliseconds).
+    """
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(client, [(url, duration)] * clients)
+
+    latencies = sorted(
+        latency for _, latencies in results for latency in latencies)
+    errors = sum(errors for errors, _ in results)
+
+    def percentile(value):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * value))]
+
+    return {
+        'requests_per_second': len(latencies) / duration,
+        'errors': errors,
+        'p50': percentile(0.50) * 1e3,
+        'p99': percentile(0.99) * 1e3,
+    }
+
+
+def prepare_database(path: str, route: str) -> str:
+    """Create a SQLite database containing a single link."""
+    url = 'sqlite:///' + path
+    os.environ['DEVELOPMENT_DATABASE_URL'] = url
+
+    from app import create_app, db
+    from app.models import Link
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        Link(link=route, redirect='https://example.com').save()
+
+    return url
+
+
+def start_server(database_url: str, workers: int, threads: int,
+                 port: int, path: str) -> subprocess.Popen:
+    env = dict(
+        os.environ, DATABASE_URL=database_url, FLASK_ENV='production',
+        SECRET_KEY='load-test', WEB_WORKERS=str(workers),
+        WEB_THREADS=str(threads), BIND=f'127.0.0.1:{ port }')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         'wsgi:app'],
+        cwd=base_dir, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+    # Wait until every worker has booted and served a request.
+    deadline = time.monotonic() + 60
+    ready = 0
+    while time.monotonic() < deadline and ready < workers * threads * 4:
+        try:
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            ready += connection.getresponse().status < 500
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    if ready:
+        return server
+
+    server.terminate()
+    raise RuntimeError('The server did not start')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--route', default='load-test')
+    parser.add_argument('--url', help='Test this URL instead of gunicorn.')
+    arguments = parser.parse_args()
+
+    print(f'{ "workers":>8} { "requests/s":>12} { "p50 ms":>8} '
+          f'{ "p99 ms":>8} { "errors":>7}')
+
+    def report(label, result):
+        print(f'{ label:>8} { result["requests_per_second"]:>12,.0f} '
+              f'{ result["p50"]:>8.2f} { result["p99"]:>8.2f} '
+              f'{ result["errors"]:>7}')
+
+    if arguments.url:
+        report('-', load(arguments.url, arguments.clients, arguments.duration))
+        return
+
+    directory = tempfile.mkdtemp()
+    database_url = prepare_database(
+        os.path.join(directory, 'load-test.sqlite3'), arguments.route)
+
+    for workers in arguments.workers:
+        port = free_port()
+        path = f'/l/{ arguments.route }'
+        server = start_server(
+            database_url, workers, arguments.threads, port, path)
+        try:
+            url = f'http://127.0.0.1:{ port }{ path }'
+            report(workers, load(url, arguments.clients, arguments.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Seed a database with users, links and requests for benchmarking.
+
+Rows are inserted with executemany, in chunks, and the rollups and hit
+counters are then rebuilt from the requests, as they would be after a real
+import. Seeding is deterministic for a given seed value.
+"""
+import random
+from datetime import datetime, timedelta
+
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) '
+    'AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 '
+    'Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'curl/8.4.0',
+)
+
+
+def seed(users: int = 10, links: int = 100, requests: int = 10000,
+         days: int = 30, chunk_size: int = 5000, seed: int = 0) -> dict:
+    """Fill the database of the current application. Must be called within an
+    application context, with the tables already created.
+
+    Args:
+        users (int, optional): the number of users. Defaults to 10.
+        links (int, optional): the number of links per user. Defaults to 100.
+        requests (int, optional): the number of requests, spread over every
+            link and the given number of days. Defaults to 10000.
+        days (int, optional): how far back requests go. Defaults to 30.
+        chunk_size (int, optional): rows inserted per statement. Defaults to
+            5000.
+        seed (int, optional): the random seed. Defaults to 0.
+
+    Returns:
+        dict: the 'user_id' of the first user, and the 'route' and 'link_id'
+            of one of its links.
+    """
+    from app import db
+    from app.links import rollups
+    from app.links.agents import parse_user_agent
+    from app.models import Link, Request, User
+
+    generator = random.Random(seed)
+    now = datetime.now()
+
+    # Passwords are hashed, so users are created one at a time.
+    user_ids = []
+    for index in range(users):
+        user = User(
+            username=f'user{ index }', email=f'user{ index }@example.com',
+            password='password')
+        user_ids.append(user.save().id)
+
+    records = (
+        {
+            'user_id': user_id,
+            'link': f'u{ user_id }l{ index }',
+            'redirect': f'https://example.com/{ user_id }/{ index }',
+            'activated': True,
+            'track_requests': True,
+            'created_at': now - timedelta(days=days),
+        }
+        for user_id in user_ids for index in range(links)
+    )
+    _insert(db, Link.__table__, records, chunk_size)
+
+    routes = db.session.query(Link.id, Link.link).order_by(Link.id).all()
+    agents = [parse_user_agent(agent)._asdict() for agent in USER_AGENTS]
+
+    def request(index):
+        end = now - timedelta(seconds=generator.randrange(days * 86400))
+        link_id, route = None, 'missing'
+        if routes and generator.random() < 0.9:
+            link_id, route = generator.choice(routes)
+        return dict(
+            generator.choice(agents), link_id=link_id, route=route,
+            is_hit=link_id is not None, start=end, end=end, user_agent=None)
+
+    _insert(db, Request.__table__, map(request, range(requests)), chunk_size)
+    rollups.rebuild()
+
+    first = Link.query.filter(Link.user_id == user_ids[0]).first()
+    return {
+        'user_id': user_ids[0],
+        'route': first.link if first else None,
+        'link_id': first.id if first else None,
+    }
+
+
+def _insert(db, table, records, chunk_size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert(), chunk)
+            chunk = []
+
+    if chunk:
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), chunk)
@@ -0,0 +1,317 @@
+"""Benchmark suite for the hot endpoints.
+
+Seeds a database, then measures redirect hits and misses, the dashboard, the
+link page and link creation. Each scenario runs through the Flask test client
+and through a real, threaded WSGI server on localhost, which serves the
+application as wsgi.py does (including the redirect fast path). For each one
+the suite reports latency percentiles, throughput and the peak memory
+allocated per request.
+
+Results can be written as JSON, and compared against an earlier run, failing
+if any scenario regressed by more than the tolerance. Run from the 'shortener'
+directory with:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --compare results.json --tolerance 0.2
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+SCENARIOS = ('redirect_hit', 'redirect_miss', 'dashboard', 'link', 'create')
+TRANSPORTS = ('client', 'server')
+
+
+class TestClientTransport(object):
+    """Sends requests through the Flask test client."""
+
+    def __init__(self, app, cookie: tuple):
+        self.client = app.test_client()
+        self.client.set_cookie('localhost', *cookie)
+
+    def request(self, method: str, path: str, data: dict = None) -> int:
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerTransport(object):
+    """Sends requests to a threaded WSGI server on localhost, over a
+    keep-alive connection.
+    """
+
+    def __init__(self, app, cookie: tuple):
+        from werkzeug.serving import make_server
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.server.protocol_version = 'HTTP/1.1'
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.connection = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_port)
+        self.headers = {'Cookie': '='.join(cookie)}
+
+    def request(self, method: str, path: str, data: dict = None) -> int:
+        headers = dict(self.headers)
+        body = None
+        if data is not None:
+            from urllib.parse import urlencode
+
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self.connection.close()
+        self.server.shutdown()
+
+
+def scenarios(context: dict) -> dict:
+    """The requests made by each scenario, as functions of the iteration."""
+    return {
+        'redirect_hit': lambda _: ('GET', f'/l/{ context["route"] }', None),
+        'redirect_miss': lambda index: ('GET', f'/l/missing{ index }', None),
+        'dashboard': lambda _: ('GET', '/dashboard', None),
+        'link': lambda _: ('GET', f'/link/{ context["link_id"] }', None),
+        'create': lambda index: ('POST', '/dashboard', {
+            'redirect': f'https://example.com/created/{ index }'}),
+    }
+
+
+def measure(transport, request, iterations: int, warmup: int,
+            allocations: int) -> dict:
+    """Time a scenario, then measure its allocations in a separate, shorter
+    pass, as tracing memory slows every request down.
+
+    Returns:
+        dict: the results for the scenario.
+    """
+    for index in range(warmup):
+        transport.request(*request(index))
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for index in range(warmup, warmup + iterations):
+        began = time.perf_counter()
+        status = transport.request(*request(index))
+        latencies.append(time.perf_counter() - began)
+        errors += status >= 500
+    elapsed = time.perf_counter() - start
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        offset = warmup + iterations
+        for index in range(offset, offset + allocations):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            transport.request(*request(index))
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+
+    def percentile(value):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * value))]
+
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'requests_per_second': iterations / elapsed,
+        'mean_ms': sum(latencies) / len(latencies) * 1e3,
+        'p50_ms': percentile(0.50) * 1e3,
+        'p95_ms': percentile(0.95) * 1e3,
+        'p99_ms': percentile(0.99) * 1e3,
+        'peak_kib': sum(peaks) / len(peaks) / 1024 if peaks else 0.0,
+    }
+
+
+def run(arguments) -> dict:
+    """Seed a database and run every selected scenario.
+
+    Returns:
+        dict: the environment the suite ran in, and the results keyed by
+            '<transport>:<scenario>'.
+    """
+    if arguments.database_url:
+        os.environ['TEST_DATABASE_URL'] = arguments.database_url
+    else:
+        os.environ['TEST_DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'benchmarks.sqlite3')
+
+    from app import create_app, db
+    from app.links import redirects
+    from app.links.tracking import request_logger
+    from benchmarks.seed import seed
+
+    app = create_app(environment='testing')
+    app.config['SECRET_KEY'] = 'benchmarks'
+    app.logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        context = seed(
+            users=arguments.users, links=arguments.links,
+            requests=arguments.requests)
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    session = serializer.dumps(
+        {'_user_id': str(context['user_id']), '_fresh': True})
+    cookie = (app.session_cookie_name, session)
+
+    served = create_app(environment='testing')
+    served.config['SECRET_KEY'] = 'benchmarks'
+    served.logger.setLevel(logging.WARNING)
+    redirects.mount(served)
+    applications = {'client': app, 'server': served}
+    # Log requests in the background, as production does. This is set after
+    # both applications are created, as each configures the logger.
+    request_logger.asynchronous = True
+
+    results = {}
+    requests = scenarios(context)
+    try:
+        for name in arguments.transports:
+            transport = (
+                TestClientTransport if name == 'client' else ServerTransport
+            )(applications[name], cookie)
+            try:
+                for scenario in arguments.scenarios:
+                    results[f'{ name }:{ scenario }'] = measure(
+                        transport, requests[scenario], arguments.iterations,
+                        arguments.warmup, arguments.allocations)
+            finally:
+                transport.close()
+    finally:
+        request_logger.stop()
+
+    return {
+        'environment': environment(arguments),
+        'results': results,
+    }
+
+
+def environment(arguments) -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'users': arguments.users,
+        'links': arguments.links,
+        'requests': arguments.requests,
+        'iterations': arguments.iterations,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Find the scenarios that are slower than the baseline, by more than the
+    tolerance, in either throughput or p95 latency.
+
+    Args:
+        results (dict): results from run().
+        baseline (dict): earlier results from run().
+        tolerance (float): the allowed fraction of slowdown, such as 0.2.
+
+    Returns:
+        list: a description of each regression.
+    """
+    regressions = []
+    for key, result in results['results'].items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+
+        throughput = result['requests_per_second']
+        if throughput < before['requests_per_second'] * (1 - tolerance):
+            regressions.append(
+                f'{ key }: { throughput:,.0f} requests/s, down from '
+                f'{ before["requests_per_second"]:,.0f}')
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{ key }: p95 of { result["p95_ms"]:.2f}ms, up from '
+                f'{ before["p95_ms"]:.2f}ms')
+
+    return regressions
+
+
+def report(results: dict):
+    print(f'{ "scenario":<24} { "req/s":>9} { "p50 ms":>8} { "p95 ms":>8} '
+          f'{ "p99 ms":>8} { "peak KiB":>9} { "errors":>7}')
+    for key, result in results['results'].items():
+        print(f'{ key:<24} { result["requests_per_second"]:>9,.0f} '
+              f'{ result["p50_ms"]:>8.2f} { result["p95_ms"]:>8.2f} '
+              f'{ result["p99_ms"]:>8.2f} { result["peak_kib"]:>9.1f} '
+              f'{ result["errors"]:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--links', type=int, default=100,
+                        help='Links per user.')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--allocations', type=int, default=50,
+                        help='Requests traced to measure allocations.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument('--transports', nargs='+', choices=TRANSPORTS,
+                        default=list(TRANSPORTS))
+    parser.add_argument('--database-url',
+                        help='Defaults to a temporary SQLite database.')
+    parser.add_argument('--output', help='Write the results to this file.')
+    parser.add_argument('--compare', help='Compare with an earlier output.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    arguments = parser.parse_args()
+
+    results = run(arguments)
+    report(results)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            regressions = compare(
+                results, json.load(file), arguments.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION { regression }')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,52 @@ import os
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
+# Threads in each worker that use the database besides those serving
+# requests: the request logger and the expiration sweeper.
+BACKGROUND_THREADS = 2
+
+
+def engine_options(url: str, workers: int = 1, threads: int = 1,
+                   max_connections: int = 100,
+                   statement_timeout: int = 5000) -> dict:
+    """SQLAlchemy engine options for a server with the given number of worker
+    processes and threads. Each worker holds its own pool, with a connection
+    for every thread and for each of the BACKGROUND_THREADS. Pools are capped
+    at an equal share of the database's max_connections, and overflow
+    connections are shared out from whatever is left of it.
+
+    Args:
+        url (str): the database URL.
+        workers (int, optional): worker processes. Defaults to 1.
+        threads (int, optional): threads per worker. Defaults to 1.
+        max_connections (int, optional): connections the database allows
+            this application. Defaults to 100.
+        statement_timeout (int, optional): milliseconds before a statement is
+            cancelled, on PostgreSQL. Defaults to 5000.
+
+    Returns:
+        dict: a value for SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    if url.startswith('sqlite'):
+        return {}
+
+    share = max(1, max_connections // workers)
+    pool_size = min(threads + BACKGROUND_THREADS, share)
+    max_overflow = max(0, min(threads, share - pool_size))
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+    if url.startswith('postgres'):
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={ statement_timeout }'
+        }
+
+    return options
+
 
 class BaseConfig(object):
     """Base configuration."""
@@ -12,6 +58,111 @@ class BaseConfig(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = False
 
+    # Route cache, used by the redirect path. Sizes are numbers of routes and
+    # TTLs are in seconds.
+    ROUTE_CACHE_SIZE = 1024
+    ROUTE_CACHE_TTL = 300
+    ROUTE_CACHE_NEGATIVE_SIZE = 4096
+    ROUTE_CACHE_NEGATIVE_TTL = 30
+
+    # Chart data for the dashboard and link pages, cached per user or link
+    # and day. CHART_CACHE_BACKEND is 'memory', 'redis' or 'none', and the
+    # redis backend connects to CHART_CACHE_URL. The memory backend caches
+    # values per worker, but keeps the versions that invalidate them in the
+    # 'chart_versions' table, so writes by any process are seen. Entries
+    # last for CHART_CACHE_TTL seconds, and are served for
+    # CHART_CACHE_MAX_STALENESS seconds after new requests arrive.
+    CHART_CACHE_BACKEND = os.environ.get('CHART_CACHE_BACKEND', 'memory')
+    CHART_CACHE_URL = os.environ.get('CHART_CACHE_URL')
+    CHART_CACHE_SIZE = 1024
+    CHART_CACHE_TTL = 300
+    CHART_CACHE_MAX_STALENESS = 5
+
+    # A memory-mapped snapshot of every active route, written by 'flask
+    # build-route-snapshot' and consulted before the database. Workers check
+    # for a newer snapshot every ROUTE_SNAPSHOT_CHECK_INTERVAL seconds.
+    ROUTE_SNAPSHOT_PATH = os.environ.get(
+        'ROUTE_SNAPSHOT_PATH', os.path.join(base_dir, 'routes.snapshot'))
+    ROUTE_SNAPSHOT_CHECK_INTERVAL = 5
+
+    # A route cache shared by the workers on a node, kept in the file at
+    # ROUTE_SHARED_CACHE_PATH (best placed in /dev/shm), and the channel that
+    # carries route invalidations to every worker. ROUTE_INVALIDATION_URL is
+    # a Redis URL, or 'local://' for a single process.
+    ROUTE_SHARED_CACHE_PATH = os.environ.get('ROUTE_SHARED_CACHE_PATH')
+    ROUTE_SHARED_CACHE_SLOTS = 8192
+    ROUTE_INVALIDATION_URL = os.environ.get('ROUTE_INVALIDATION_URL')
+    ROUTE_INVALIDATION_CHANNEL = 'shortener:routes'
+
+    # Expired links are deactivated by a background thread in each worker.
+    # Upcoming expirations are read every EXPIRATION_SWEEP_INTERVAL seconds,
+    # for the next EXPIRATION_SWEEP_HORIZON seconds.
+    EXPIRATION_SWEEP_ENABLED = True
+    EXPIRATION_SWEEP_INTERVAL = 60
+    EXPIRATION_SWEEP_HORIZON = 300
+
+    # User agent classification. BOT_SIGNATURES holds extra, case-insensitive
+    # regular expressions that identify bots.
+    USER_AGENT_CACHE_SIZE = 4096
+    BOT_SIGNATURES = []
+
+    # Request logging. Records are queued and written in batches of up to
+    # REQUEST_LOG_BATCH_SIZE, at least every REQUEST_LOG_FLUSH_INTERVAL
+    # seconds. When the queue is full, the redirect waits for up to
+    # REQUEST_LOG_BLOCK_TIMEOUT seconds before the record is dropped.
+    REQUEST_LOG_ASYNC = True
+    REQUEST_LOG_QUEUE_SIZE = 10000
+    REQUEST_LOG_BATCH_SIZE = 500
+    REQUEST_LOG_FLUSH_INTERVAL = 1.0
+    REQUEST_LOG_BLOCK_TIMEOUT = 0
+
+    # Links with an adaptive sample rate are sampled once a worker sees more
+    # than REQUEST_SAMPLE_THRESHOLD requests per second to them, measured
+    # over REQUEST_SAMPLE_WINDOW seconds.
+    REQUEST_SAMPLE_THRESHOLD = 50
+    REQUEST_SAMPLE_WINDOW = 10
+
+    # Link allocation, either 'sequence' or 'random'. Sequence links come from
+    # blocks of LINK_ALLOCATOR_BLOCK_SIZE counter values, permuted using
+    # LINK_ALLOCATOR_KEY, which must not change once links have been handed
+    # out. Links grow by a character once LINK_ALLOCATOR_THRESHOLD of the
+    # links of the current size have been allocated.
+    LINK_ALLOCATOR = 'sequence'
+    LINK_ALLOCATOR_BLOCK_SIZE = 100
+    LINK_ALLOCATOR_THRESHOLD = 0.5
+    LINK_ALLOCATOR_KEY = os.environ.get('LINK_ALLOCATOR_KEY')
+
+    # Serve redirects from a minimal WSGI application mounted by wsgi.py,
+    # rather than the main.link view.
+    REDIRECT_FAST_PATH = True
+
+    # The asyncio redirect service in asgi.py. ASYNC_DATABASE_URL defaults to
+    # the database URL, using the aiosqlite or asyncpg driver.
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASYNC_POOL_SIZE = 20
+    ASYNC_MAX_OVERFLOW = 10
+
+    # Bulk imports are checked and inserted this many rows at a time.
+    LINK_IMPORT_BATCH_SIZE = 1000
+
+    # Serve request, query and template timings from '/metrics'. They are
+    # only served to METRICS_ALLOWED_IPS, or to scrapers that send
+    # 'Authorization: Bearer <METRICS_TOKEN>'.
+    METRICS_ENABLED = True
+    METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Request profiling, with PROFILER either 'cprofile' or 'sampler'. Admins
+    # profile a request by sending PROFILE_HEADER, and PROFILE_SAMPLE_RATE of
+    # all requests are profiled. The newest PROFILE_KEEP profiles are kept in
+    # PROFILE_DIRECTORY, which defaults to 'profiles' in the instance folder.
+    PROFILER = 'cprofile'
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_SAMPLE_RATE = 0.0
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_KEEP = 100
+    PROFILE_DIRECTORY = os.environ.get('PROFILE_DIRECTORY')
+
     @staticmethod
     def configure(app):
         # Implement this method to do further configuration on your app.
@@ -33,6 +184,12 @@ class TestingConfig(BaseConfig):
 
     TESTING = True
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    REQUEST_LOG_ASYNC = False
+    CHART_CACHE_MAX_STALENESS = 0
+    ROUTE_SNAPSHOT_PATH = None
+    ROUTE_SHARED_CACHE_PATH = None
+    ROUTE_INVALIDATION_URL = None
+    EXPIRATION_SWEEP_ENABLED = False
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         'TEST_DATABASE_URL', 'sqlite:///' +
         os.path.join(base_dir, 'database-test.sqlite3')
@@ -46,6 +203,14 @@ class ProductionConfig(BaseConfig):
         'DATABASE_URL', 'sqlite:///' +
         os.path.join(base_dir, 'database.sqlite3')
     )
+    # WEB_WORKERS and WEB_THREADS are set by gunicorn.conf.py.
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        workers=int(os.environ.get('WEB_WORKERS', 1)),
+        threads=int(os.environ.get('WEB_THREADS', 1)),
+        max_connections=int(os.environ.get('DATABASE_MAX_CONNECTIONS', 100)),
+        statement_timeout=int(os.environ.get('STATEMENT_TIMEOUT', 5000)),
+    )
     WTF_CSRF_ENABLED = True
 
 
@@ -0,0 +1,30 @@
+"""Gunicorn configuration for production. Run with:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Workers and threads are sized from the number of CPUs, and can be set with
+WEB_WORKERS and WEB_THREADS. Both are exported so that ProductionConfig can
+size the database pool of each worker to match.
+"""
+import multiprocessing
+import os
+
+workers = int(
+    os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+os.environ['WEB_WORKERS'] = str(workers)
+os.environ['WEB_THREADS'] = str(threads)
+os.environ.setdefault('FLASK_ENV', 'production')
+
+worker_class = 'gthread'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+
+# Restart workers now and then, so that slow leaks cannot build up.
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = os.environ.get('ACCESS_LOG')
+errorlog = '-'
@@ -0,0 +1,52 @@
+from unittest import TestCase, main
+
+from app.links.agents import UserAgentClassifier
+
+CHROME = (
+  'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+  '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+GOOGLEBOT = (
+  'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+)
+
+
+class TestUserAgentClassifier(TestCase):
+  def setUp(self):
+    self.classifier = UserAgentClassifier()
+
+  def test_browser(self):
+    agent = self.classifier.classify(CHROME)
+    self.assertEqual(agent.browser, 'chrome')
+    self.assertEqual(agent.browser_version, 120)
+    self.assertEqual(agent.platform, 'windows')
+    self.assertEqual((agent.os_name, agent.os_version),
+                     ('Windows NT 10.0', 'Win64'))
+    self.assertFalse(agent.is_bot)
+
+  def test_bots(self):
+    for user_agent in (GOOGLEBOT, 'curl/8.4.0', 'SomeCrawler/1.0'):
+      self.assertTrue(self.classifier.classify(user_agent).is_bot, user_agent)
+
+  def test_unmatched_operating_system(self):
+    agent = self.classifier.classify('Mozilla/5.0')
+    self.assertIsNone(agent.os_name)
+
+  def test_empty(self):
+    self.assertFalse(self.classifier.classify('').is_bot)
+    self.assertIsNone(self.classifier.classify(None).browser)
+
+  def test_cache(self):
+    self.classifier.classify(CHROME)
+    self.classifier.classify(CHROME)
+    stats = self.classifier.stats()
+    self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+  def test_extra_signatures(self):
+    self.classifier.configure(16, ('internal-checker',))
+    self.assertTrue(self.classifier.classify('Internal-Checker/2').is_bot)
+    self.assertFalse(self.classifier.classify(GOOGLEBOT).is_bot)
+
+
+if __name__ == "__main__":
+  main()
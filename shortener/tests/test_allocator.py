@@ -0,0 +1,77 @@
+from unittest import TestCase, main
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db, create_app
+from app.links.allocator import RandomAllocator, SequenceAllocator
+from app.models import Link, LinkSequence
+
+app = create_app(environment='testing')
+
+
+class TestSequenceAllocator(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_permutation_is_a_bijection(self):
+    allocator = SequenceAllocator(size=2)
+    values = {allocator.permute(value, 2) for value in range(64 ** 2)}
+    self.assertEqual(values, set(range(64 ** 2)))
+
+  def test_links_are_unique(self):
+    allocator = SequenceAllocator(block_size=10)
+    links = [allocator.allocate() for _ in range(35)]
+    self.assertEqual(len(set(links)), 35)
+    self.assertTrue(all(len(link) == Link.LINK_SIZE for link in links))
+    self.assertEqual(allocator.stats()['reservations'], 4)
+    sequence = db.session.get(LinkSequence, Link.LINK_SIZE)
+    self.assertEqual(sequence.next_value, 40)
+
+  def test_blocks_are_not_shared(self):
+    first = SequenceAllocator(block_size=5)
+    second = SequenceAllocator(block_size=5)
+    links = {first.allocate() for _ in range(5)}
+    links |= {second.allocate() for _ in range(5)}
+    self.assertEqual(len(links), 10)
+
+  def test_taken_links_are_skipped(self):
+    allocator = SequenceAllocator(block_size=5)
+    taken = SequenceAllocator(block_size=5).encode(0, Link.LINK_SIZE)
+    Link(link=taken, redirect='https://example.com').save()
+
+    self.assertNotEqual(allocator.allocate(), taken)
+    self.assertEqual(allocator.stats()['collisions'], 1)
+
+  def test_size_grows_past_threshold(self):
+    allocator = SequenceAllocator(size=1, block_size=8, threshold=0.25)
+    links = [allocator.allocate() for _ in range(40)]
+    self.assertEqual(len(set(links)), 40)
+    self.assertEqual(sum(len(link) == 1 for link in links), 16)
+    self.assertEqual(allocator.size, 2)
+
+  def test_random_allocator(self):
+    allocator = RandomAllocator(size=1, attempts=1)
+    links = set()
+    for _ in range(10):
+      link = Link(link=allocator.allocate(), redirect='https://example.com')
+      links.add(link.save().link)
+    self.assertEqual(len(links), 10)
+
+  def test_active_links_are_unique(self):
+    Link(link='taken', redirect='https://example.com').save()
+    Link(link='taken', redirect='https://example.com', activated=False).save()
+
+    with self.assertRaises(IntegrityError):
+      Link(link='taken', redirect='https://example.com').save()
+    db.session.rollback()
+
+
+if __name__ == "__main__":
+  main()
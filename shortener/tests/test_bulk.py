@@ -0,0 +1,147 @@
+import io
+from datetime import datetime, timezone
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.bulk import import_links, read_rows
+from app.links.cache import route_cache
+from app.links.expiration import expiration_sweeper
+from app.models import Link, User
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+
+class TestImportLinks(TestCase):
+  def setUp(self):
+    self.client = app.test_client()
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def run_import(self, text, format, batch_size=1000):
+    rows = read_rows(io.StringIO(text, newline=''), format)
+    created, errors = 0, []
+    for count, batch_errors in import_links(rows, batch_size=batch_size):
+      created += count
+      errors.extend(batch_errors)
+    return created, errors
+
+  def test_csv(self):
+    text = (
+      'link,redirect,expiration,activated\n'
+      'first,https://example.com/1,2100-01-01,\n'
+      ',https://example.com/2,,false\n'
+    )
+    created, errors = self.run_import(text, 'csv')
+    self.assertEqual((created, errors), (2, []))
+
+    first = Link.query.filter_by(link='first').one()
+    self.assertEqual(first.expiration.year, 2100)
+    self.assertTrue(first.activated)
+    second = Link.query.filter_by(redirect='https://example.com/2').one()
+    self.assertEqual(len(second.link), Link.LINK_SIZE)
+    self.assertFalse(second.activated)
+
+  def test_expirations_with_an_offset(self):
+    expiration_sweeper.horizon = 10 * 365 * 24 * 60 * 60
+    expiration_sweeper.load()
+    self.addCleanup(setattr, expiration_sweeper, 'horizon', 300)
+
+    text = (
+      'link,redirect,expiration\n'
+      'utc,https://example.com/1,2030-01-01T00:00:00Z\n'
+      'offset,https://example.com/2,2030-01-01T02:00:00+02:00\n'
+    )
+    self.assertEqual(self.run_import(text, 'csv'), (2, []))
+
+    expected = datetime(2030, 1, 1, tzinfo=timezone.utc).astimezone()
+    for link in Link.query.all():
+      self.assertEqual(link.expiration, expected.replace(tzinfo=None))
+    self.assertEqual(expiration_sweeper.stats()['scheduled'], 2)
+
+  def test_sample_rates(self):
+    text = (
+      'redirect,sample_rate\n'
+      'https://example.com/1,\n'
+      'https://example.com/2,0.1\n'
+      'https://example.com/3,adaptive\n'
+      'https://example.com/4,2\n'
+    )
+    created, errors = self.run_import(text, 'csv')
+    self.assertEqual(created, 3)
+    self.assertEqual([number for number, _ in errors], [5])
+
+    rates = [link.sample_rate for link in Link.query.order_by(Link.id)]
+    self.assertEqual(rates, [1.0, 0.1, 0.0])
+
+  def test_row_errors_do_not_abort_the_batch(self):
+    Link(link='taken', redirect='https://example.com').save()
+    text = '\n'.join([
+      '{"link": "taken", "redirect": "https://example.com/1"}',
+      '{"link": "fresh", "redirect": "https://example.com/2"}',
+      '{"link": "fresh", "redirect": "https://example.com/3"}',
+      '{"redirect": "not a url"}',
+      '{"link": "bad link", "redirect": "https://example.com/4"}',
+      '[1, 2]',
+      '{"redirect": "https://example.com/5"}',
+    ])
+    created, errors = self.run_import(text, 'jsonl', batch_size=3)
+    self.assertEqual(created, 2)
+    self.assertEqual([number for number, _ in errors], [1, 3, 4, 5, 6])
+    self.assertIn('already in use', errors[0][1])
+    self.assertIn('repeated on line 2', errors[1][1])
+    self.assertEqual(Link.query.count(), 3)
+
+  def test_repeated_routes_across_batches(self):
+    text = (
+      'link,redirect\n'
+      'same,https://example.com/1\n'
+      'same,https://example.com/2\n'
+    )
+    created, errors = self.run_import(text, 'csv', batch_size=1)
+    self.assertEqual(created, 1)
+    self.assertEqual(errors[0][0], 3)
+
+  def test_imported_routes_are_invalidated(self):
+    self.assertIsNone(self.client.get('/l/cached').location)
+    text = 'link,redirect\ncached,https://example.com/\n'
+    self.run_import(text, 'csv')
+
+    response = self.client.get('/l/cached')
+    self.assertEqual(response.location, 'https://example.com/')
+
+  def test_endpoint(self):
+    user = User(username='alice', email='alice@example.com', password='secret')
+    user.save()
+    with self.client.session_transaction() as session:
+      session['_user_id'] = str(user.id)
+
+    response = self.client.post(
+      '/link/import', content_type='application/x-ndjson',
+      data='{"redirect": "https://example.com"}\n{"redirect": ""}\n')
+    self.assertEqual(response.json['created'], 1)
+    self.assertEqual(response.json['errors'][0]['line'], 2)
+    self.assertEqual(Link.query.one().user_id, user.id)
+
+    response = self.client.get(
+      '/link/import', content_type='text/csv',
+      data='redirect\nhttps://example.com/1\n')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(Link.query.count(), 1)
+
+    response = self.client.post('/link/import', data={
+      'file': (io.BytesIO(b'redirect\nhttps://example.com/2\n'), 'links.csv'),
+    }, content_type='multipart/form-data')
+    self.assertIn(b'1 links were imported.', response.data)
+    self.assertEqual(Link.query.count(), 2)
+
+
+if __name__ == "__main__":
+  main()
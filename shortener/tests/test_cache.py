@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.cache import CachedRoute, RouteCache, route_cache
+from app.models import Link
+
+app = create_app(environment='testing')
+
+
+class TestRouteCache(TestCase):
+  def test_hit_and_miss(self):
+    cache = RouteCache(size=2)
+    self.assertEqual(cache.get('abc'), (False, None))
+    value = CachedRoute(1, 'https://example.com', True, None)
+    cache.set('abc', value)
+    self.assertEqual(cache.get('abc'), (True, value))
+    self.assertEqual(cache.stats()['hits'], 1)
+    self.assertEqual(cache.stats()['misses'], 1)
+
+  def test_negative_cache(self):
+    cache = RouteCache()
+    cache.set('missing')
+    self.assertEqual(cache.get('missing'), (True, None))
+    self.assertEqual(cache.stats()['negative_hits'], 1)
+
+  def test_lru_eviction(self):
+    cache = RouteCache(size=2)
+    for route in ('a', 'b'):
+      cache.set(route, CachedRoute(1, route, True, None))
+    cache.get('a')
+    cache.set('c', CachedRoute(1, 'c', True, None))
+    self.assertTrue(cache.get('a')[0])
+    self.assertFalse(cache.get('b')[0])
+    self.assertEqual(cache.stats()['evictions'], 1)
+
+  def test_expired_link_is_dropped(self):
+    cache = RouteCache()
+    expiration = datetime.now() - timedelta(seconds=1)
+    cache.set('old', CachedRoute(1, 'old', True, expiration))
+    self.assertFalse(cache.get('old')[0])
+
+  def test_stale_generation_is_discarded(self):
+    cache = RouteCache()
+    generation = cache.generation
+    cache.invalidate('abc')
+    cache.set('abc', CachedRoute(1, 'abc', True, None), generation)
+    self.assertFalse(cache.get('abc')[0])
+
+
+class TestRouteCacheInvalidation(TestCase):
+  def setUp(self):
+    self.client = app.test_client()
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_missing_route_becomes_available(self):
+    response = self.client.get('/l/abcdef')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(route_cache.get('abcdef'), (True, None))
+
+    Link(link='abcdef', redirect='https://example.com').save()
+    response = self.client.get('/l/abcdef')
+    self.assertEqual(response.status_code, 302)
+
+  def test_edited_route_is_invalidated(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    self.assertEqual(self.client.get('/l/abcdef').status_code, 302)
+
+    link.link = 'ghijkl'
+    link.update()
+    self.assertEqual(self.client.get('/l/abcdef').status_code, 200)
+    self.assertEqual(self.client.get('/l/ghijkl').status_code, 302)
+
+    link.delete()
+    self.assertEqual(self.client.get('/l/ghijkl').status_code, 200)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,119 @@
+from datetime import datetime
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.charts import (
+  ChartCache, DatabaseVersions, MemoryBackend, RedisBackend, chart_cache
+)
+from app.links.tracking import request_logger
+from app.links.utils import get_link_data
+from app.local_redis import LocalRedis
+from app.models import Link, Request
+
+app = create_app(environment='testing')
+
+
+class TestChartCache(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    chart_cache.clear()
+    chart_cache.reset_stats()
+
+    self.calls = 0
+
+  def tearDown(self):
+    chart_cache.max_staleness = 0
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def compute(self):
+    self.calls += 1
+    return {'values': (self.calls,)}
+
+  def test_memory_backend_is_bounded(self):
+    backend = MemoryBackend(size=2)
+    for key in 'abc':
+      backend.set(key, key, ttl=60)
+    backend.set('expired', 1, ttl=0)
+
+    self.assertIsNone(backend.get('a'))
+    self.assertIsNone(backend.get('expired'))
+    self.assertEqual(backend.get('c'), 'c')
+
+  def test_redis_backend(self):
+    backend = RedisBackend(LocalRedis())
+    backend.set('key', {'values': (1, 2)}, ttl=60)
+    backend.incr(['version:a', 'version:a'])
+
+    self.assertEqual(backend.get('key'), {'values': [1, 2]})
+    self.assertEqual(backend.counters(['version:a', 'version:b']), (2, 0))
+
+    backend.clear()
+    self.assertIsNone(backend.get('key'))
+
+  def test_entries_are_recomputed_after_invalidation(self):
+    for backend in (MemoryBackend(), RedisBackend(LocalRedis())):
+      cache = ChartCache()
+      cache.backend = backend
+      cache.max_staleness = 0
+      self.calls = 0
+
+      self.assertEqual(cache.link(1, self.compute), {'values': (1,)})
+      self.assertEqual(cache.link(1, self.compute)['values'][0], 1)
+      cache.invalidate('link:2')
+      self.assertEqual(cache.link(1, self.compute)['values'][0], 1)
+
+      cache.invalidate('link:1')
+      self.assertEqual(cache.link(1, self.compute)['values'][0], 2)
+      self.assertEqual(cache.stats()['misses'], 2)
+
+  def test_workers_share_versions_through_the_database(self):
+    workers = []
+    for _ in range(2):
+      cache = ChartCache()
+      cache.backend = MemoryBackend(versions=DatabaseVersions(app))
+      cache.max_staleness = 0
+      workers.append(cache)
+    first, second = workers
+
+    first.dashboard(1, self.compute)
+    self.assertEqual(first.dashboard(1, self.compute)['values'], (1,))
+
+    # Requests written by another process move the shared version on.
+    second.requests_written([{'link_id': 1}, {'link_id': None}])
+    second.requests_written([{'link_id': 1}])
+    self.assertEqual(first.dashboard(1, self.compute)['values'], (2,))
+    self.assertEqual(
+      first.backend.counters(['version:requests', 'version:link:1']), (2, 2))
+
+  def test_stale_entries_are_served_within_the_limit(self):
+    chart_cache.max_staleness = 60
+    chart_cache.dashboard(1, self.compute)
+    chart_cache.invalidate(chart_cache.REQUESTS)
+
+    self.assertEqual(chart_cache.dashboard(1, self.compute)['values'], (1,))
+    self.assertEqual(chart_cache.stats()['stale_hits'], 1)
+
+  def test_written_requests_invalidate_link_charts(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+
+    def compute():
+      return get_link_data(link.id)
+
+    self.assertIsNone(chart_cache.link(link.id, compute))
+
+    now = datetime.now()
+    request_logger.log(Request(
+      route='abcdef', link_id=link.id, is_hit=True, start=now, end=now,
+      browser='chrome').to_record())
+
+    data = chart_cache.link(link.id, compute)
+    self.assertEqual(data['requests']['values'], (1,))
+    self.assertEqual(data['browser']['labels'], ('Chrome',))
+
+
+if __name__ == "__main__":
+  main()
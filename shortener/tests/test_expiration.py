@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta
+from time import monotonic, sleep
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.cache import find_route, route_cache
+from app.links.expiration import expiration_sweeper
+from app.links.forms import LinkForm
+from app.models import Link
+
+app = create_app(environment='testing')
+
+
+class TestExpirationSweeper(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+    expiration_sweeper.reset_stats()
+
+  def tearDown(self):
+    expiration_sweeper.stop()
+    expiration_sweeper.enabled = False
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def is_activated(self, route: str) -> bool:
+    return db.session.query(Link.activated) \
+      .filter(Link.link == route).scalar()
+
+  def test_expired_links_are_deactivated(self):
+    now = datetime.now()
+    Link(link='expired', redirect='https://example.com',
+         expiration=now - timedelta(minutes=1)).save()
+    Link(link='current', redirect='https://example.com',
+         expiration=now + timedelta(minutes=1)).save()
+    Link(link='forever', redirect='https://example.com').save()
+
+    # Lookups do not wait for the sweeper to skip expired links.
+    self.assertIsNone(find_route('expired'))
+    self.assertIsNotNone(find_route('current'))
+
+    self.assertEqual(expiration_sweeper.sweep(now), ['expired'])
+    self.assertEqual(expiration_sweeper.sweep(now), [])
+    self.assertFalse(self.is_activated('expired'))
+    self.assertTrue(self.is_activated('current'))
+    self.assertTrue(self.is_activated('forever'))
+
+  def test_upcoming_expirations_are_kept_in_a_heap(self):
+    now = datetime.now()
+    for minutes in (3, 1, 2, 10):
+      Link(link=f'link{ minutes }', redirect='https://example.com',
+           expiration=now + timedelta(minutes=minutes)).save()
+
+    expiration_sweeper.horizon = 300
+    expiration_sweeper.load(now)
+    self.assertEqual(expiration_sweeper.stats()['scheduled'], 3)
+
+    # Links saved by this process are added as they are committed.
+    Link(link='saved', redirect='https://example.com',
+         expiration=now + timedelta(seconds=90)).save()
+    Link(link='inactive', redirect='https://example.com', activated=False,
+         expiration=now + timedelta(seconds=30)).save()
+
+    self.assertEqual(expiration_sweeper.due(now + timedelta(minutes=2)),
+                     ['link1', 'saved', 'link2'])
+    self.assertEqual(expiration_sweeper.stats()['scheduled'], 1)
+
+  def test_expiration_dates_from_the_form_are_scheduled(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    expiration_sweeper.load()
+
+    tomorrow = date.today() + timedelta(days=1)
+    data = {'link': 'abcdef', 'redirect': 'https://example.com',
+            'expiration': tomorrow.isoformat(), 'activated': 'y',
+            'sample_rate': '1.0'}
+    with app.test_request_context(method='POST', data=data):
+      form = LinkForm(obj=link)
+      self.assertTrue(form.validate())
+      form.populate_obj(link)
+      link.update()
+
+    midnight = datetime.combine(tomorrow, datetime.min.time())
+    self.assertEqual(link.expiration, midnight)
+    self.assertFalse(link.is_expired())
+
+    # Expirations within the horizon are added to the heap.
+    expiration_sweeper.horizon = 2 * 24 * 60 * 60
+    expiration_sweeper.load()
+    link.expiration = tomorrow
+    link.update()
+    self.assertEqual(expiration_sweeper.due(midnight), ['abcdef', 'abcdef'])
+
+  def test_routes_are_evicted_when_links_expire(self):
+    link = Link(link='abcdef', redirect='https://example.com',
+                expiration=datetime.now() + timedelta(seconds=0.5)).save()
+    self.assertEqual(find_route('abcdef').link_id, link.id)
+    self.assertTrue(route_cache.get('abcdef')[0])
+
+    expiration_sweeper.enabled = True
+    expiration_sweeper.start()
+    deadline = monotonic() + 3
+    while expiration_sweeper.stats()['deactivated'] == 0 and \
+            monotonic() < deadline:
+      sleep(0.05)
+
+    self.assertEqual(expiration_sweeper.stats()['deactivated'], 1)
+    self.assertFalse(route_cache.get('abcdef')[0])
+    self.assertFalse(self.is_activated('abcdef'))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,97 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links import export
+from app.models import Link, Request, User
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+
+class TestExport(TestCase):
+  def setUp(self):
+    self.client = app.test_client()
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+
+    self.user = User(
+      username='alice', email='alice@example.com', password='secret').save()
+    self.link = Link(
+      link='abcdef', redirect='https://example.com', user_id=self.user.id
+    ).save()
+    self.other = Link(link='other', redirect='https://example.com').save()
+
+    start = datetime(2024, 1, 1)
+    for index in range(25):
+      end = start + timedelta(hours=index)
+      db.session.add(Request(
+        link_id=self.link.id, route='abcdef', is_hit=True, start=end,
+        end=end, browser='chrome', browser_version=120))
+    db.session.add(Request(
+      link_id=self.other.id, route='other', is_hit=True, start=start,
+      end=start))
+    db.session.commit()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def login(self):
+    with self.client.session_transaction() as session:
+      session['_user_id'] = str(self.user.id)
+
+  def test_csv_is_streamed_in_chunks(self):
+    query = export.select([self.link.id])
+    chunks = list(export.export(query, chunk_size=10))
+    self.assertEqual(len(chunks), 4)
+
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+    self.assertEqual(len(rows), 25)
+    self.assertNotIn('user_agent', rows[0])
+    self.assertEqual(rows[0]['browser'], 'chrome')
+
+  def test_header_is_sent_before_the_query(self):
+    chunks = export.export(export.select(), engine=object())
+    self.assertTrue(next(chunks).startswith(b'id,'))
+
+  def test_jsonl_with_gzip_and_range(self):
+    query = export.select(
+      since=datetime(2024, 1, 1, 10), until=datetime(2024, 1, 1, 20))
+    data = b''.join(export.export(query, 'jsonl', compress=True))
+
+    rows = [json.loads(line) for line in gzip.decompress(data).splitlines()]
+    self.assertEqual(len(rows), 10)
+    self.assertEqual(rows[0]['end'], '2024-01-01T10:00:00')
+
+  def test_link_endpoint(self):
+    self.login()
+    response = self.client.get(f'/link/{ self.link.id }/export?format=jsonl')
+    self.assertEqual(response.mimetype, 'application/x-ndjson')
+    self.assertTrue(response.is_streamed)
+    self.assertEqual(len(response.data.splitlines()), 25)
+
+    response = self.client.get(f'/link/{ self.other.id }/export')
+    self.assertEqual(response.status_code, 302)
+
+  def test_admin_endpoint(self):
+    self.user.is_admin = True
+    self.user.update()
+    self.login()
+
+    response = self.client.get('/settings/export?gzip=1')
+    self.assertEqual(response.mimetype, 'application/gzip')
+    self.assertEqual(len(gzip.decompress(response.data).splitlines()), 27)
+
+    response = self.client.get('/settings/export?since=yesterday')
+    self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.cache import route_cache
+from app.metrics import Histogram, request_metrics
+
+app = create_app(environment='testing')
+
+
+class TestMetrics(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+    request_metrics.reset_stats()
+    self.client = app.test_client()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_histogram_exposition(self):
+    histogram = Histogram('latency', 'Latency.', ('path',), (0.1, 1))
+    histogram.observe(0.05, '/')
+    histogram.observe(0.5, '/')
+    histogram.observe(5, '/')
+
+    self.assertEqual(histogram.exposition()[2:], [
+      'latency_bucket{path="/",le="0.1"} 1',
+      'latency_bucket{path="/",le="1"} 2',
+      'latency_bucket{path="/",le="+Inf"} 3',
+      'latency_sum{path="/"} 5.55',
+      'latency_count{path="/"} 3',
+    ])
+
+  def test_requests_are_timed(self):
+    self.client.get('/')
+    self.client.get('/l/missing')
+
+    self.assertEqual(request_metrics.request_duration.count(
+      'main.index', 'GET', '200'), 1)
+    self.assertEqual(request_metrics.request_duration.count(
+      'main.link', 'GET', '200'), 1)
+    self.assertEqual(
+      request_metrics.template_duration.count('index.html'), 1)
+
+    # Looking up the missing route takes at least one query.
+    self.assertEqual(request_metrics.request_queries.count('main.link'), 1)
+    self.assertIn(
+      'http_request_queries_bucket{endpoint="main.link",le="0"} 0',
+      request_metrics.request_queries.exposition())
+    self.assertGreater(request_metrics.queries, 0)
+
+  def test_metrics_endpoint(self):
+    self.client.get('/')
+    response = self.client.get('/metrics')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.mimetype, 'text/plain')
+    self.assertIn(
+      b'http_request_duration_seconds_count'
+      b'{endpoint="main.index",method="GET",status="200"} 1',
+      response.data)
+    self.assertIn(b'# TYPE http_request_queries histogram', response.data)
+    self.assertIn(b'db_queries_total', response.data)
+
+  def test_metrics_are_only_served_to_scrapers(self):
+    remote = {'REMOTE_ADDR': '203.0.113.1'}
+    self.assertEqual(
+      self.client.get('/metrics', environ_base=remote).status_code, 403)
+
+    request_metrics.token = 'secret'
+    self.addCleanup(setattr, request_metrics, 'token', None)
+    response = self.client.get('/metrics', environ_base=remote, headers={
+      'Authorization': 'Bearer wrong'})
+    self.assertEqual(response.status_code, 403)
+    response = self.client.get('/metrics', environ_base=remote, headers={
+      'Authorization': 'Bearer secret'})
+    self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+  main()
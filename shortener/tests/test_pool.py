@@ -0,0 +1,53 @@
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.pool import pool_monitor
+from config import engine_options
+
+app = create_app(environment='testing')
+
+
+class TestPool(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    pool_monitor.init_app(app)
+    pool_monitor.reset_stats()
+
+  def tearDown(self):
+    db.session.remove()
+    self.app_ctx.pop()
+
+  def test_engine_options(self):
+    self.assertEqual(engine_options('sqlite:///database.sqlite3'), {})
+
+    options = engine_options(
+      'postgresql://db/production', workers=9, threads=4, max_connections=50)
+    self.assertEqual(options['pool_size'], 5)
+    self.assertEqual(options['max_overflow'], 0)
+    self.assertIn('statement_timeout=5000', options['connect_args']['options'])
+
+    options = engine_options(
+      'postgresql://db/production', workers=2, threads=4)
+    self.assertEqual(options['pool_size'], 6)
+    self.assertEqual(options['max_overflow'], 4)
+
+    # Pools never add up to more than the database allows.
+    options = engine_options(
+      'postgresql://db/production', workers=17, threads=4, max_connections=50)
+    self.assertEqual(options['pool_size'], 2)
+    self.assertEqual(options['max_overflow'], 0)
+
+  def test_checkouts_are_counted(self):
+    with db.engine.connect() as first, db.engine.connect() as second:
+      self.assertIsNot(first.connection, second.connection)
+      self.assertEqual(pool_monitor.stats()['checked_out'], 2)
+
+    stats = pool_monitor.stats()
+    self.assertEqual(stats['checked_out'], 0)
+    self.assertEqual(stats['peak_checked_out'], 2)
+    self.assertEqual(stats['checkouts'], 2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,111 @@
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.cache import route_cache
+from app.models import User
+from app.profiler import ProfileStore, StackSampler, request_profiler
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+
+def spin(seconds):
+  deadline = time.perf_counter() + seconds
+  while time.perf_counter() < deadline:
+    pass
+
+
+class TestProfiler(TestCase):
+  def setUp(self):
+    self.client = app.test_client()
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+
+    self.store = request_profiler.store
+    request_profiler.store = ProfileStore(tempfile.mkdtemp(), keep=2)
+    self.user = User(
+      username='alice', email='alice@example.com', password='secret',
+      is_admin=True).save()
+
+  def tearDown(self):
+    request_profiler.store = self.store
+    request_profiler.sample_rate = 0.0
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def login(self):
+    with self.client.session_transaction() as session:
+      session['_user_id'] = str(self.user.id)
+
+  def test_header_is_ignored_for_anonymous_users(self):
+    response = self.client.get('/', headers={'X-Profile': '1'})
+    self.assertNotIn('X-Profile-Id', response.headers)
+    self.assertEqual(request_profiler.store.ids(), [])
+
+  def test_admins_can_request_a_profile(self):
+    self.login()
+    response = self.client.get('/', headers={'X-Profile': '1'})
+    profile = request_profiler.store.get(response.headers['X-Profile-Id'])
+
+    self.assertEqual(profile['path'], '/')
+    self.assertEqual(profile['status'], 200)
+    self.assertEqual(profile['reason'], 'requested')
+    self.assertIn('cumulative', profile['summary'])
+
+    response = self.client.get('/')
+    self.assertNotIn('X-Profile-Id', response.headers)
+
+  def test_sampled_profiles_capture_statements(self):
+    request_profiler.sample_rate = 1.0
+    response = self.client.get('/l/missing')
+    profile = request_profiler.store.get(response.headers['X-Profile-Id'])
+
+    self.assertEqual(profile['reason'], 'sampled')
+    self.assertTrue(any(
+      'FROM links' in statement['statement']
+      for statement in profile['statements']))
+
+  def test_store_keeps_the_newest_profiles(self):
+    store = request_profiler.store
+    ids = [store.save({'path': '/'}, 'prof', b'') for _ in range(3)]
+
+    self.assertEqual(store.ids(), ids[:0:-1])
+    self.assertIsNone(store.get(ids[0]))
+    self.assertIsNone(store.get('../../etc/passwd'))
+
+  def test_profiles_can_be_browsed(self):
+    self.login()
+    response = self.client.get('/', headers={'X-Profile': '1'})
+    profile_id = response.headers['X-Profile-Id']
+
+    response = self.client.get('/settings/profiles')
+    self.assertIn(profile_id.encode(), response.data)
+
+    response = self.client.get(f'/settings/profiles/{ profile_id }')
+    self.assertEqual(response.status_code, 200)
+
+    response = self.client.get(f'/settings/profiles/{ profile_id }?download=1')
+    self.assertEqual(response.status_code, 200)
+    response.close()
+
+    response = self.client.get('/settings/profiles/missing')
+    self.assertEqual(response.status_code, 404)
+
+  def test_stack_sampler(self):
+    sampler = StackSampler(threading.get_ident(), interval=0.001)
+    sampler.start()
+    spin(0.1)
+    sampler.stop()
+
+    self.assertIn('spin (test_profiler.py', sampler.folded())
+    self.assertRegex(sampler.folded().splitlines()[0], r' [0-9]+$')
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,89 @@
+from unittest import TestCase, main
+
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.test import Client
+
+from app import db, create_app
+from app.links.cache import route_cache
+from app.links.redirects import RedirectApp
+from app.models import Link, Request
+
+app = create_app(environment='testing')
+
+
+class TestRedirectApp(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+    route_cache.reset_stats()
+
+    mounted = DispatcherMiddleware(app.wsgi_app, {'/l': RedirectApp(app)})
+    self.client = Client(mounted)
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_hit(self):
+    link = Link(link='abcdef', redirect='https://example.com/ü').save()
+    response = self.client.get(
+      '/l/abcdef', headers={'User-Agent': 'curl/8.4.0'})
+    self.assertEqual(response.status_code, 302)
+    self.assertEqual(
+      response.headers['Location'], 'https://example.com/%C3%BC')
+
+    request = Request.query.one()
+    self.assertEqual(request.link_id, link.id)
+    self.assertTrue(request.is_hit)
+    self.assertTrue(request.is_bot)
+
+  def test_miss(self):
+    response = self.client.get('/l/missing')
+    self.assertEqual(response.status_code, 404)
+    self.assertIn(b'This link appears to have gone', response.data)
+    self.assertFalse(Request.query.one().is_hit)
+
+  def test_lookups_are_counted_once(self):
+    Link(link='abcdef', redirect='https://example.com').save()
+    self.client.get('/l/abcdef')
+    self.client.get('/l/abcdef')
+    self.client.get('/l/missing')
+
+    stats = route_cache.stats()
+    self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+    self.assertEqual(stats['hit_ratio'], 1 / 3)
+
+  def test_untracked(self):
+    Link(link='abcdef', redirect='https://example.com',
+         track_requests=False).save()
+    self.assertEqual(self.client.get('/l/abcdef').status_code, 302)
+    self.assertEqual(Request.query.count(), 0)
+
+  def test_only_get_and_head_are_served(self):
+    Link(link='abcdef', redirect='https://example.com').save()
+    self.assertEqual(self.client.head('/l/abcdef').status_code, 302)
+
+    response = self.client.post('/l/abcdef')
+    self.assertEqual(response.status_code, 405)
+    self.assertEqual(response.headers['Allow'], 'GET, HEAD')
+    self.assertIn(b'405 - Method Not Allowed', response.data)
+    self.assertEqual(Request.query.count(), 1)
+
+  def test_empty_routes_are_not_looked_up(self):
+    for path in ('/l', '/l/', '/l/abc/def'):
+      response = self.client.get(path)
+      self.assertEqual(response.status_code, 404)
+      self.assertIn(b'404 - Not Found', response.data)
+
+    self.assertEqual(Request.query.count(), 0)
+    self.assertEqual(route_cache.stats()['misses'], 0)
+
+  def test_other_paths_reach_the_application(self):
+    self.assertEqual(self.client.get('/').status_code, 200)
+
+
+if __name__ == "__main__":
+  main()
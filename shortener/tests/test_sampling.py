@@ -0,0 +1,118 @@
+import random
+from datetime import datetime
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.cache import CachedRoute, route_cache
+from app.links.forms import LinkForm
+from app.links.sampling import ADAPTIVE, RequestSampler, request_sampler
+from app.links.tracking import request_logger
+from app.links.utils import get_link_data
+from app.models import Link, Request
+
+app = create_app(environment='testing')
+
+
+class TestRequestSampler(TestCase):
+  def setUp(self):
+    self.sampler = RequestSampler(threshold=10, window=10)
+    self.now = 0.0
+    self.sampler.clock = lambda: self.now
+
+  def test_fixed_rates(self):
+    link = CachedRoute(1, 'https://example.com', True, None, 0.1)
+    self.sampler.random = lambda: 0.05
+    self.assertEqual(self.sampler.weight(link), 10)
+    self.sampler.random = lambda: 0.5
+    self.assertEqual(self.sampler.weight(link), 0)
+
+    self.assertEqual(self.sampler.weight(link._replace(sample_rate=1.0)), 1)
+    self.assertEqual(self.sampler.weight(link._replace(track_requests=False)),
+                     0)
+    self.assertEqual(self.sampler.weight(None), 1)
+
+  def test_adaptive_rate_follows_traffic(self):
+    link = CachedRoute(1, 'https://example.com', True, None, ADAPTIVE)
+    self.sampler.random = lambda: 0.0
+
+    # 2,000 requests in a window is 200 a second, which needs a rate of 1 in
+    # 100 to fall under the threshold of 10.
+    weights = [self.sampler.weight(link) for _ in range(2000)]
+    self.assertEqual(set(weights), {1})
+    self.now = 10
+    self.assertEqual(self.sampler.weight(link), 100)
+
+    # Quiet windows go back to recording every request.
+    self.now = 20
+    self.assertEqual(self.sampler.weight(link), 1)
+    self.assertEqual(self.sampler.stats()['adjustments'], 2)
+
+
+class TestWeightedRequests(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+    self.link = Link(link='abcdef', redirect='https://example.com',
+                     sample_rate=0.01).save()
+
+  def tearDown(self):
+    request_sampler.random = random.random
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_sampled_requests_are_scaled_up(self):
+    now = datetime.now()
+    for browser, weight in (('chrome', 100), ('chrome', 100),
+                            ('firefox', 100), ('safari', 1)):
+      request_logger.log(Request(
+        link_id=self.link.id, route='abcdef', is_hit=True, start=now, end=now,
+        browser=browser, weight=weight).to_record())
+
+    data = get_link_data(self.link.id)
+    self.assertEqual(data['requests']['values'], (301,))
+    self.assertEqual(data['browser']['labels'],
+                     ('Chrome', 'Firefox', 'Safari'))
+    self.assertAlmostEqual(data['browser']['values'][0], 200 / 301 * 100)
+
+    db.session.refresh(self.link)
+    self.assertEqual(self.link.total_hits, 301)
+
+  def test_redirects_record_sampled_requests(self):
+    client = app.test_client()
+    request_sampler.random = lambda: 0.5
+    self.assertEqual(client.get('/l/abcdef').status_code, 302)
+    self.assertEqual(Request.query.count(), 0)
+
+    request_sampler.random = lambda: 0.001
+    client.get('/l/abcdef')
+    self.assertEqual(
+      db.session.query(Request.weight).scalar(), 100)
+
+  def test_the_form_keeps_imported_rates(self):
+    self.link.sample_rate = 0.5
+    self.link.update()
+
+    with app.test_request_context():
+      html = LinkForm(obj=self.link).sample_rate()
+      self.assertIn('selected value="0.5"', html)
+      self.assertIn('1 in 2 requests', html)
+
+    data = {'link': 'abcdef', 'redirect': 'https://example.com',
+            'track_requests': 'y', 'sample_rate': '0.5'}
+    with app.test_request_context(method='POST', data=data):
+      form = LinkForm(obj=self.link)
+      self.assertTrue(form.validate())
+      form.populate_obj(self.link)
+      self.link.update()
+    self.assertEqual(self.link.sample_rate, 0.5)
+
+    # Other rates are only accepted when the link already has them.
+    with app.test_request_context(method='POST', data=data):
+      self.assertFalse(LinkForm().validate())
+
+
+if __name__ == "__main__":
+  main()
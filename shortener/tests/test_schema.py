@@ -0,0 +1,92 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from app import db, create_app, schema
+from app.links import partitions
+from app.models import Link, Request, Setting, User
+from app.settings.models import Type
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+USER_AGENT = (
+  'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0'
+)
+
+
+class TestSchema(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_upgrade_is_idempotent(self):
+    self.assertEqual(schema.upgrade(), [])
+
+  def test_backfill_user_agents(self):
+    now = datetime.now()
+    for _ in range(5):
+      db.session.add(Request(
+        route='abcdef', start=now, end=now,
+        user_agent={'string': USER_AGENT, 'browser': 'firefox'}))
+    db.session.commit()
+
+    self.assertEqual(
+      list(schema.backfill_user_agents(chunk_size=2)), [2, 2, 1])
+
+    db.session.expire_all()
+    request = Request.query.first()
+    self.assertEqual(request.browser, 'firefox')
+    self.assertEqual(request.browser_version, 115)
+    self.assertEqual(request.platform, 'linux')
+    self.assertEqual(request.os_name, 'X11')
+    self.assertIsNone(request.user_agent)
+
+  def test_redirect_lookup_uses_index(self):
+    user = User(username='alice', email='alice@example.com',
+                password='password').save()
+    link = Link(link='abcdef', redirect='https://example.com',
+                user_id=user.id).save()
+
+    results = schema.explain_hot_queries(user, link.link, link.id)
+    names = {name for name, _, _, _ in results}
+    self.assertIn('User.links', names)
+    for name, _, plan, sequential in results:
+      if name == 'main.link':
+        self.assertFalse(sequential, plan)
+
+  def test_prune_requests(self):
+    now = datetime.now()
+    for days in (400, 100, 1):
+      end = now - timedelta(days=days)
+      db.session.add(Request(route=str(days), start=end, end=end))
+    db.session.commit()
+
+    with TemporaryDirectory() as directory:
+      pruned = partitions.prune(now - timedelta(days=30), directory)
+      self.assertEqual(pruned, [('requests', 2)])
+
+      path, = os.listdir(directory)
+      with gzip.open(os.path.join(directory, path), 'rt') as file:
+        routes = {json.loads(line)['route'] for line in file}
+      self.assertEqual(routes, {'400', '100'})
+
+    self.assertEqual([r.route for r in Request.query.all()], ['1'])
+
+  def test_retention_setting(self):
+    self.assertIsNone(Setting.value_by_key(Setting.REQUEST_RETENTION_DAYS))
+    Setting.set_value(Setting.REQUEST_RETENTION_DAYS, 90, Type.INTEGER)
+    self.assertEqual(Setting.value_by_key(Setting.REQUEST_RETENTION_DAYS), 90)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from app import db, create_app
+from app.links.cache import route_cache
+from app.links.charts import chart_cache
+from app.links.service import RedirectService, async_url
+from app.models import Link, Request
+
+app = create_app(environment='testing')
+
+
+async def get(service, path, user_agent=b'curl/8.4.0'):
+  scope = {
+    'type': 'http', 'method': 'GET', 'path': path,
+    'headers': [(b'user-agent', user_agent)],
+  }
+  messages = []
+
+  async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+  async def send(message):
+    messages.append(message)
+
+  await service(scope, receive, send)
+  start, body = messages
+  return start['status'], dict(start['headers']), body['body']
+
+
+class TestRedirectService(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+    self.service = RedirectService.from_app(app)
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def serve(self, *paths):
+    async def run():
+      try:
+        return await asyncio.gather(
+          *(get(self.service, path) for path in paths))
+      finally:
+        await self.service.shutdown()
+
+    return asyncio.run(run())
+
+  def test_async_url(self):
+    self.assertEqual(
+      async_url('sqlite:////tmp/database.sqlite3'),
+      'sqlite+aiosqlite:////tmp/database.sqlite3')
+    self.assertEqual(
+      async_url('postgresql://user:secret@db/development'),
+      'postgresql+asyncpg://user:secret@db/development')
+
+  def test_hit_and_miss(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    (hit, headers, _), (miss, _, body) = self.serve('/l/abcdef', '/l/missing')
+
+    self.assertEqual(hit, 302)
+    self.assertEqual(headers[b'location'], b'https://example.com')
+    self.assertEqual(miss, 404)
+    self.assertIn(b'This link appears to have gone', body)
+
+    requests = Request.query.order_by(Request.is_hit).all()
+    self.assertEqual([request.link_id for request in requests],
+                     [None, link.id])
+    self.assertTrue(requests[0].is_bot)
+    self.assertEqual(db.session.get(Link, link.id).total_hits, 1)
+
+  def test_concurrent_lookups_are_shared(self):
+    Link(link='abcdef', redirect='https://example.com').save()
+    responses = self.serve(*['/l/abcdef'] * 500)
+
+    self.assertTrue(all(status == 302 for status, _, _ in responses))
+    self.assertEqual(self.service.stats()['lookups'], 1)
+    self.assertEqual(self.service.stats()['written'], 500)
+    self.assertEqual(Request.query.count(), 500)
+
+  def test_chart_cache_is_invalidated_off_the_event_loop(self):
+    Link(link='abcdef', redirect='https://example.com').save()
+    threads = []
+    with patch.object(chart_cache, 'requests_written',
+                      lambda records: threads.append(threading.get_ident())):
+      self.serve('/l/abcdef')
+
+    self.assertEqual(len(threads), 1)
+    self.assertNotEqual(threads[0], threading.get_ident())
+
+
+if __name__ == "__main__":
+  main()
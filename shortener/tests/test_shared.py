@@ -0,0 +1,205 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links import snapshot
+from app.links.cache import CachedRoute, find_route, route_cache
+from app.links.shared import (
+  SharedRouteCache, route_invalidation, shared_route_cache
+)
+from app.links.snapshot import route_snapshot
+from app.local_redis import LocalRedis
+from app.models import Link
+
+app = create_app(environment='testing')
+
+
+def wait_for(condition, timeout=2):
+  deadline = monotonic() + timeout
+  while not condition() and monotonic() < deadline:
+    sleep(0.01)
+  return condition()
+
+
+class UnreachableRedis(LocalRedis):
+  """Fails to subscribe the first few times."""
+
+  def __init__(self, failures):
+    super().__init__()
+    self.failures = failures
+
+  def pubsub(self, **kwargs):
+    if self.failures:
+      self.failures -= 1
+      raise ConnectionError('Connection refused')
+    return super().pubsub(**kwargs)
+
+
+class TestSharedRouteCache(TestCase):
+  def setUp(self):
+    self.path = os.path.join(tempfile.mkdtemp(), 'routes.cache')
+    self.caches = []
+
+  def tearDown(self):
+    for cache in self.caches:
+      cache.close()
+
+  def worker(self):
+    cache = SharedRouteCache()
+    cache.path = self.path
+    cache.slots = 64
+    cache.open()
+    self.caches.append(cache)
+    return cache
+
+  def test_workers_share_routes(self):
+    first, second = self.worker(), self.worker()
+    value = CachedRoute(1, 'https://example.com/ü', True, None)
+    first.set('abcdef', value)
+
+    self.assertEqual(second.get('abcdef'), (True, value))
+    self.assertEqual(second.get('ghijkl'), (False, None))
+
+    second.invalidate('abcdef')
+    self.assertEqual(first.get('abcdef'), (False, None))
+    self.assertEqual(first.stats()['generation'], 1)
+
+  def test_lookups_overtaken_by_an_invalidation_are_discarded(self):
+    first, second = self.worker(), self.worker()
+    generation = first.generation
+    second.invalidate('abcdef')
+    first.set('abcdef', CachedRoute(1, 'https://example.com', True, None),
+              generation)
+
+    self.assertEqual(second.get('abcdef'), (False, None))
+
+  def test_expired_and_oversized_routes_are_not_served(self):
+    cache = self.worker()
+    expiration = datetime.now() - timedelta(seconds=1)
+    cache.set('abcdef', CachedRoute(1, 'https://example.com', True,
+                                    expiration))
+    cache.set('ghijkl', CachedRoute(2, 'https://example.com/' + 'a' * 600,
+                                    True, None))
+
+    self.assertEqual(cache.get('abcdef'), (False, None))
+    self.assertEqual(cache.get('ghijkl'), (False, None))
+    self.assertEqual(cache.stats()['skipped'], 1)
+
+  def test_files_with_another_layout_are_reset(self):
+    self.worker().set('abcdef', CachedRoute(1, 'https://example.com', True,
+                                            None))
+    cache = SharedRouteCache()
+    cache.path, cache.slots = self.path, 128
+    cache.open()
+    self.caches.append(cache)
+
+    self.assertEqual(cache.get('abcdef'), (False, None))
+    self.assertEqual(os.path.getsize(self.path), len(cache.map))
+
+
+class TestRouteInvalidation(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+
+    shared_route_cache.path = os.path.join(tempfile.mkdtemp(), 'routes.cache')
+    shared_route_cache.slots = 64
+    shared_route_cache.open()
+    shared_route_cache.reset_stats()
+
+    self.client = LocalRedis()
+    route_invalidation.client = self.client
+    route_invalidation.reset_stats()
+
+  def tearDown(self):
+    route_invalidation.stop()
+    route_invalidation.client = None
+    shared_route_cache.close()
+    shared_route_cache.path = None
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_link_changes_are_published(self):
+    pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(route_invalidation.channel)
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    self.assertEqual(
+      json.loads(pubsub.get_message(timeout=1)['data'])['routes'],
+      ['abcdef'])
+
+    link.link = 'ghijkl'
+    link.update()
+    routes = json.loads(pubsub.get_message(timeout=1)['data'])['routes']
+    self.assertEqual(sorted(routes), ['abcdef', 'ghijkl'])
+
+    link.delete()
+    self.assertEqual(
+      json.loads(pubsub.get_message(timeout=1)['data'])['routes'],
+      ['ghijkl'])
+    self.assertEqual(route_invalidation.stats()['published'], 3)
+
+  def test_lookups_fill_the_shared_cache(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    self.assertEqual(find_route('abcdef').link_id, link.id)
+    self.assertEqual(shared_route_cache.get('abcdef')[1].link_id, link.id)
+
+    link.activated = False
+    link.update()
+    self.assertEqual(shared_route_cache.get('abcdef'), (False, None))
+    self.assertIsNone(find_route('abcdef'))
+
+  def test_invalidations_from_other_workers_are_applied(self):
+    Link(link='abcdef', redirect='https://example.com').save()
+    find_route('abcdef')
+    self.assertTrue(wait_for(
+      lambda: route_invalidation.stats()['subscriptions'] == 1))
+
+    find_route('abcdef')
+    self.assertTrue(route_cache.get('abcdef')[0])
+
+    # Messages from this worker have already been applied, and are skipped.
+    route_invalidation.invalidate('ghijkl')
+    self.client.publish(route_invalidation.channel, json.dumps(
+      {'sender': 'another worker', 'routes': ['abcdef']}))
+
+    self.assertTrue(wait_for(
+      lambda: route_invalidation.stats()['received'] == 1))
+    self.assertFalse(route_cache.get('abcdef')[0])
+    self.assertEqual(shared_route_cache.get('abcdef'), (False, None))
+
+  def test_snapshots_are_distrusted_after_an_outage(self):
+    path = os.path.join(tempfile.mkdtemp(), 'routes.snapshot')
+    snapshot.write(
+      path, [(1, 'abcdef', 'https://example.com', True, None, 1.0)],
+      generation=0)
+    route_snapshot.path, route_snapshot.check_interval = path, 0
+    self.addCleanup(setattr, route_snapshot, 'path', None)
+    self.addCleanup(route_snapshot.unload)
+    self.assertTrue(route_snapshot.get('abcdef')[0])
+
+    route_invalidation.client = UnreachableRedis(failures=1)
+    route_invalidation.retry_interval = 0.01
+    self.addCleanup(setattr, route_invalidation, 'retry_interval', 1.0)
+    route_invalidation.listen()
+    self.assertTrue(wait_for(
+      lambda: route_invalidation.stats()['subscriptions'] == 1))
+    self.assertEqual(route_invalidation.stats()['failed'], 1)
+
+    # Changes may have been missed while the channel was down, so the
+    # snapshot is only used again once a newer one is built.
+    self.assertEqual(route_snapshot.get('abcdef'), (False, None))
+    snapshot.write(
+      path, [(1, 'abcdef', 'https://example.com', True, None, 1.0)],
+      generation=1)
+    self.assertTrue(route_snapshot.get('abcdef')[0])
+
+
+if __name__ == "__main__":
+  main()
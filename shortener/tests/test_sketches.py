@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+from unittest import TestCase, main
+
+from flask_login import login_user
+
+from app import db, create_app
+from app.links import sketches
+from app.links.sketches import HyperLogLog, visitor_id
+from app.links.tracking import request_logger
+from app.links.utils import get_dashboard_data, get_link_data
+from app.models import Link, OwnerSketch, Request, RequestSketch, User
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+
+def visitors(start, count):
+  return [visitor_id(f'10.0.{ n // 256 }.{ n % 256 }', 'Firefox', 'testing')
+          for n in range(start, start + count)]
+
+
+class TestHyperLogLog(TestCase):
+  def assertEstimates(self, sketch, count):
+    error = 3 * sketches.STANDARD_ERROR * count
+    self.assertLessEqual(abs(sketch.count() - count), error)
+
+  def test_estimates_are_within_the_documented_error(self):
+    for count in (10, 1000, 20000):
+      sketch = HyperLogLog()
+      for visitor in visitors(0, count) * 2:
+        sketch.add(visitor)
+      self.assertEstimates(sketch, count)
+
+  def test_merged_sketches_count_visitors_once(self):
+    first, second = HyperLogLog(), HyperLogLog()
+    for visitor in visitors(0, 6000):
+      first.add(visitor)
+    for visitor in visitors(4000, 6000):
+      second.add(visitor)
+
+    self.assertEstimates(first.merge(second), 10000)
+
+  def test_sketches_are_stored_compressed(self):
+    sketch = HyperLogLog()
+    for visitor in visitors(0, 10):
+      sketch.add(visitor)
+
+    data = sketch.to_bytes()
+    self.assertLess(len(data), sketches.REGISTERS // 4)
+    self.assertEqual(HyperLogLog.from_bytes(data).registers, sketch.registers)
+
+  def test_visitors_are_keyed(self):
+    self.assertEqual(visitor_id('10.0.0.1', 'Firefox', 'a'),
+                     visitor_id('10.0.0.1', 'Firefox', 'a'))
+    self.assertNotEqual(visitor_id('10.0.0.1', 'Firefox', 'a'),
+                        visitor_id('10.0.0.1', 'Firefox', 'b'))
+    self.assertNotEqual(visitor_id('10.0.0.1', 'Firefox', 'a'),
+                        visitor_id('10.0.0.1', 'Chrome', 'a'))
+    self.assertIsNone(visitor_id(None, 'Firefox', 'a'))
+
+
+class TestVisitorSketches(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    self.link = Link(link='abcdef', redirect='https://example.com').save()
+    self.other = Link(link='ghijkl', redirect='https://example.com').save()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def log(self, link, visitors, end=None, is_bot=False):
+    end = end or datetime.now()
+    for visitor in visitors:
+      request_logger.log(Request(
+        link_id=link.id, route=link.link, is_hit=True, is_bot=is_bot,
+        start=end, end=end, visitor=visitor).to_record())
+
+  def test_sketches_are_maintained(self):
+    yesterday = datetime.now() - timedelta(days=1)
+    self.log(self.link, visitors(0, 30), end=yesterday)
+    self.log(self.link, visitors(20, 20))
+    self.log(self.link, visitors(20, 20))
+    self.log(self.link, visitors(100, 5), is_bot=True)
+    self.log(self.other, visitors(0, 50))
+
+    self.assertEqual(RequestSketch.query.count(), 3)
+    link_ids = [self.link.id]
+    self.assertEqual(sketches.unique_visitors(link_ids, datetime.now()), 20)
+    self.assertEqual(sketches.unique_visitors(link_ids, yesterday), 40)
+    self.assertEqual(sketches.unique_visitors(
+      link_ids, yesterday, yesterday + timedelta(days=1)), 30)
+    self.assertEqual(sketches.unique_visitors(
+      [self.link.id, self.other.id], yesterday), 50)
+
+    data = get_link_data(self.link.id)
+    self.assertEqual((data['visitors']['today'], data['visitors']['days']),
+                     (20, 40))
+
+  def test_duplicate_rows_are_merged(self):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for start in (0, 10):
+      sketch = HyperLogLog()
+      for visitor in visitors(start, 10):
+        sketch.add(visitor)
+      db.session.add(RequestSketch(
+        link_id=self.link.id, bucket_start=today,
+        registers=sketch.to_bytes()))
+    db.session.commit()
+    self.assertEqual(sketches.unique_visitors([self.link.id], today), 20)
+
+    self.log(self.link, visitors(15, 10))
+    self.assertEqual(RequestSketch.query.count(), 1)
+    self.assertEqual(sketches.unique_visitors([self.link.id], today), 25)
+
+  def test_rebuild_matches_incremental(self):
+    yesterday = datetime.now() - timedelta(days=1)
+    self.log(self.link, visitors(0, 30), end=yesterday)
+    self.log(self.link, visitors(20, 20))
+    before = [registers for registers, in RequestSketch.query
+              .order_by(RequestSketch.bucket_start)
+              .with_entities(RequestSketch.registers)]
+
+    self.assertEqual(sketches.rebuild(), 2)
+    after = [registers for registers, in RequestSketch.query
+             .order_by(RequestSketch.bucket_start)
+             .with_entities(RequestSketch.registers)]
+    self.assertEqual(after, before)
+
+    self.assertEqual(sketches.rebuild(datetime.now()), 1)
+    self.assertEqual(RequestSketch.query.count(), 2)
+
+  def test_owners_have_daily_unions(self):
+    user = User(username='alice', email='alice@example.com',
+                password='password').save()
+    owned = Link(link='mnopqr', redirect='https://example.com',
+                 user_id=user.id).save()
+    yesterday = datetime.now() - timedelta(days=1)
+    self.log(owned, visitors(0, 30), end=yesterday)
+    self.log(owned, visitors(20, 20))
+    self.log(self.link, visitors(0, 50))
+
+    self.assertEqual(OwnerSketch.query.count(), 4)
+    self.assertEqual(sketches.recent_visitors(user_id=user.id), (20, 40))
+    self.assertEqual(sketches.recent_visitors(), (50, 50))
+    self.assertEqual(sketches.recent_visitors([owned.id]), (20, 40))
+
+    with app.test_request_context():
+      login_user(user)
+      data = get_dashboard_data()
+    self.assertEqual((data['visitors']['today'], data['visitors']['days']),
+                     (20, 40))
+
+    query = OwnerSketch.query.order_by(
+      OwnerSketch.user_id, OwnerSketch.bucket_start).with_entities(
+        OwnerSketch.user_id, OwnerSketch.bucket_start, OwnerSketch.registers)
+    before = query.all()
+    sketches.rebuild()
+    self.assertEqual(query.all(), before)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from time import time
+from unittest import TestCase, main
+from unittest.mock import ANY
+
+from app import db, create_app
+from app.links import snapshot
+from app.links.cache import find_route, route_cache
+from app.links.snapshot import Snapshot, route_snapshot
+from app.metrics import request_metrics
+from app.models import Link
+
+app = create_app(environment='testing')
+
+
+class TestRouteSnapshot(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    route_cache.clear()
+
+    self.path = os.path.join(tempfile.mkdtemp(), 'routes.snapshot')
+    route_snapshot.path = self.path
+    route_snapshot.check_interval = 0
+    route_snapshot.unload()
+    route_snapshot.reset_stats()
+
+  def tearDown(self):
+    route_snapshot.path = None
+    route_snapshot.unload()
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def test_routes_are_found_by_binary_search(self):
+    expiration = datetime(2030, 1, 1)
+    links = [
+      (index, f'route{ index }', f'https://example.com/{ index }', True, None,
+       1.0)
+      for index in range(100)]
+    links.append(
+      (100, 'ünïcode', 'https://example.com/ü', False, expiration, 0.01))
+    snapshot.write(self.path, links, generation=100)
+
+    loaded = Snapshot(self.path)
+    self.assertEqual((loaded.count, loaded.generation), (101, 100))
+    for link_id, route, redirect, _, _, _ in links:
+      entry = loaded.find(route.encode())
+      self.assertEqual(entry[0], link_id)
+      self.assertEqual(loaded.redirect(entry), redirect)
+    entry = loaded.find('ünïcode'.encode())
+    self.assertEqual(entry[1], expiration.timestamp())
+    self.assertEqual(entry[7], 0.01)
+    self.assertIsNone(loaded.find(b'missing'))
+    self.assertIsNone(loaded.find(b''))
+
+  def test_active_links_are_served_from_the_snapshot(self):
+    link = Link(link='abcdef', redirect='https://example.com').save()
+    Link(link='inactive', redirect='https://example.com',
+         activated=False).save()
+    Link(link='expired', redirect='https://example.com',
+         expiration=datetime.now() - timedelta(days=1)).save()
+    self.assertEqual(snapshot.build(self.path)['routes'], 1)
+
+    # Change the link behind the snapshot's back, so that lookups show where
+    # they were answered from.
+    db.session.execute(
+      Link.__table__.update().values(redirect='https://example.org'))
+    db.session.commit()
+
+    self.assertEqual(find_route('abcdef').redirect, 'https://example.com')
+    self.assertEqual(route_snapshot.stats()['hits'], 1)
+    self.assertIsNone(find_route('inactive'))
+    self.assertIsNone(find_route('expired'))
+
+    # Links changed by this process are read from the database instead.
+    link.redirect = 'https://example.net'
+    link.update()
+    self.assertEqual(find_route('abcdef').redirect, 'https://example.net')
+
+  def test_newer_snapshots_are_loaded(self):
+    snapshot.write(self.path, [], generation=0)
+    self.assertEqual(route_snapshot.get('abcdef'), (False, None))
+
+    snapshot.write(
+      self.path, [(1, 'abcdef', 'https://example.com', True, None, 1.0)],
+      generation=1)
+    found, value = route_snapshot.get('abcdef')
+    self.assertTrue(found)
+    self.assertEqual(value.link_id, 1)
+    self.assertEqual(route_snapshot.stats()['loads'], 2)
+
+    os.remove(self.path)
+    self.assertEqual(route_snapshot.get('abcdef'), (False, None))
+    self.assertEqual(route_snapshot.stats()['routes'], 0)
+
+  def test_changes_without_a_snapshot_are_not_kept(self):
+    routes = [f'route{ n }' for n in range(route_snapshot.MAX_CHANGED)]
+    route_snapshot.invalidate(*routes)
+    self.assertEqual(route_snapshot._changed, {})
+
+    # Snapshots built before the changes are not trusted, newer ones are.
+    links = [(1, 'route1', 'https://example.com', True, None, 1.0)]
+    snapshot.write(self.path, links, generation=0, created_at=time() - 60)
+    self.assertEqual(route_snapshot.get('route1'), (False, None))
+    self.assertEqual(route_snapshot.stats()['stale'], 1)
+    snapshot.write(self.path, links, generation=1)
+    self.assertTrue(route_snapshot.get('route1')[0])
+
+    # Tracking too many changes also falls back to distrusting the snapshot.
+    route_snapshot.invalidate('route1')
+    self.assertEqual(route_snapshot._changed, {'route1': ANY})
+    route_snapshot.invalidate(*routes)
+    self.assertEqual(route_snapshot._changed, {})
+    self.assertEqual(route_snapshot.get('route1'), (False, None))
+
+  def test_metrics(self):
+    snapshot.write(
+      self.path, [(1, 'abcdef', 'https://example.com', True, None, 1.0)],
+      generation=1)
+    route_snapshot.get('abcdef')
+
+    exposition = request_metrics.exposition()
+    self.assertIn('route_snapshot_routes 1\n', exposition)
+    self.assertIn('# TYPE route_snapshot_age_seconds gauge', exposition)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+from datetime import datetime
+from queue import Queue
+from unittest import TestCase, main
+
+from app import db, create_app
+from app.links.tracking import RequestLogger
+from app.models import Request
+
+app = create_app(environment='testing')
+
+
+class TestRequestLogger(TestCase):
+  def setUp(self):
+    self.client = app.test_client()
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def record(self, route='abcdef'):
+    now = datetime.now()
+    return Request(route=route, start=now, end=now).to_record()
+
+  def test_record_has_defaults(self):
+    record = self.record()
+    self.assertNotIn('id', record)
+    self.assertIs(record['is_hit'], False)
+    self.assertIs(record['is_bot'], False)
+
+  def test_batches_are_written_on_stop(self):
+    logger = RequestLogger(batch_size=10, flush_interval=0.05)
+    logger.app = app
+    for _ in range(25):
+      self.assertTrue(logger.log(self.record()))
+    logger.stop()
+
+    self.assertEqual(Request.query.count(), 25)
+    self.assertEqual(logger.stats()['written'], 25)
+    self.assertEqual(logger.stats()['dropped'], 0)
+
+  def test_full_queue_drops_records(self):
+    logger = RequestLogger()
+    logger.app = app
+    queue = Queue(maxsize=1)
+    logger._queue = queue
+    logger._ensure_worker = lambda: queue
+
+    self.assertTrue(logger.log(self.record()))
+    self.assertFalse(logger.log(self.record()))
+    self.assertEqual(logger.stats()['dropped'], 1)
+
+    logger.flush()
+    self.assertEqual(Request.query.count(), 1)
+
+  def test_redirect_is_logged(self):
+    self.client.get('/l/missing')
+    request = Request.query.one()
+    self.assertEqual(request.route, 'missing')
+    self.assertFalse(request.is_hit)
+
+
+if __name__ == "__main__":
+  main()
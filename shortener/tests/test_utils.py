@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+from unittest import TestCase, main
+
+from flask_login import login_user
+
+from app import db, create_app
+from app.links import rollups
+from app.links.tracking import request_logger
+from app.links.utils import get_dashboard_data, get_link_data
+from app.models import Link, Request, RequestRollup, RequestTotal, User
+
+app = create_app(environment='testing')
+app.config['SECRET_KEY'] = 'testing'
+
+
+class TestLinkData(TestCase):
+  def setUp(self):
+    self.app_ctx = app.app_context()
+    self.app_ctx.push()
+    db.create_all()
+    self.link = Link(link='abcdef', redirect='https://example.com').save()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def add_requests(self, count, browser, version=None):
+    now = datetime.now()
+    for _ in range(count):
+      db.session.add(Request(
+        link_id=self.link.id, route='abcdef', is_hit=True, start=now,
+        end=now, browser=browser, browser_version=version))
+    db.session.commit()
+
+  def test_no_requests(self):
+    self.assertIsNone(get_link_data(self.link.id))
+
+  def test_browser_breakdown(self):
+    self.add_requests(6, 'chrome', 120)
+    self.add_requests(2, 'chrome', 119)
+    self.add_requests(1, 'firefox', 115)
+    self.add_requests(1, 'safari')
+    self.add_requests(3, None)
+
+    data = get_link_data(self.link.id, limit=2)
+    self.assertEqual(data['browser']['labels'], ('Chrome', 'Firefox', 'Other'))
+    self.assertEqual(data['browser']['values'], (80.0, 10.0, 10.0))
+    self.assertEqual(data['version']['labels'], ('Chrome 120', 'Chrome 119'))
+    self.assertEqual(data['version']['values'], (60.0, 20.0))
+
+
+class TestRollups(TestCase):
+  def setUp(self):
+    self.app_ctx = app.test_request_context()
+    self.app_ctx.push()
+    db.create_all()
+    self.user = User(username='alice', email='alice@example.com',
+                     password='password').save()
+    self.link = Link(link='abcdef', redirect='https://example.com',
+                     user_id=self.user.id).save()
+    login_user(self.user)
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.app_ctx.pop()
+
+  def log(self, link_id=None, is_bot=False, end=None):
+    end = end or datetime.now()
+    request_logger.log(Request(
+      link_id=link_id, route='abcdef', is_hit=link_id is not None,
+      is_bot=is_bot, start=end, end=end).to_record())
+
+  def test_rollups_are_maintained(self):
+    self.log(self.link.id)
+    self.log(self.link.id, is_bot=True)
+    self.log()
+
+    day = RequestRollup.query.filter_by(
+      granularity=RequestRollup.DAY, link_id=self.link.id).one()
+    self.assertEqual((day.hits, day.misses, day.bots), (2, 0, 1))
+    self.assertEqual(RequestRollup.query.count(), 4)
+
+    data = get_dashboard_data()
+    self.assertEqual(data['requests']['values'], (2,))
+    self.assertEqual(data['hits']['hits'], [2])
+    self.assertEqual(data['hits']['misses'], [1])
+    self.assertEqual(data['hits']['bots'], [1])
+
+    data = get_link_data(self.link.id)
+    self.assertEqual(data['requests']['values'], (2,))
+
+    db.session.refresh(self.link)
+    self.assertEqual(self.link.total_hits, 2)
+    self.assertIsNotNone(self.link.last_hit_at)
+    self.assertEqual(self.link.hits_today(), 2)
+
+  def test_rebuild_matches_incremental(self):
+    for _ in range(3):
+      self.log(self.link.id)
+    self.log()
+
+    before = get_dashboard_data()
+    self.assertEqual(rollups.rebuild(), 4)
+    self.assertEqual(get_dashboard_data(), before)
+
+    db.session.refresh(self.link)
+    self.assertEqual(self.link.total_hits, 3)
+
+  def test_closed_weeks_are_stored(self):
+    past = datetime.now() - timedelta(weeks=2)
+    week = RequestRollup.truncate(past, RequestRollup.WEEK)
+    self.log(self.link.id, end=past)
+    self.log(end=past)
+    self.log(self.link.id)
+
+    data = get_dashboard_data()
+    self.assertEqual(data['hits']['labels'][0], week.strftime('Week %W, %Y'))
+    self.assertEqual(data['hits']['hits'], [1, 1])
+    self.assertEqual(data['hits']['misses'], [1, 0])
+
+    total = RequestTotal.query.filter_by(
+      granularity=RequestRollup.WEEK, bucket_start=week).one()
+    self.assertEqual((total.hits, total.misses), (1, 1))
+
+    # Closed weeks are read from their stored totals, rather than the
+    # rollups, until the rollups are rebuilt.
+    self.log(self.link.id, end=past)
+    self.assertEqual(get_dashboard_data()['hits']['hits'], [1, 1])
+
+    rollups.rebuild()
+    self.assertEqual(get_dashboard_data()['hits']['hits'], [2, 1])
+    total = db.session.query(RequestTotal.hits).filter_by(
+      granularity=RequestRollup.WEEK, bucket_start=week).scalar()
+    self.assertEqual(total, 2)
+
+  def test_open_week_combines_stored_and_live_days(self):
+    now = datetime(2024, 1, 10, 12)
+    self.log(self.link.id, end=datetime(2024, 1, 8, 9))
+    self.log(self.link.id, end=datetime(2024, 1, 10, 9))
+
+    week = datetime(2024, 1, 8)
+    totals = rollups.totals(RequestRollup.WEEK, [week], now)
+    self.assertEqual(totals[week], [2, 0, 0])
+
+    stored = RequestTotal.query.filter_by(granularity=RequestRollup.DAY).all()
+    self.assertEqual(
+      sorted(total.bucket_start.day for total in stored), [8, 9])
+
+
+if __name__ == "__main__":
+  main()
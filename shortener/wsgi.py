@@ -1,9 +1,17 @@
 #!/user/bin/env python
 import click
+import time
+from datetime import datetime, timedelta
 
-from app import create_app, db, models, forms
+from app import create_app, db, models, forms, schema
+from app.links import (
+    bulk, export, partitions, redirects, rollups, sketches, snapshot
+)
+from app.links.expiration import expiration_sweeper
+from app.settings.models import Setting, Type
 
 app = create_app()
+redirects.mount(app)
 
 
 @app.shell_context_processor
@@ -16,6 +24,193 @@ def get_context():
 def create_db():
     """Create the configured database."""
     db.create_all()
+    partitions.partition()
+
+
+@app.cli.command()
+def upgrade_db():
+    """Add any missing tables, columns and indexes to the database."""
+    for change in schema.upgrade() + partitions.partition():
+        print(change)
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=1000, show_default=True)
+def backfill_user_agents(chunk_size: int):
+    """Convert pickled user agents into the structured request columns."""
+    total = 0
+    for count in schema.backfill_user_agents(chunk_size):
+        total += count
+        print(f'Converted { total } requests')
+
+
+@app.cli.command()
+@click.option('--since', type=click.DateTime(),
+              help='Only rebuild buckets from this date onwards.')
+def rebuild_rollups(since):
+    """Recompute the request rollups and visitor sketches."""
+    count = rollups.rebuild(since)
+    print(f'Wrote { count } rollups')
+    count = sketches.rebuild(since)
+    print(f'Wrote { count } visitor sketches')
+
+
+@app.cli.command()
+@click.option('--path', help='Defaults to ROUTE_SNAPSHOT_PATH.')
+@click.option('--interval', type=float,
+              help='Keep rebuilding the snapshot, every so many seconds.')
+def build_route_snapshot(path, interval):
+    """Write every active link to the memory-mapped route snapshot."""
+    path = path or app.config.get('ROUTE_SNAPSHOT_PATH')
+    if not path:
+        raise click.UsageError(
+            'No path was given, and ROUTE_SNAPSHOT_PATH is not set.')
+
+    while True:
+        start = time.perf_counter()
+        result = snapshot.build(path)
+        print(f'Wrote { result["routes"] } routes ({ result["bytes"] } bytes, '
+              f'generation { result["generation"] }) to { path } in '
+              f'{ time.perf_counter() - start:.2f}s')
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@app.cli.command()
+def expire_links():
+    """Deactivate every link that has expired."""
+    routes = expiration_sweeper.sweep()
+    print(f'Deactivated { len(routes) } expired links')
+
+
+@app.cli.command()
+@click.option('--username', help='The user to run the dashboard queries as.')
+@click.option('--route', help='The route looked up by the redirect query.')
+@click.option('--fail-on-seq-scan', is_flag=True,
+              help='Exit with an error if any query performs a full scan.')
+def explain_hot_queries(username: str, route: str, fail_on_seq_scan: bool):
+    """EXPLAIN the queries behind the redirect, dashboard and link pages."""
+    user = models.User.query.filter_by(username=username).first() \
+        if username else models.User.query.first()
+    link = models.Link.query.filter_by(link=route).first() \
+        if route else models.Link.query.first()
+    if user is None:
+        raise click.ClickException('A user is required to explain queries.')
+
+    sequential = False
+    results = schema.explain_hot_queries(
+        user, route or 'missing', link.id if link else 0)
+    for name, statement, plan, is_sequential in results:
+        sequential = sequential or is_sequential
+        flag = ' [SEQUENTIAL SCAN]' if is_sequential else ''
+        print(f'== { name }{ flag }\n{ statement }')
+        for line in plan:
+            print(f'  { line }')
+        print()
+
+    if sequential and fail_on_seq_scan:
+        raise click.ClickException('A hot query performs a sequential scan.')
+
+
+@app.cli.command()
+@click.option('--months-ahead', default=3, show_default=True)
+def partition_requests(months_ahead: int):
+    """Partition requests by month, creating partitions for coming months."""
+    for change in partitions.partition(months_ahead):
+        print(change)
+
+
+@app.cli.command()
+@click.option('--older-than', type=int,
+              help='Age in days. Defaults to the retention setting.')
+@click.option('--archive', type=click.Path(file_okay=False),
+              help='Directory to archive pruned requests to.')
+def prune_requests(older_than: int, archive: str):
+    """Remove (and optionally archive) requests past their retention."""
+    if older_than is None:
+        older_than = Setting.value_by_key(Setting.REQUEST_RETENTION_DAYS)
+    if older_than is None:
+        raise click.ClickException(
+            f'Pass --older-than or set { Setting.REQUEST_RETENTION_DAYS }.')
+
+    cutoff = datetime.now() - timedelta(days=older_than)
+    for name, count in partitions.prune(cutoff, archive):
+        print(f'Pruned { name }' + ('' if count is None else f' ({ count })'))
+
+
+@app.cli.command()
+@click.argument('key')
+@click.argument('value')
+@click.option('--type', 'value_type', default='string', show_default=True,
+              type=click.Choice([value.name.lower() for value in Type]))
+def set_setting(key: str, value: str, value_type: str):
+    """Create or update a setting, such as requests.retention_days."""
+    Setting.set_value(key, value, Type[value_type.upper()])
+
+
+@app.cli.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']),
+              help='Defaults to the format given by the file extension.')
+@click.option('--username', help='The user that will own the links.')
+@click.option('--batch-size', type=int,
+              help='Defaults to LINK_IMPORT_BATCH_SIZE.')
+def import_links(path: str, format: str, username: str, batch_size: int):
+    """Create links from a CSV or JSON lines file."""
+    format = format or bulk.detect_format(path)
+    if format is None:
+        raise click.ClickException('Pass --format for this file extension.')
+
+    user_id = None
+    if username:
+        user = models.User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(
+                f'The user { username } does not exist.')
+        user_id = user.id
+
+    batch_size = batch_size or app.config['LINK_IMPORT_BATCH_SIZE']
+    created = failed = 0
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = bulk.read_rows(file, format)
+        for count, errors in bulk.import_links(rows, user_id, batch_size):
+            created += count
+            failed += len(errors)
+            for number, error in errors:
+                print(f'Line { number }: { error }')
+            print(f'Imported { created } links')
+
+    if failed:
+        raise click.ClickException(f'{ failed } rows were not imported.')
+
+
+@app.cli.command()
+@click.option('--route', multiple=True,
+              help='Only export requests to this link. May be repeated.')
+@click.option('--since', type=click.DateTime(),
+              help='Only export requests that ended from this date.')
+@click.option('--until', type=click.DateTime(),
+              help='Only export requests that ended before this date.')
+@click.option('--format', default='csv', show_default=True,
+              type=click.Choice(list(export.FORMATS)))
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', type=click.File('wb'), default='-',
+              help='The file to write to. Defaults to standard output.')
+def export_requests(route, since, until, format: str, compress: bool,
+                    output):
+    """Stream recorded requests as CSV or JSON lines."""
+    link_ids = None
+    if route:
+        link_ids = [
+            id for id, in models.Link.query
+            .filter(models.Link.link.in_(route))
+            .with_entities(models.Link.id)
+        ]
+
+    query = export.select(link_ids, since, until)
+    for chunk in export.export(query, format, compress):
+        output.write(chunk)
 
 
 @app.cli.command()